@@ -40,7 +40,16 @@ def create_bigquery_table(request) -> Dict[str, Any]:
     client = bigquery.Client.from_service_account_info(service_account_info)
 
     valid_table_types = ["clean_news_data", "clean_stock_data",
-                         "raw_news_data", "raw_news_meta_data", "raw_stock_data"]
+                         "raw_news_data", "raw_news_meta_data", "raw_stock_data",
+                         "raw_news_articles", "raw_news_data_compact",
+                         "raw_stock_data_compact", "news_backfill_checkpoints",
+                         "news_watermarks", "intraday_stock_data",
+                         "clean_intraday_stock_data", "stock_shard_leases",
+                         "news_transform_watermarks", "intraday_clean_watermarks"]
+
+    # Tabeller som delas upp per dag på en tidskolumn
+    time_partitioning = None
+    clustering_fields = None
 
     if table_type.lower() == valid_table_types[0]:
         schema = [
@@ -72,22 +81,138 @@ def create_bigquery_table(request) -> Dict[str, Any]:
             bigquery.SchemaField("company", "STRING", mode="NULLABLE"),
             bigquery.SchemaField("unique_id", "STRING", mode="NULLABLE"),
         ]
+        # clean_news i läget 'watermark' läser bara dagarna efter vattenmärket
+        time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY, field="fetch_date")
     elif table_type.lower() == valid_table_types[3]:
         schema = [
             bigquery.SchemaField("unique_id", "STRING", mode="REQUIRED"),
             bigquery.SchemaField("is_processed", "BOOLEAN", mode="REQUIRED"),
         ]
+        # Obearbetade rader och enskilda ID:n hittas utan att läsa hela tabellen.
+        # Befintliga tabeller: bq update --clustering_fields=is_processed,unique_id
+        clustering_fields = ["is_processed", "unique_id"]
     elif table_type.lower() == valid_table_types[4]:
         schema = [
             bigquery.SchemaField("stock_symbol", "STRING", mode="NULLABLE"),
             bigquery.SchemaField("raw_data", "JSON", mode="NULLABLE"),
             bigquery.SchemaField("fetch_date", "TIMESTAMP", mode="NULLABLE"),
         ]
+    elif table_type.lower() == valid_table_types[5]:
+        # En rad per artikel, så att läsningar bara behöver hämta de kolumner de använder
+        schema = [
+            bigquery.SchemaField("unique_id", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("response_id", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("company", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("fetch_date", "TIMESTAMP", mode="NULLABLE"),
+            bigquery.SchemaField("source_id", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("source_name", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("author", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("title", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("description", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("url", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("url_to_image", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("published_at", "TIMESTAMP", mode="NULLABLE"),
+            bigquery.SchemaField("content", "STRING", mode="NULLABLE"),
+        ]
+        time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY, field="fetch_date")
+    elif table_type.lower() == valid_table_types[6]:
+        # Som raw_news_data men med zlib-komprimerad payload
+        schema = [
+            bigquery.SchemaField("data_z", "BYTES", mode="NULLABLE"),
+            bigquery.SchemaField("encoding", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("fetch_date", "TIMESTAMP", mode="NULLABLE"),
+            bigquery.SchemaField("company", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("unique_id", "STRING", mode="NULLABLE"),
+        ]
+        time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY, field="fetch_date")
+    elif table_type.lower() == valid_table_types[7]:
+        # Komprimerad payload, med encoding 'zlib+delta' bara dagarna sedan förra raden
+        schema = [
+            bigquery.SchemaField("stock_symbol", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("raw_data_z", "BYTES", mode="NULLABLE"),
+            bigquery.SchemaField("encoding", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("latest_date", "DATE", mode="NULLABLE"),
+            bigquery.SchemaField("fetch_date", "TIMESTAMP", mode="NULLABLE"),
+        ]
+    elif table_type.lower() == valid_table_types[8]:
+        # En rad per klar eller misslyckad arbetsenhet i fetch_news/backfill.py
+        schema = [
+            bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("company", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("from_date", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("to_date", "DATE", mode="REQUIRED"),
+            bigquery.SchemaField("status", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("articles", "INTEGER", mode="NULLABLE"),
+            bigquery.SchemaField("error", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+    elif table_type.lower() == valid_table_types[9]:
+        # Senast sedda publishedAt per företag, för inkrementell hämtning
+        schema = [
+            bigquery.SchemaField("company", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("last_published_at", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
+        ]
+    elif table_type.lower() in (valid_table_types[10], valid_table_types[11]):
+        # Intradagsstaplar, partitionerade per dag så att läsningar bara rör nya dagar
+        schema = [
+            bigquery.SchemaField("stock_symbol", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("interval", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("open", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("high", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("low", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("close", "FLOAT", mode="NULLABLE"),
+            bigquery.SchemaField("volume", "INTEGER", mode="NULLABLE"),
+        ]
+        if table_type.lower() == valid_table_types[10]:
+            schema.append(bigquery.SchemaField("fetch_date", "TIMESTAMP", mode="NULLABLE"))
+        time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY, field="timestamp")
+        clustering_fields = ["stock_symbol", "interval"]
+    elif table_type.lower() == valid_table_types[12]:
+        # En rad per shard och körning, se shared/shard_leases.py
+        schema = [
+            bigquery.SchemaField("job", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("run_key", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("shard_count", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("shard", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("status", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("owner", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("lease_until", "TIMESTAMP", mode="NULLABLE"),
+            bigquery.SchemaField("attempts", "INTEGER", mode="NULLABLE"),
+            bigquery.SchemaField("symbols", "INTEGER", mode="NULLABLE"),
+            bigquery.SchemaField("error", "STRING", mode="NULLABLE"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
+        ]
+        clustering_fields = ["job", "run_key"]
+    elif table_type.lower() == valid_table_types[13]:
+        # Senast bearbetade fetch_date per rå nyhetstabell, se clean_news i
+        # transform_news_2
+        schema = [
+            bigquery.SchemaField("source_table", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("last_fetch_date", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
+        ]
+    elif table_type.lower() == valid_table_types[14]:
+        # Senast rensade intradagsstapel per aktie och intervall, se
+        # clean_intraday_data i transform_stocks
+        schema = [
+            bigquery.SchemaField("stock_symbol", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("interval", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("last_timestamp", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE"),
+        ]
     else:
         return {"error": f"Invalid table_type '{table_type}'"}, 400
 
     table_id = f"{project_id}.{dataset_id}.{table_name}"
     table = bigquery.Table(table_id, schema=schema)
+    table.time_partitioning = time_partitioning
+    table.clustering_fields = clustering_fields
 
     try:
         client.get_table(table_id)
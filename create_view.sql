@@ -43,29 +43,10 @@ avg_scores AS (
     unique_news
   GROUP BY 
     company, DATE(pub_date)
-),
-
--- CTE för att välja unika rader baserat på stock_symbol och date
-unique_stocks AS (
-  SELECT 
-    stock_symbol, 
-    date,  -- Använd original date-kolumnen utan omvandling
-    open, 
-    high, 
-    low, 
-    close, 
-    volume
-  FROM (
-    SELECT 
-      *, 
-      ROW_NUMBER() OVER (PARTITION BY stock_symbol, date) AS row_num
-    FROM 
-      `tomastestproject-433206.testdb_1.clean_stock_data`
-  )
-  WHERE row_num = 1
 )
 
--- Joina avg_scores med unique_stocks på pub_date och company
+-- Joina avg_scores med aktiedata på pub_date och company.
+-- clean_stock_data skrivs med MERGE på (stock_symbol, date) och har inga dubletter
 SELECT 
   a.avg_score_description, 
   a.avg_score_title, 
@@ -77,7 +58,7 @@ SELECT
   b.close, 
   b.volume
 FROM 
-  unique_stocks b
+  `tomastestproject-433206.testdb_1.clean_stock_data` b
 RIGHT JOIN 
   avg_scores a
 ON 
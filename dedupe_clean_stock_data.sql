@@ -0,0 +1,21 @@
+-- Engångsstädning innan create_view.sql körs utan ROW_NUMBER() för aktiedata.
+-- clean_stocks skriver numera med MERGE på (stock_symbol, date), så nya
+-- dubletter uppstår inte. Gamla dubletter tas bort här. De är normalt
+-- identiska; skiljer de sig behålls raden med högst volym.
+CREATE OR REPLACE TABLE `tomastestproject-433206.testdb_1.clean_stock_data` AS
+SELECT
+  stock_symbol,
+  date,
+  open,
+  high,
+  low,
+  close,
+  volume
+FROM
+  `tomastestproject-433206.testdb_1.clean_stock_data`
+WHERE
+  stock_symbol IS NOT NULL AND date IS NOT NULL
+QUALIFY ROW_NUMBER() OVER (
+  PARTITION BY stock_symbol, date
+  ORDER BY volume DESC
+) = 1;
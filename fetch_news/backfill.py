@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+import httpx
+from google.cloud import bigquery
+from fetch_raw_data import iter_news_chunks_async, save_news_to_big_query
+from shared.gcp import get_project_id, get_secret
+from shared.rate_limit import QuotaExhaustedError
+
+# Tabell av typen news_backfill_checkpoints i create_table/main.py
+CHECKPOINT_TABLE = 'news_backfill_checkpoints'
+
+UNIT_DAYS = {'day': 1, 'week': 7}
+
+# Status för en arbetsenhet i checkpoint-tabellen
+STATUS_DONE = 'done'
+STATUS_EMPTY = 'empty'
+STATUS_FAILED = 'failed'
+# Några sidor är sparade men inte alla. Enheten hämtas om från början.
+STATUS_PARTIAL = 'partial'
+
+# Pågående och avslutade körningar i den här instansen, för statusendpointen
+_runs = {}
+
+
+def split_date_range(from_date: str, to_date: str,
+                     unit: str = 'day') -> List[Tuple[str, str]]:
+    """
+    Delar upp ett datumintervall i arbetsenheter om en dag eller en vecka.
+
+    Args:
+        from_date (str): Första dagen (format 'YYYY-MM-DD').
+        to_date (str): Sista dagen, inklusive (format 'YYYY-MM-DD').
+        unit (str): 'day' eller 'week'.
+
+    Returns:
+        list: (from_date, to_date) per enhet. Sista enheten kan vara kortare.
+    """
+    if unit not in UNIT_DAYS:
+        raise ValueError(f"Invalid unit '{unit}', expected one of {list(UNIT_DAYS)}")
+
+    start = datetime.strptime(from_date, '%Y-%m-%d').date()
+    end = datetime.strptime(to_date, '%Y-%m-%d').date()
+    if end < start:
+        raise ValueError("to_date must not be before from_date")
+
+    step = timedelta(days=UNIT_DAYS[unit])
+    units = []
+    while start <= end:
+        unit_end = min(start + step - timedelta(days=1), end)
+        units.append((start.isoformat(), unit_end.isoformat()))
+        start = unit_end + timedelta(days=1)
+    return units
+
+
+def backfill_run_id(companies: List[str], from_date: str, to_date: str,
+                    unit: str, table_name: str) -> str:
+    """
+    Ger samma id för samma backfill, så att en omstart fortsätter där den
+    förra körningen slutade i stället för att börja om.
+    """
+    key = '|'.join([','.join(sorted(set(companies))), from_date, to_date,
+                    unit, table_name])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def checkpoint_table_id(table: str = CHECKPOINT_TABLE) -> str:
+    return f"{get_project_id()}.{get_secret('dataset')}.{table}"
+
+
+def load_finished_units(client: bigquery.Client, table_id: str,
+                        run_id: str) -> set:
+    """
+    Hämtar de enheter som redan är klara för en körning.
+
+    Returns:
+        set: (company, from_date) för enheter med status 'done' eller 'empty'.
+    """
+    query = f"""
+        SELECT DISTINCT company, FORMAT_DATE('%Y-%m-%d', from_date) AS from_date
+        FROM `{table_id}`
+        WHERE run_id = @run_id AND status IN ('{STATUS_DONE}', '{STATUS_EMPTY}')
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("run_id", "STRING", run_id)
+        ]
+    )
+    return {(row.company, row.from_date)
+            for row in client.query(query, job_config=job_config).result()}
+
+
+def save_checkpoint(client: bigquery.Client, table_id: str, run_id: str,
+                    company: str, unit: Tuple[str, str], status: str,
+                    articles: int = 0, error: Optional[str] = None):
+    """Sparar utfallet för en arbetsenhet i checkpoint-tabellen."""
+    row = {
+        "run_id": run_id,
+        "company": company,
+        "from_date": unit[0],
+        "to_date": unit[1],
+        "status": status,
+        "articles": articles,
+        "error": error,
+        "updated_at": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    errors = client.insert_rows_json(table_id, [row])
+    if errors:
+        raise RuntimeError(f"Failed to insert checkpoint: {errors}")
+
+
+class BackfillProgress:
+    """Räknare för en körning, med genomströmning och antal enheter kvar."""
+
+    def __init__(self, run_id: str, units_total: int, units_skipped: int):
+        self.run_id = run_id
+        self.units_total = units_total
+        self.units_skipped = units_skipped
+        self.units_done = 0
+        self.units_failed = 0
+        self.articles = 0
+        self.stopped_reason = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    def as_dict(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        processed = self.units_done + self.units_failed
+        return {
+            "run_id": self.run_id,
+            "running": self.finished is None,
+            "stopped_reason": self.stopped_reason,
+            "units_total": self.units_total,
+            "units_skipped": self.units_skipped,
+            "units_done": self.units_done,
+            "units_failed": self.units_failed,
+            "units_remaining": (self.units_total - self.units_skipped
+                                - self.units_done),
+            "articles": self.articles,
+            "elapsed_seconds": round(elapsed, 2),
+            "units_per_minute": round(processed / elapsed * 60, 2) if elapsed else 0.0,
+            "articles_per_second": round(self.articles / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+async def run_backfill(http_client: httpx.AsyncClient,
+                       bq_client: bigquery.Client,
+                       api_key: str,
+                       companies: List[str],
+                       from_date: str,
+                       to_date: str,
+                       unit: str = 'day',
+                       table_name: str = 'raw_news',
+                       storage_mode: str = 'blob',
+                       concurrency: int = 4,
+                       run_id: Optional[str] = None,
+                       checkpoint_table: str = CHECKPOINT_TABLE) -> dict:
+    """
+    Hämtar nyheter för flera företag över ett långt datumintervall.
+
+    Intervallet delas i enheter om en dag eller vecka per företag. Högst
+    `concurrency` enheter körs samtidigt och alla anrop går via den delade
+    hastighetsbegränsaren, så körningen håller sig inom kvoten. Varje enhet
+    skrivs till checkpoint-tabellen när den är klar, och enheter som redan
+    är klara hoppas över. En enhet räknas som klar först när alla dess
+    sidor är sparade eller NewsAPI:s resultattak är nått; annars får den
+    status 'partial' eller 'failed' och hämtas igen. En körning som
+    kraschar eller får slut på dygnskvoten fortsätter alltså där den
+    slutade när den startas igen med samma parametrar.
+
+    Args:
+        http_client (httpx.AsyncClient): Delad klient med anslutningspool.
+        bq_client (bigquery.Client): Klient för data och checkpoints.
+        api_key (str): NewsAPI-nyckeln.
+        companies (list): Företag att hämta.
+        from_date (str): Första dagen (format 'YYYY-MM-DD').
+        to_date (str): Sista dagen, inklusive.
+        unit (str): 'day' eller 'week'.
+        table_name (str): Tabell att spara nyheterna i.
+        storage_mode (str): Se `save_news_to_big_query`.
+        concurrency (int): Max antal enheter som hämtas samtidigt.
+        run_id (str): Valfritt id. Standard är ett id byggt på parametrarna.
+        checkpoint_table (str): Tabell av typen news_backfill_checkpoints.
+
+    Returns:
+        dict: Framsteg och genomströmning, se `BackfillProgress.as_dict`.
+    """
+    companies = list(dict.fromkeys(companies))
+    run_id = run_id or backfill_run_id(companies, from_date, to_date, unit,
+                                       table_name)
+    table_id = checkpoint_table_id(checkpoint_table)
+
+    units = [(company, unit_range)
+             for unit_range in split_date_range(from_date, to_date, unit)
+             for company in companies]
+    finished = await asyncio.to_thread(load_finished_units, bq_client,
+                                       table_id, run_id)
+    pending = [(company, unit_range) for company, unit_range in units
+               if (company, unit_range[0]) not in finished]
+
+    progress = BackfillProgress(run_id, len(units), len(units) - len(pending))
+    _runs[run_id] = progress
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def process(company: str, unit_range: Tuple[str, str]):
+        async with semaphore:
+            # Ingen idé att fortsätta när dygnskvoten är slut
+            if progress.stopped_reason is not None:
+                return
+            saved = 0
+            try:
+                # Alla sidor i enheten, en bit i taget
+                async for chunk in iter_news_chunks_async(
+                        client=http_client, company=company, api_key=api_key,
+                        from_date=unit_range[0], to_date=unit_range[1]):
+                    if not chunk['articles']:
+                        continue
+                    await asyncio.to_thread(save_news_to_big_query,
+                                            data=chunk, company=company,
+                                            table=table_name,
+                                            storage_mode=storage_mode,
+                                            client=bq_client)
+                    saved += len(chunk['articles'])
+                    progress.articles += len(chunk['articles'])
+                await asyncio.to_thread(
+                    save_checkpoint, bq_client, table_id, run_id, company,
+                    unit_range, STATUS_DONE if saved else STATUS_EMPTY, saved)
+                progress.units_done += 1
+            except QuotaExhaustedError as e:
+                progress.stopped_reason = f"quota: {e}"
+                if saved:
+                    await _save_unfinished(company, unit_range, saved, e)
+            except Exception as e:
+                print(f"Backfill {run_id}: {company} {unit_range} misslyckades: {e}")
+                progress.units_failed += 1
+                await _save_unfinished(company, unit_range, saved, e)
+
+    async def _save_unfinished(company: str, unit_range: Tuple[str, str],
+                               saved: int, error: Exception):
+        try:
+            await asyncio.to_thread(save_checkpoint, bq_client, table_id,
+                                    run_id, company, unit_range,
+                                    STATUS_PARTIAL if saved else STATUS_FAILED,
+                                    saved, error=str(error)[:1024])
+        except Exception as checkpoint_error:
+            print(f"Kunde inte spara checkpoint: {checkpoint_error}")
+
+    try:
+        await asyncio.gather(*(process(company, unit_range)
+                               for company, unit_range in pending))
+    finally:
+        progress.finished = time.monotonic()
+
+    return progress.as_dict()
+
+
+def get_backfill_status(client: bigquery.Client, run_id: str,
+                        checkpoint_table: str = CHECKPOINT_TABLE) -> dict:
+    """
+    Status för en körning. Körningar i den här instansen har levande
+    räknare; för andra läses det senaste utfallet per enhet från
+    checkpoint-tabellen.
+    """
+    if run_id in _runs:
+        return _runs[run_id].as_dict()
+
+    query = f"""
+        SELECT status, COUNT(*) AS units, SUM(articles) AS articles,
+               MAX(updated_at) AS last_update
+        FROM (
+            SELECT status, articles, updated_at
+            FROM `{checkpoint_table_id(checkpoint_table)}`
+            WHERE run_id = @run_id
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY company, from_date ORDER BY updated_at DESC) = 1
+        )
+        GROUP BY status
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("run_id", "STRING", run_id)
+        ]
+    )
+    status = {"run_id": run_id, "running": False, "units": {}, "articles": 0,
+              "last_update": None}
+    for row in client.query(query, job_config=job_config).result():
+        status["units"][row.status] = row.units
+        status["articles"] += row.articles or 0
+        if row.last_update and (status["last_update"] is None
+                                or row.last_update.isoformat() > status["last_update"]):
+            status["last_update"] = row.last_update.isoformat()
+    return status
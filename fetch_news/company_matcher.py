@@ -0,0 +1,203 @@
+import json
+import os
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# NewsAPI tillåter som mest 500 tecken i q
+NEWS_API_MAX_QUERY_LENGTH = 500
+
+# Tickern är alltid ett alias. Första aliaset efter den (juridiskt namn)
+# används också i sökfrågan, resten bara när artiklarna fördelas.
+DEFAULT_ALIASES = {
+    "AAPL": ["Apple", "Apple Inc", "iPhone", "iPad", "MacBook", "Tim Cook"],
+    "GOOGL": ["Alphabet", "Google", "YouTube", "Sundar Pichai"],
+    "MSFT": ["Microsoft", "Azure", "Xbox", "Satya Nadella"],
+    "AMZN": ["Amazon", "AWS", "Amazon Web Services", "Andy Jassy"],
+    "TSLA": ["Tesla", "Tesla Inc", "Cybertruck"],
+}
+
+# Antal termer per företag i sökfrågan: tickern och det juridiska namnet
+QUERY_TERMS_PER_COMPANY = 2
+
+
+def load_aliases(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Läser aliastabellen från en JSON-fil ({"AAPL": ["Apple", ...]}).
+
+    Args:
+        path (str): Sökväg till filen. Standard är miljövariabeln
+            COMPANY_ALIASES_FILE, och utan den DEFAULT_ALIASES.
+
+    Returns:
+        dict: Företag -> lista med alias.
+    """
+    path = path or os.getenv('COMPANY_ALIASES_FILE')
+    if not path:
+        return dict(DEFAULT_ALIASES)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def aliases_for(companies: Iterable[str],
+                aliases: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+    """Aliastabellen för de valda företagen. Okända företag får bara sig själva."""
+    aliases = DEFAULT_ALIASES if aliases is None else aliases
+    return {company: [company] + [alias for alias in aliases.get(company, [])
+                                  if alias != company]
+            for company in dict.fromkeys(companies)}
+
+
+def _query_term(term: str) -> str:
+    return f'"{term}"' if ' ' in term else term
+
+
+def build_or_queries(company_aliases: Dict[str, List[str]],
+                     max_length: int = NEWS_API_MAX_QUERY_LENGTH
+                     ) -> List[Tuple[str, List[str]]]:
+    """
+    Packar ihop företagen i så få OR-frågor som möjligt.
+
+    Args:
+        company_aliases (dict): Från `aliases_for`.
+        max_length (int): Max antal tecken per fråga.
+
+    Returns:
+        list: (fråga, företag i frågan) per NewsAPI-anrop.
+
+    Raises:
+        ValueError: Om ett enskilt företags termer inte får plats.
+    """
+    queries = []
+    terms = []
+    companies = []
+    length = 0
+    for company, aliases in company_aliases.items():
+        company_terms = [_query_term(term) for term in
+                         list(dict.fromkeys(aliases))[:QUERY_TERMS_PER_COMPANY]]
+        part_length = sum(len(term) for term in company_terms) + \
+            len(' OR ') * (len(company_terms) - 1)
+        if part_length > max_length:
+            raise ValueError(f"Query terms for {company} exceed {max_length} characters")
+
+        added = part_length + (len(' OR ') if terms else 0)
+        if terms and length + added > max_length:
+            queries.append((' OR '.join(terms), companies))
+            terms, companies, length = [], [], 0
+            added = part_length
+        terms.extend(company_terms)
+        companies.append(company)
+        length += added
+
+    if terms:
+        queries.append((' OR '.join(terms), companies))
+    return queries
+
+
+class AhoCorasick:
+    """
+    Hittar alla mönster i en text i ett enda pass, oavsett antal mönster.
+
+    Matchningen är skiftlägesokänslig och bara hela ord räknas, så
+    'Apple' träffar inte 'Pineapple'.
+
+    Args:
+        patterns (dict): Mönster -> värde som ges tillbaka vid träff.
+    """
+
+    def __init__(self, patterns: Dict[str, str]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # (mönsterlängd, värde) per tillstånd
+
+        for pattern, value in patterns.items():
+            pattern = pattern.lower()
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append((len(pattern), value))
+
+        # Bredden först, så att fail-länken för föräldern alltid är klar
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + \
+                    self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> set:
+        """Värdena för alla mönster som förekommer som hela ord i `text`."""
+        found = set()
+        if not text:
+            return found
+        text = text.lower()
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._output[state]:
+                start = end - length + 1
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (end + 1 == len(text) or not text[end + 1].isalnum()):
+                    found.add(value)
+        return found
+
+
+class CompanyMatcher:
+    """
+    Fördelar artiklar på de företag de nämner.
+
+    Titel och beskrivning söks igenom först. Träffar de inget används
+    artikelns innehåll, eftersom NewsAPI även söker där.
+
+    Args:
+        company_aliases (dict): Från `aliases_for`.
+    """
+
+    def __init__(self, company_aliases: Dict[str, List[str]]):
+        patterns = {}
+        for company, aliases in company_aliases.items():
+            for alias in aliases:
+                # Ett alias som delas av flera företag ger alla företagen
+                patterns.setdefault(alias.lower(), set()).add(company)
+        self._automaton = AhoCorasick({pattern: frozenset(companies)
+                                       for pattern, companies in patterns.items()})
+
+    def match(self, article: dict) -> List[str]:
+        """Företagen som artikeln nämner, sorterade."""
+        text = ' \n '.join(filter(None, [article.get('title'),
+                                          article.get('description')]))
+        found = self._automaton.find(text)
+        if not found:
+            found = self._automaton.find(article.get('content') or '')
+        return sorted(set().union(*found)) if found else []
+
+    def route(self, articles: List[dict]) -> Tuple[Dict[str, List[dict]], int]:
+        """
+        Grupperar artiklarna per företag. En artikel som nämner flera
+        företag hamnar hos alla.
+
+        Returns:
+            tuple: (företag -> artiklar, antal artiklar utan något företag)
+        """
+        routed = {}
+        unmatched = 0
+        for article in articles:
+            companies = self.match(article)
+            if not companies:
+                unmatched += 1
+            for company in companies:
+                routed.setdefault(company, []).append(article)
+        return routed, unmatched
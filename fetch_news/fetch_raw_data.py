@@ -1,53 +1,98 @@
 from google.api_core.exceptions import GoogleAPIError, NotFound
+from typing import AsyncIterator, Iterator, List, Optional
 import requests
+import httpx
 from google.cloud import bigquery
 from datetime import datetime
 import json
-from google.cloud import secretmanager
 import uuid
-from google.auth import default
-import os
+from shared.gcp import get_bigquery_client, get_project_id, get_secret
+from shared.http_cache import cache_key, get_response_cache
+from shared.payload_codec import ENCODING_ZLIB, encode_payload
+from shared.rate_limit import (QuotaExhaustedError, RateLimitError,
+                               call_with_retry, call_with_retry_async,
+                               get_rate_limiter)
 
-def get_project_id():
-    """Retrieve project ID either from environment or default credentials."""
-    # First, check if the GOOGLE_CLOUD_PROJECT env var is set
-    project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
-    
-    if not project_id:
-        # If not set, retrieve the project ID from default credentials
-        _, project_id = default()
-    
-    return project_id
 
-def get_secret(secret_name='bigquery-accout-secret') -> str:
-    """Fetches a secret from Google Cloud Secret Manager.
+class NewsApiError(ValueError):
+    """Fel som NewsAPI rapporterar i svaret, med API:ts felkod i `code`."""
 
-    Args:
-        secret_name (str): The name of the secret in Secret Manager.
+    def __init__(self, message: str, code: Optional[str] = None):
+        super().__init__(message)
+        self.code = code
 
-    Returns:
-        str: The secret data as a string.
-    """
-    # Instansiera en klient för Secret Manager
-    client = secretmanager.SecretManagerServiceClient()
 
-    # Bygg sökvägen till den hemlighet du vill hämta
-    project_id = get_project_id()  # Ersätt med ditt projekt-ID
-    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+class NewsApiRateLimitError(NewsApiError, RateLimitError):
+    """NewsAPI har begränsat oss tillfälligt. Anropet kan försökas igen."""
+
+    def __init__(self, message: str, code: Optional[str] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message, code=code)
+        self.retry_after = retry_after
+
+
+class NewsApiQuotaError(NewsApiRateLimitError, QuotaExhaustedError):
+    """Nyckelns dygnskvot är slut. Ingen idé att försöka igen i dag."""
+
+
+# NewsAPI:s felkoder för kvotfel. `rateLimited` går över om en stund,
+# `apiKeyExhausted` betyder att nyckelns kvot för perioden är slut.
+CODE_RATE_LIMITED = 'rateLimited'
+CODE_KEY_EXHAUSTED = 'apiKeyExhausted'
+
+
+def _raise_for_rate_limit(status_code: int, data: dict, headers=None):
+    """Gör om NewsAPI:s kvotfel till fel som hastighetsbegränsaren förstår."""
+    code = data.get('code')
+    if status_code != 429 and code not in (CODE_RATE_LIMITED, CODE_KEY_EXHAUSTED):
+        return
+
+    message = f"API Error: {data.get('message', 'Rate limited')}"
+    if code == CODE_KEY_EXHAUSTED:
+        raise NewsApiQuotaError(message, code=code)
+
+    retry_after = (headers or {}).get('Retry-After')
+    raise NewsApiRateLimitError(
+        message, code=code,
+        retry_after=float(retry_after) if retry_after else None)
+
+
+def _json_or_empty(response) -> dict:
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
+# NewsAPI tillåter som mest 100 artiklar per sida
+NEWS_API_MAX_PAGE_SIZE = 100
+
+NEWS_API_URL = 'https://newsapi.org/v2/everything'
 
-    # Hämta den senaste versionen av hemligheten
-    response = client.access_secret_version(name=secret_path)
 
-    # Dekoda hemligheten till en sträng
-    secret_data = response.payload.data.decode('UTF-8')
+def _news_params(company: str, from_date: str, to_date: str, sort_by: str,
+                 language: str, page: Optional[int] = None, page_size: Optional[int] = None) -> dict:
+    """
+    Frågeparametrar för /v2/everything. De skickas som `params` så att
+    klienten URL-kodar dem; en OR-fråga med citattecken eller alias som
+    "AT&T" skulle annars delas upp eller ändras i URL:en.
+    """
+    params = {'q': company, 'from': from_date, 'to': to_date,
+              'sortBy': sort_by, 'language': language}
+    if page is not None:
+        params['page'] = page
+    if page_size is not None:
+        params['pageSize'] = page_size
+    return params
 
-    return secret_data
 
 def fetch_news(company: str, api_key: str,
                from_date: str,
                to_date: str,
              sort_by: str = 'relevance',
-             language: str = 'en') -> dict:
+             language: str = 'en',
+             page: Optional[int] = None,
+             page_size: Optional[int] = None) -> dict:
     """
     Hämtar nyhetsdata för ett specifikt företag från NewsAPI.
     
@@ -58,25 +103,36 @@ def fetch_news(company: str, api_key: str,
         to_date (str): Slutdatum för sökningen (format 'YYYY-MM-DD')
         sort_by (str): Sorteringskriterium (t.ex. 'relevance'). Standard är 'relevance'.
         language (str): Språk för nyheterna. Standard är 'en'.
+        page (int): Sidnummer att hämta. Utelämnas som standard (första sidan).
+        page_size (int): Antal artiklar per sida, max 100.
     
     Returns:
         dict: JSON-svar från NewsAPI om anropet lyckas.
     
     Raises:
-        ValueError: Om API-svaret innehåller ett felmeddelande.
+        NewsApiRateLimitError: Om NewsAPI begränsar anropen (HTTP 429).
+        NewsApiError: Om API-svaret innehåller ett felmeddelande.
         requests.exceptions.RequestException: Om nätverksfel eller anslutningsfel uppstår.
     """
-    url = f'https://newsapi.org/v2/everything?q={company}&from={from_date}&to={to_date}&sortBy={sort_by}&language={language}&apiKey={api_key}'
+    params = _news_params(company, from_date, to_date, sort_by, language,
+                          page, page_size)
+    params['apiKey'] = api_key
 
     try:
-        response = requests.get(url=url)
+        response = requests.get(url=NEWS_API_URL, params=params)
+        if not response.ok:
+            # Kvotfel kommer med olika statuskoder, felkoden i svaret avgör
+            _raise_for_rate_limit(response.status_code, _json_or_empty(response),
+                                  response.headers)
         response.raise_for_status()  # Kontrollera för HTTP-fel
         data = response.json()
 
         # Kontrollera om API-anropet innehåller fel
         if data.get("status") != "ok":
-            raise ValueError(
-                f"API Error: {data.get('message', 'Unknown error')}")
+            _raise_for_rate_limit(response.status_code, data)
+            raise NewsApiError(
+                f"API Error: {data.get('message', 'Unknown error')}",
+                code=data.get('code'))
 
         return data
 
@@ -89,12 +145,290 @@ def fetch_news(company: str, api_key: str,
         raise
 
 
+def news_cache_key(company: str, from_date: str, to_date: str,
+                   sort_by: str = 'relevance', language: str = 'en',
+                   page: Optional[int] = None, page_size: Optional[int] = None) -> str:
+    """Nyckel i svarscachen för ett NewsAPI-anrop. API-nyckeln ingår inte."""
+    return cache_key('newsapi', {'q': company, 'from': from_date,
+                                 'to': to_date, 'sortBy': sort_by,
+                                 'language': language, 'page': page,
+                                 'pageSize': page_size})
+
+
+def fetch_news_with_retry(company: str, api_key: str,
+                          from_date: str,
+                          to_date: str,
+                          **kwargs) -> dict:
+    """
+    Som `fetch_news`, men går via den delade hastighetsbegränsaren för
+    API-nyckeln. Anropet köas tills kvoten tillåter det och försöks igen med
+    exponentiell backoff om NewsAPI ändå svarar att vi är begränsade.
+
+    Svaret går också via svarscachen (HTTP_CACHE_MODE), så en träff varken
+    går ut på nätet eller förbrukar kvot.
+    """
+    key = news_cache_key(company, from_date, to_date, **kwargs)
+    return get_response_cache('newsapi').fetch(
+        key, call_with_retry, fetch_news,
+        limiter=get_rate_limiter('newsapi', api_key),
+        company=company, api_key=api_key,
+        from_date=from_date, to_date=to_date, **kwargs)
+
+
+async def fetch_news_async_with_retry(client: httpx.AsyncClient,
+                                      company: str, api_key: str,
+                                      from_date: str,
+                                      to_date: str,
+                                      **kwargs) -> dict:
+    """Asynkron variant av `fetch_news_with_retry`."""
+    key = news_cache_key(company, from_date, to_date, **kwargs)
+    return await get_response_cache('newsapi').fetch_async(
+        key, call_with_retry_async, fetch_news_async,
+        limiter=get_rate_limiter('newsapi', api_key),
+        client=client, company=company,
+        api_key=api_key, from_date=from_date,
+        to_date=to_date, **kwargs)
+
+
+def _news_api_error_code(error: requests.exceptions.HTTPError) -> str:
+    """Läser ut NewsAPI:s felkod ur ett HTTP-fel, om svaret innehåller en."""
+    try:
+        return error.response.json().get('code')
+    except (AttributeError, ValueError):
+        return None
+
+
+def _is_result_cap(error: Exception) -> bool:
+    """Sant om felet betyder att planens tak för antal resultat är nått."""
+    if isinstance(error, NewsApiError):
+        return error.code == 'maximumResultsReached'
+    return _news_api_error_code(error) == 'maximumResultsReached'
+
+
+class _NewsPager:
+    """
+    Sidräkning och buffring för en genomgång av alla sidor i ett svar.
+
+    Delas av `iter_news_chunks` och `iter_news_chunks_async`, som bara står
+    för själva anropet. Genomgången tar slut när alla `totalResults` är
+    lästa, en sida är kortare än `page_size`, `max_pages` är nådd eller
+    NewsAPI svarar `maximumResultsReached`.
+    """
+
+    def __init__(self, company: str, page_size: int, chunk_size: int,
+                 max_pages: Optional[int]):
+        self.company = company
+        self.page_size = min(page_size, NEWS_API_MAX_PAGE_SIZE)
+        self.chunk_size = chunk_size
+        self.max_pages = max_pages
+        self.page = 1
+        self.done = False
+        self._buffer = []
+        self._total_results = 0
+        self._fetched = 0
+
+    @property
+    def more(self) -> bool:
+        """Sant om nästa sida (`page`) ska hämtas."""
+        return not self.done and (self.max_pages is None
+                                  or self.page <= self.max_pages)
+
+    def add(self, data: dict) -> List[dict]:
+        """Tar emot en hämtad sida och returnerar de bitar som är fulla."""
+        articles = data.get('articles', [])
+        self._total_results = data.get('totalResults', self._total_results)
+        self._fetched += len(articles)
+        self._buffer.extend(articles)
+
+        chunks = []
+        while len(self._buffer) >= self.chunk_size:
+            chunks.append(self._chunk(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+
+        if (len(articles) < self.page_size
+                or self._fetched >= self._total_results):
+            self.done = True
+        self.page += 1
+        return chunks
+
+    def stop_at(self, error: Exception) -> bool:
+        """
+        Sant om felet betyder att planens tak för antal resultat är nått.
+        Resten går då inte att hämta och genomgången avslutas; annat fel
+        ska den som anropar släppa vidare.
+        """
+        if not _is_result_cap(error):
+            return False
+        print(f"NewsAPI resultattak nått för {self.company} på sida {self.page}.")
+        self.done = True
+        return True
+
+    def rest(self) -> List[dict]:
+        """Sista, ofullständiga biten, om det finns en."""
+        if not self._buffer:
+            return []
+        chunk, self._buffer = self._chunk(self._buffer), []
+        return [chunk]
+
+    def _chunk(self, articles: list) -> dict:
+        return {"status": "ok", "totalResults": self._total_results,
+                "articles": articles}
+
+
+def iter_news_chunks(company: str, api_key: str,
+                     from_date: str,
+                     to_date: str,
+                     sort_by: str = 'relevance',
+                     language: str = 'en',
+                     page_size: int = NEWS_API_MAX_PAGE_SIZE,
+                     chunk_size: int = NEWS_API_MAX_PAGE_SIZE,
+                     max_pages: Optional[int] = None) -> Iterator[dict]:
+    """
+    Går igenom alla sidor i NewsAPI-svaret och ger artiklarna i bitar.
+
+    Sidorna hämtas först när föregående bit har konsumerats, så som mest
+    en sida plus en bit hålls i minnet oavsett hur stort `totalResults` är.
+    Varje bit har samma form som ett vanligt API-svar ({"status",
+    "totalResults", "articles"}) så att den kan sparas och rensas som förut.
+    Sidorna hämtas via hastighetsbegränsaren, så långa genomgångar väntar
+    in kvoten i stället för att misslyckas.
+
+    Args:
+        company (str): Namnet på företaget som ska sökas efter.
+        api_key (str): API-nyckeln för att autentisera mot NewsAPI.
+        from_date (str): Startdatum för sökningen (format 'YYYY-MM-DD')
+        to_date (str): Slutdatum för sökningen (format 'YYYY-MM-DD')
+        sort_by (str): Sorteringskriterium. Standard är 'relevance'.
+        language (str): Språk för nyheterna. Standard är 'en'.
+        page_size (int): Antal artiklar per anrop, max 100.
+        chunk_size (int): Max antal artiklar per bit som ges tillbaka.
+        max_pages (int): Valfri övre gräns för antalet sidor som hämtas.
+
+    Yields:
+        dict: Ett API-liknande svar med högst `chunk_size` artiklar.
+    """
+    pager = _NewsPager(company, page_size, chunk_size, max_pages)
+    while pager.more:
+        try:
+            data = fetch_news_with_retry(company=company, api_key=api_key,
+                                         from_date=from_date, to_date=to_date,
+                                         sort_by=sort_by, language=language,
+                                         page=pager.page,
+                                         page_size=pager.page_size)
+        except (requests.exceptions.HTTPError, NewsApiError) as e:
+            if not pager.stop_at(e):
+                raise
+            break
+        yield from pager.add(data)
+    yield from pager.rest()
+
+
+async def iter_news_chunks_async(client: httpx.AsyncClient,
+                                 company: str, api_key: str,
+                                 from_date: str,
+                                 to_date: str,
+                                 sort_by: str = 'relevance',
+                                 language: str = 'en',
+                                 page_size: int = NEWS_API_MAX_PAGE_SIZE,
+                                 chunk_size: int = NEWS_API_MAX_PAGE_SIZE,
+                                 max_pages: Optional[int] = None) -> AsyncIterator[dict]:
+    """
+    Asynkron variant av `iter_news_chunks` som använder en delad httpx-klient.
+
+    Generatorn tar slut först när alla `totalResults` är lästa eller NewsAPI
+    svarar `maximumResultsReached`. Ett annat fel avbryter den, så den som
+    anropar vet att resten av sidorna inte är hämtade.
+    """
+    pager = _NewsPager(company, page_size, chunk_size, max_pages)
+    while pager.more:
+        try:
+            data = await fetch_news_async_with_retry(
+                client=client, company=company, api_key=api_key,
+                from_date=from_date, to_date=to_date, sort_by=sort_by,
+                language=language, page=pager.page,
+                page_size=pager.page_size)
+        except (httpx.HTTPStatusError, NewsApiError) as e:
+            if not pager.stop_at(e):
+                raise
+            break
+        for chunk in pager.add(data):
+            yield chunk
+    for chunk in pager.rest():
+        yield chunk
+
+
+async def fetch_news_async(client: httpx.AsyncClient,
+                           company: str, api_key: str,
+                           from_date: str,
+                           to_date: str,
+                           sort_by: str = 'relevance',
+                           language: str = 'en',
+                           page: Optional[int] = None,
+                           page_size: Optional[int] = None) -> dict:
+    """
+    Asynkron variant av `fetch_news` som använder en delad httpx-klient.
+
+    Klienten återanvänder keep-alive-anslutningar mellan anropen, så flera
+    företag kan hämtas samtidigt utan en ny TLS-handskakning per anrop.
+
+    Args:
+        client (httpx.AsyncClient): Delad klient med anslutningspool.
+        company (str): Namnet på företaget som ska sökas efter.
+        api_key (str): API-nyckeln för att autentisera mot NewsAPI.
+        from_date (str): Startdatum för sökningen (format 'YYYY-MM-DD')
+        to_date (str): Slutdatum för sökningen (format 'YYYY-MM-DD')
+        sort_by (str): Sorteringskriterium. Standard är 'relevance'.
+        language (str): Språk för nyheterna. Standard är 'en'.
+        page (int): Sidnummer att hämta. Utelämnas som standard (första sidan).
+        page_size (int): Antal artiklar per sida, max 100.
+
+    Returns:
+        dict: JSON-svar från NewsAPI om anropet lyckas.
+
+    Raises:
+        NewsApiRateLimitError: Om NewsAPI begränsar anropen (HTTP 429).
+        NewsApiError: Om API-svaret innehåller ett felmeddelande.
+        httpx.HTTPError: Om nätverksfel eller anslutningsfel uppstår.
+    """
+    params = _news_params(company, from_date, to_date, sort_by, language,
+                          page, page_size)
+
+    try:
+        # Nyckeln skickas som header så att den inte hamnar i felmeddelanden
+        response = await client.get(NEWS_API_URL, params=params,
+                                    headers={'X-Api-Key': api_key})
+        if response.is_error:
+            # Kvotfel kommer med olika statuskoder, felkoden i svaret avgör
+            _raise_for_rate_limit(response.status_code, _json_or_empty(response),
+                                  response.headers)
+        response.raise_for_status()  # Kontrollera för HTTP-fel
+        data = response.json()
+
+        if data.get("status") != "ok":
+            _raise_for_rate_limit(response.status_code, data)
+            raise NewsApiError(
+                f"API Error: {data.get('message', 'Unknown error')}",
+                code=data.get('code'))
+
+        return data
+
+    except httpx.HTTPError as e:
+        print(f"Nätverksfel eller anslutningsproblem ({company}): {e}")
+        raise
+
+    except ValueError as ve:
+        print(f"Fel i API-svaret ({company}): {ve}")
+        raise
+
+
 def save_raw_data_to_big_query(data: dict, 
                                company: str, 
                                table='raw_news', 
                                project_id=get_project_id(),     
                                dataset= get_secret('dataset'), 
-                               secret='bigquery-accout-secret'):
+                               secret='bigquery-accout-secret',
+                               client: Optional[bigquery.Client] = None,
+                               compact: bool = False):
     """
     Sparar rådata till BigQuery med datum och företagsnamn.
 
@@ -104,39 +438,42 @@ def save_raw_data_to_big_query(data: dict,
         table (str): Namnet på tabellen att spara i.
         project_id (str): Google Cloud Project ID.
         dataset (str): Namnet på datasetet.
+        client (bigquery.Client): Klient att använda. Standard är den delade
+            klienten för service account-hemligheten.
+        compact (bool): Spara svaret zlib-komprimerat i kolumnen `data_z`
+            (tabelltypen raw_news_data_compact) i stället för som JSON.
 
     Raises:
         GoogleAPIError: Vid fel med BigQuery.
         Exception: Vid andra fel under insättningen.
     """
+    table_id = f"{project_id}.{dataset}.{table}"
     try:
-        # Initiera BigQuery-klienten
+        if client is None:
+            # Delad klient, byggs bara första gången i processen
+            client = get_bigquery_client(secret)
 
-        # Hämta JSON-sträng från Secret Manager
-        secret_data = get_secret(secret)
-
-        # Ladda JSON-strängen till en dictionary
-        service_account_info = json.loads(secret_data)
-
-        # Initiera BigQuery-klienten med service account
-        client = bigquery.Client.from_service_account_info(
-            service_account_info)
-    
 
         # Lägg till dagens datum i data-dict
         fetch_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         # Förbered data för BigQuery
-        rows_to_insert = [{
-            "data": json.dumps(data),  # JSON-sträng för din data
-            "fetch_date": fetch_date,  # Datum som en separat kolumn
-            "company": company,
-            "unique_id": str(uuid.uuid4())
-        }]
-
-        # Definiera din dataset och tabell
-        table_id = f"{project_id}.{dataset}.{table}"
-        #print(f"Table ID: {table_id}")
+        if compact:
+            # Komprimerad payload i en BYTES-kolumn (raw_news_data_compact)
+            rows_to_insert = [{
+                "data_z": encode_payload(data),
+                "encoding": ENCODING_ZLIB,
+                "fetch_date": fetch_date,
+                "company": company,
+                "unique_id": str(uuid.uuid4())
+            }]
+        else:
+            rows_to_insert = [{
+                "data": json.dumps(data),  # JSON-sträng för din data
+                "fetch_date": fetch_date,  # Datum som en separat kolumn
+                "company": company,
+                "unique_id": str(uuid.uuid4())
+            }]
 
         # Infoga data till BigQuery
         errors = client.insert_rows_json(table_id, rows_to_insert)
@@ -161,6 +498,125 @@ def save_raw_data_to_big_query(data: dict,
         raise
 
 
+def articles_to_rows(data: dict, company: str, fetch_date: str) -> list:
+    """
+    Delar upp ett NewsAPI-svar i en typad rad per artikel.
+
+    Raderna följer schemat för tabelltypen `raw_news_articles` i
+    create_table/main.py. Alla artiklar från samma svar får samma
+    `response_id` så att svaret går att sätta ihop igen vid behov.
+
+    Args:
+        data (dict): NewsAPI-svar med nyckeln 'articles'.
+        company (str): Företagsnamn som en kolumn.
+        fetch_date (str): Tidpunkt då svaret hämtades.
+
+    Returns:
+        list: En dict per artikel, redo för insert_rows_json.
+    """
+    response_id = str(uuid.uuid4())
+    rows = []
+    for article in data.get('articles', []):
+        source = article.get('source') or {}
+        rows.append({
+            "unique_id": str(uuid.uuid4()),
+            "response_id": response_id,
+            "company": company,
+            "fetch_date": fetch_date,
+            "source_id": source.get('id'),
+            "source_name": source.get('name'),
+            "author": article.get('author'),
+            "title": article.get('title'),
+            "description": article.get('description'),
+            "url": article.get('url'),
+            "url_to_image": article.get('urlToImage'),
+            "published_at": article.get('publishedAt'),
+            "content": article.get('content'),
+        })
+    return rows
+
+
+def save_articles_to_big_query(data: dict,
+                               company: str,
+                               table='raw_news_articles',
+                               project_id=get_project_id(),
+                               dataset=get_secret('dataset'),
+                               secret='bigquery-accout-secret',
+                               client: Optional[bigquery.Client] = None) -> int:
+    """
+    Sparar ett NewsAPI-svar som en rad per artikel i stället för en JSON-blob.
+
+    Args:
+        data (dict): Rådata som ska sparas.
+        company (str): Företagsnamn som en kolumn.
+        table (str): Tabell av typen `raw_news_articles`.
+        project_id (str): Google Cloud Project ID.
+        dataset (str): Namnet på datasetet.
+        client (bigquery.Client): Klient att använda. Standard är den delade
+            klienten för service account-hemligheten.
+
+    Returns:
+        int: Antal artiklar som sparades.
+
+    Raises:
+        GoogleAPIError: Vid fel med BigQuery.
+        Exception: Vid andra fel under insättningen.
+    """
+    table_id = f"{project_id}.{dataset}.{table}"
+    try:
+        if client is None:
+            client = get_bigquery_client(secret)
+
+        fetch_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows_to_insert = articles_to_rows(data, company, fetch_date)
+        if not rows_to_insert:
+            return 0
+
+        errors = client.insert_rows_json(table_id, rows_to_insert)
+
+        if errors:
+            print(f"Errors: {errors}")
+            raise RuntimeError(f"Failed to insert rows: {errors}")
+        print(f"{len(rows_to_insert)} articles successfully inserted.")
+        return len(rows_to_insert)
+
+    except NotFound:
+        print(f"Error: The table {table_id} was not found.")
+        raise
+
+    except GoogleAPIError as e:
+        print(f"Google API Error: {e}")
+        raise
+
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        raise
+
+
+def save_news_to_big_query(data: dict,
+                           company: str,
+                           table: str,
+                           storage_mode: str = 'blob',
+                           client: Optional[bigquery.Client] = None):
+    """
+    Sparar ett NewsAPI-svar i det valda lagringsformatet.
+
+    Args:
+        storage_mode (str): 'blob' sparar hela svaret som en JSON-sträng i
+            `raw_news_data`, 'compact' sparar det komprimerat i
+            `raw_news_data_compact` och 'articles' sparar en typad rad per
+            artikel.
+    """
+    if storage_mode == 'articles':
+        return save_articles_to_big_query(data=data, company=company,
+                                          table=table, client=client)
+    if storage_mode in ('blob', 'compact'):
+        return save_raw_data_to_big_query(data=data, company=company,
+                                          table=table, client=client,
+                                          compact=storage_mode == 'compact')
+    raise ValueError(f"Unknown storage_mode '{storage_mode}'")
+
+
 if __name__=='__main__':
     #print(get_secret())
     pass
\ No newline at end of file
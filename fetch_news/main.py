@@ -1,32 +1,120 @@
 # main.py
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta,timezone
-from fetch_raw_data import fetch_news,save_raw_data_to_big_query, get_secret
+import httpx
+from google.cloud import bigquery
+from fetch_raw_data import (fetch_news_with_retry, fetch_news_async_with_retry,
+                            iter_news_chunks, iter_news_chunks_async,
+                            save_news_to_big_query, get_secret)
+from backfill import get_backfill_status, run_backfill
+from company_matcher import (NEWS_API_MAX_QUERY_LENGTH, CompanyMatcher,
+                             aliases_for, build_or_queries, load_aliases)
+from watermarks import (filter_new_articles, get_watermarks,
+                        incremental_from_date, latest_published_at,
+                        update_watermarks, watermark_table_id)
+from shared.gcp import cache_stats, get_bigquery_client
+from shared.http_cache import http_cache_stats
+from shared.rate_limit import RateLimitError, rate_limit_stats
 
 
+# Delad anslutningspool för alla anrop mot NewsAPI från den här instansen
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+HTTP_TIMEOUT = httpx.Timeout(30.0)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http_client = httpx.AsyncClient(limits=HTTP_LIMITS,
+                                              timeout=HTTP_TIMEOUT)
+    yield
+    await app.state.http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def yesterday() -> str:
+    # Räknas ut per anrop, inte en gång när containern startar
+    return ((datetime.now(timezone.utc)) - timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
 
 class QueryParameters(BaseModel):
     company: str
-    from_date: Optional[str] = ((datetime.now(timezone.utc)) -timedelta(days=1)).strftime('%Y-%m-%d')
-    to_date: Optional[str] = ((datetime.now(timezone.utc)) - timedelta(days=1)).strftime('%Y-%m-%d')
+    from_date: Optional[str] = Field(default_factory=yesterday)
+    to_date: Optional[str] = Field(default_factory=yesterday)
     table_name: Optional[str] = 'raw_news'
+    # 'blob' = hela svaret som JSON, 'compact' = komprimerat svar,
+    # 'articles' = en typad rad per artikel
+    storage_mode: Optional[str] = 'blob'
+    paginate: Optional[bool] = False
+    page_size: Optional[int] = 100
+    chunk_size: Optional[int] = 100
+    # Hämta bara artiklar nyare än företagets vattenmärke, fram till nu.
+    # from_date används bara för företag som inte har något vattenmärke än.
+    # Alla sidor hämtas, sorterade på publishedAt, som med paginate.
+    incremental: Optional[bool] = False
+    watermark_table: Optional[str] = 'news_watermarks'
+
+
+class BatchQueryParameters(BaseModel):
+    companies: List[str]
+    from_date: Optional[str] = Field(default_factory=yesterday)
+    to_date: Optional[str] = Field(default_factory=yesterday)
+    table_name: Optional[str] = 'raw_news'
+    storage_mode: Optional[str] = 'blob'
+    incremental: Optional[bool] = False
+    watermark_table: Optional[str] = 'news_watermarks'
+
+
+# Sortering vid inkrementell hämtning. Med 'relevance' kan nyare artiklar
+# hamna på senare sidor och sedan ligga bakom vattenmärket.
+INCREMENTAL_SORT_BY = 'publishedAt'
+
+
+def resolve_window(params: QueryParameters, bq_client: Optional[bigquery.Client] = None):
+    """
+    Intervallet att hämta för ett anrop.
+
+    Vid inkrementell hämtning börjar intervallet vid företagets vattenmärke
+    och slutar nu, annars används from_date och to_date som de är.
+
+    Returns:
+        tuple: (from_date, to_date, vattenmärke eller None)
+    """
+    if not params.incremental:
+        return params.from_date, params.to_date, None
+
+    bq_client = bq_client or get_bigquery_client()
+    watermark = get_watermarks(bq_client,
+                               watermark_table_id(params.watermark_table),
+                               [params.company]).get(params.company)
+    return incremental_from_date(watermark, params.from_date), utc_now(), watermark
 
 
 @app.post("/fetch-news/")
 def fetch_news_and_save(params: QueryParameters):
       # Ersätt med din NewsAPI-nyckel
 
+    # Vattenmärket får bara flyttas när alla sidor i fönstret är sparade
+    if params.paginate or params.incremental:
+        return fetch_all_pages_and_save(params)
+
     try:
+        from_date, to_date, _ = resolve_window(params)
+
         # 1. Hämta nyheter från API:t
-        news_data = fetch_news(
+        news_data = fetch_news_with_retry(
             company=params.company,
-            from_date=params.from_date,
-            to_date=params.to_date,
+            from_date=from_date,
+            to_date=to_date,
             api_key=get_secret('NEWS_API_KEY')
         )
 
@@ -34,19 +122,428 @@ def fetch_news_and_save(params: QueryParameters):
             raise HTTPException(status_code=404, detail="No data found.")
 
         # 2. Spara data till BigQuery
-        save_raw_data_to_big_query(data=news_data, company=params.company,table=params.table_name)
-
-        
+        save_news_to_big_query(data=news_data, company=params.company,table=params.table_name,
+                               storage_mode=params.storage_mode)
 
         # 3. Returnera framgångsmeddelande med hämtade data
-        return {"message": "Data fetched and saved successfully.", "Number of articels saved: ": news_data['totalResults'],"from_date":f"{params.from_date}","to_date":f"{params.to_date}","company":f"{params.company}"}
+        return {"message": "Data fetched and saved successfully.", "Number of articels saved: ": news_data['totalResults'],"from_date":f"{from_date}","to_date":f"{to_date}","company":f"{params.company}"}
+
+    except HTTPException as e:
+        raise e
+    except RateLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def fetch_all_pages_and_save(params: QueryParameters):
+    """
+    Hämtar alla sidor för ett företag och sparar varje bit direkt när den
+    kommer, så att minnesanvändningen inte växer med antalet träffar.
+
+    Vid inkrementell hämtning flyttas vattenmärket först när alla sidor är
+    sparade. Ett fel halvvägs lämnar det orört, så nästa körning hämtar
+    samma fönster igen.
+    """
+    try:
+        bq_client = get_bigquery_client()
+        from_date, to_date, watermark = resolve_window(params, bq_client)
+
+        saved = 0
+        chunks = 0
+        newest = None
+        for chunk in iter_news_chunks(company=params.company,
+                                      from_date=from_date,
+                                      to_date=to_date,
+                                      api_key=get_secret('NEWS_API_KEY'),
+                                      sort_by=(INCREMENTAL_SORT_BY if params.incremental
+                                               else 'relevance'),
+                                      page_size=params.page_size,
+                                      chunk_size=params.chunk_size):
+            if params.incremental:
+                chunk = filter_new_articles(chunk, watermark)
+                if not chunk['articles']:
+                    continue
+            save_news_to_big_query(data=chunk, company=params.company,
+                                   table=params.table_name,
+                                   storage_mode=params.storage_mode,
+                                   client=bq_client)
+            saved += len(chunk['articles'])
+            chunks += 1
+            latest = latest_published_at(chunk['articles'])
+            if latest is not None and (newest is None or latest > newest):
+                newest = latest
+
+        if params.incremental:
+            if saved == 0:
+                return {"message": "No new articles since the watermark.", "Number of articels saved: ": 0, "chunks_written": 0, "from_date": f"{from_date}", "to_date": f"{to_date}", "company": f"{params.company}"}
+            update_watermarks(bq_client, watermark_table_id(params.watermark_table),
+                              {params.company: newest})
+
+        if saved == 0:
+            raise HTTPException(status_code=404, detail="No data found.")
+
+        return {"message": "Data fetched and saved successfully.", "Number of articels saved: ": saved, "chunks_written": chunks, "from_date": f"{from_date}", "to_date": f"{to_date}", "company": f"{params.company}"}
 
     except HTTPException as e:
         raise e
+    except RateLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def fetch_and_save_company(http_client: httpx.AsyncClient,
+                                 bq_client: bigquery.Client,
+                                 company: str,
+                                 api_key: str,
+                                 params: BatchQueryParameters,
+                                 watermarks: Optional[dict] = None) -> dict:
+    """
+    Hämtar och sparar nyheter för ett företag i batch-endpointen.
+
+    Nätverksanropet görs asynkront och BigQuery-skrivningen körs i en tråd
+    så att den inte blockerar de andra företagen.
+
+    Vid inkrementell hämtning innehåller `watermarks` företagens nuvarande
+    vattenmärken. Alla sidor hämtas och sparas, och först därefter
+    uppdateras företagets vattenmärke med den nyaste sparade artikeln.
+    """
+    if params.incremental:
+        return await fetch_and_save_company_incremental(
+            http_client, bq_client, company, api_key, params, watermarks)
+
+    news_data = await fetch_news_async_with_retry(
+        client=http_client,
+        company=company,
+        from_date=params.from_date,
+        to_date=params.to_date,
+        api_key=api_key
+    )
+
+    if not news_data or len(news_data.get('articles', [])) == 0:
+        raise LookupError("No data found.")
+
+    await asyncio.to_thread(save_news_to_big_query,
+                            data=news_data,
+                            company=company,
+                            table=params.table_name,
+                            storage_mode=params.storage_mode,
+                            client=bq_client)
+
+    return {"Number of articels saved: ": news_data['totalResults']}
+
+
+async def fetch_and_save_company_incremental(http_client: httpx.AsyncClient,
+                                             bq_client: bigquery.Client,
+                                             company: str,
+                                             api_key: str,
+                                             params: BatchQueryParameters,
+                                             watermarks: dict) -> dict:
+    """Inkrementell del av `fetch_and_save_company`: alla sidor sedan vattenmärket."""
+    watermark = watermarks.get(company)
+    from_date, to_date = incremental_from_date(watermark, params.from_date), utc_now()
+
+    saved = 0
+    newest = None
+    async for chunk in iter_news_chunks_async(client=http_client,
+                                              company=company,
+                                              api_key=api_key,
+                                              from_date=from_date,
+                                              to_date=to_date,
+                                              sort_by=INCREMENTAL_SORT_BY):
+        chunk = filter_new_articles(chunk, watermark)
+        if not chunk['articles']:
+            continue
+        await asyncio.to_thread(save_news_to_big_query,
+                                data=chunk,
+                                company=company,
+                                table=params.table_name,
+                                storage_mode=params.storage_mode,
+                                client=bq_client)
+        saved += len(chunk['articles'])
+        latest = latest_published_at(chunk['articles'])
+        if latest is not None and (newest is None or latest > newest):
+            newest = latest
+
+    if newest is not None:
+        watermarks[company] = newest
+    return {"Number of articels saved: ": saved}
+
+
+@app.post("/fetch-news/batch/")
+async def fetch_news_batch_and_save(params: BatchQueryParameters):
+    """
+    Hämtar nyheter för flera företag samtidigt och sparar dem till BigQuery.
+
+    API-nyckeln och BigQuery-klienten delas av alla företag. Svaret
+    innehåller resultat och fel per företag, så ett misslyckat företag
+    stoppar inte de andra.
+    """
+    try:
+        api_key, bq_client = await asyncio.gather(
+            asyncio.to_thread(get_secret, 'NEWS_API_KEY'),
+            asyncio.to_thread(get_bigquery_client))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    companies = list(dict.fromkeys(params.companies))
+
+    # Ett anrop hämtar vattenmärkena för alla företag
+    watermarks = {}
+    if params.incremental:
+        try:
+            watermarks = await asyncio.to_thread(
+                get_watermarks, bq_client,
+                watermark_table_id(params.watermark_table), companies)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    previous = dict(watermarks)
+
+    outcomes = await asyncio.gather(
+        *(fetch_and_save_company(app.state.http_client, bq_client,
+                                 company, api_key, params, watermarks)
+          for company in companies),
+        return_exceptions=True)
+
+    if params.incremental:
+        # Och ett MERGE flyttar fram dem som fick nya artiklar
+        advanced = {company: published_at
+                    for company, published_at in watermarks.items()
+                    if published_at != previous.get(company)}
+        try:
+            await asyncio.to_thread(update_watermarks, bq_client,
+                                    watermark_table_id(params.watermark_table),
+                                    advanced)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"News saved but watermarks not updated: {e}")
+
+    results = {}
+    errors = {}
+    for company, outcome in zip(companies, outcomes):
+        if isinstance(outcome, Exception):
+            errors[company] = str(outcome)
+        else:
+            results[company] = outcome
+
+    return {"message": f"Fetched news for {len(results)} of {len(companies)} companies.",
+            "from_date": f"{params.from_date}",
+            "to_date": f"{params.to_date}",
+            "results": results,
+            "errors": errors}
+
+
+class MultiQueryParameters(BaseModel):
+    companies: List[str]
+    from_date: Optional[str] = Field(default_factory=yesterday)
+    to_date: Optional[str] = Field(default_factory=yesterday)
+    table_name: Optional[str] = 'raw_news'
+    storage_mode: Optional[str] = 'blob'
+    # Företag -> alias (juridiskt namn, produkter). Standard är aliastabellen
+    # i COMPANY_ALIASES_FILE eller company_matcher.DEFAULT_ALIASES.
+    aliases: Optional[Dict[str, List[str]]] = None
+    max_query_length: Optional[int] = NEWS_API_MAX_QUERY_LENGTH
+    max_pages: Optional[int] = None
+    # Som i /fetch-news/batch/: bara artiklar nyare än företagens vattenmärken
+    incremental: Optional[bool] = False
+    watermark_table: Optional[str] = 'news_watermarks'
+
+
+async def fetch_and_save_query(http_client: httpx.AsyncClient,
+                               bq_client: bigquery.Client,
+                               query: str,
+                               query_companies: List[str],
+                               matcher: CompanyMatcher,
+                               api_key: str,
+                               params: MultiQueryParameters,
+                               watermarks: Dict[str, datetime],
+                               state: dict):
+    """
+    Hämtar alla sidor för en OR-fråga och sparar varje bit per företag
+    direkt när den kommer, så att minnet inte växer med antalet träffar.
+
+    `state` delas av alla frågor i anropet: räknare, sparade URL:er per
+    företag (samma artikel kan komma i svaret på flera frågor) och nyaste
+    sparade `publishedAt` per företag.
+    """
+    if params.incremental:
+        # Frågan börjar vid det äldsta vattenmärket bland dess företag;
+        # varje företags artiklar filtreras sedan mot dess eget
+        from_date = min(incremental_from_date(watermarks.get(company), params.from_date)
+                        for company in query_companies)
+        to_date, sort_by = utc_now(), INCREMENTAL_SORT_BY
+    else:
+        from_date, to_date, sort_by = params.from_date, params.to_date, 'relevance'
+
+    async for chunk in iter_news_chunks_async(client=http_client,
+                                              company=query,
+                                              api_key=api_key,
+                                              from_date=from_date,
+                                              to_date=to_date,
+                                              sort_by=sort_by,
+                                              max_pages=params.max_pages):
+        state["fetched"] += len(chunk['articles'])
+        chunk_routed, chunk_unmatched = matcher.route(chunk['articles'])
+        state["unmatched"] += chunk_unmatched
+
+        for company, articles in chunk_routed.items():
+            seen = state["urls"].setdefault(company, set())
+            articles = [article for article in articles
+                        if article.get('url') not in seen]
+            seen.update(article.get('url') for article in articles)
+            data = {"status": "ok", "totalResults": len(articles), "articles": articles}
+            if params.incremental:
+                data = filter_new_articles(data, watermarks.get(company))
+            if not data['articles']:
+                continue
+
+            await asyncio.to_thread(save_news_to_big_query,
+                                    data=data,
+                                    company=company,
+                                    table=params.table_name,
+                                    storage_mode=params.storage_mode,
+                                    client=bq_client)
+            state["saved"][company] = state["saved"].get(company, 0) + len(data['articles'])
+            latest = latest_published_at(data['articles'])
+            newest = state["newest"].get(company)
+            if latest is not None and (newest is None or latest > newest):
+                state["newest"][company] = latest
+
+
+@app.post("/fetch-news/multi/")
+async def fetch_news_multi_and_save(params: MultiQueryParameters):
+    """
+    Hämtar nyheter för många företag med få anrop.
+
+    Företagen slås ihop till OR-frågor som ryms i NewsAPI:s maxlängd. Varje
+    artikel i svaren fördelas sedan till alla företag den nämner, via
+    aliastabellen, och sparas per företag som i de andra endpointsen.
+    Frågorna körs samtidigt över den delade klienten.
+
+    Vid inkrementell hämtning flyttas vattenmärkena först när alla frågor
+    är klara. Ett fel lämnar dem orörda, så nästa körning hämtar samma
+    fönster igen.
+    """
+    try:
+        company_aliases = aliases_for(params.companies,
+                                      params.aliases if params.aliases is not None
+                                      else load_aliases())
+        queries = build_or_queries(company_aliases, params.max_query_length)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        matcher = CompanyMatcher(company_aliases)
+        api_key, bq_client = await asyncio.gather(
+            asyncio.to_thread(get_secret, 'NEWS_API_KEY'),
+            asyncio.to_thread(get_bigquery_client))
+
+        watermarks = {}
+        if params.incremental:
+            watermarks = await asyncio.to_thread(
+                get_watermarks, bq_client,
+                watermark_table_id(params.watermark_table), list(company_aliases))
+
+        state = {"fetched": 0, "unmatched": 0, "saved": {}, "urls": {}, "newest": {}}
+        outcomes = await asyncio.gather(
+            *(fetch_and_save_query(app.state.http_client, bq_client, query,
+                                   query_companies, matcher, api_key, params,
+                                   watermarks, state)
+              for query, query_companies in queries),
+            return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                raise outcome
+
+        if params.incremental:
+            await asyncio.to_thread(update_watermarks, bq_client,
+                                    watermark_table_id(params.watermark_table),
+                                    state["newest"])
+
+        results = {company: {"Number of articels saved: ": saved}
+                   for company, saved in state["saved"].items()}
+        return {"message": f"Fetched news for {len(results)} of {len(company_aliases)} companies in {len(queries)} queries.",
+                "queries": len(queries),
+                "articles_fetched": state["fetched"],
+                "articles_unmatched": state["unmatched"],
+                "from_date": f"{params.from_date}",
+                "to_date": f"{params.to_date}",
+                "results": results}
+
+    except RateLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class BackfillParameters(BaseModel):
+    companies: List[str]
+    from_date: str
+    to_date: str
+    # 'day' eller 'week' per arbetsenhet
+    unit: Optional[str] = 'day'
+    table_name: Optional[str] = 'raw_news'
+    storage_mode: Optional[str] = 'blob'
+    concurrency: Optional[int] = 4
+    run_id: Optional[str] = None
+    checkpoint_table: Optional[str] = 'news_backfill_checkpoints'
+
+
+@app.post("/backfill-news/")
+async def backfill_news(params: BackfillParameters):
+    """
+    Hämtar historiska nyheter för flera företag, en dag eller vecka i taget.
+
+    Klara enheter sparas i checkpoint-tabellen, så samma anrop igen
+    fortsätter där en avbruten körning slutade. Svaret visar hur många
+    enheter som är kvar och genomströmningen för körningen.
+    """
+    try:
+        api_key, bq_client = await asyncio.gather(
+            asyncio.to_thread(get_secret, 'NEWS_API_KEY'),
+            asyncio.to_thread(get_bigquery_client))
+
+        return await run_backfill(http_client=app.state.http_client,
+                                  bq_client=bq_client,
+                                  api_key=api_key,
+                                  companies=params.companies,
+                                  from_date=params.from_date,
+                                  to_date=params.to_date,
+                                  unit=params.unit,
+                                  table_name=params.table_name,
+                                  storage_mode=params.storage_mode,
+                                  concurrency=params.concurrency,
+                                  run_id=params.run_id,
+                                  checkpoint_table=params.checkpoint_table)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/backfill-news/{run_id}")
+def backfill_news_status(run_id: str,
+                         checkpoint_table: str = 'news_backfill_checkpoints'):
+    """Framsteg för en backfill-körning."""
+    try:
+        return get_backfill_status(get_bigquery_client(), run_id,
+                                   checkpoint_table=checkpoint_table)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/cache-stats/")
+def get_cache_stats():
+    """Träffar och missar i cachen för hemligheter, klienter och API-svar."""
+    return {**cache_stats(), "http": http_cache_stats()}
+
+
+@app.get("/rate-limits/")
+def get_rate_limits():
+    """Förbrukad dygnskvot och kötid per API-nyckel i den här instansen."""
+    return rate_limit_stats()
+
+
 # Kör servern med uvicorn om du kör den lokalt
 if __name__ == "__main__":
     # import uvicorn
@@ -0,0 +1,100 @@
+import asyncio
+from unittest.mock import Mock, patch
+import httpx
+from backfill import run_backfill, split_date_range
+
+
+def test_split_date_range_by_week():
+    assert split_date_range("2024-01-01", "2024-01-10", unit="week") == [
+        ("2024-01-01", "2024-01-07"), ("2024-01-08", "2024-01-10")]
+    assert len(split_date_range("2024-01-01", "2024-01-10")) == 10
+
+
+def test_run_backfill_skips_finished_units():
+    # Första dagen för AAPL är redan klar från en tidigare körning
+    requested = []
+
+    def handler(request):
+        requested.append((request.url.params["q"], request.url.params["from"]))
+        return httpx.Response(200, json={"status": "ok", "totalResults": 1,
+                                         "articles": [{"title": "x"}]})
+
+    bq_client = Mock()
+    bq_client.query.return_value.result.return_value = [
+        Mock(company="AAPL", from_date="2024-01-01")]
+    bq_client.insert_rows_json.return_value = []
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await run_backfill(client, bq_client, "fake-api-key",
+                                      companies=["AAPL", "MSFT"],
+                                      from_date="2024-01-01",
+                                      to_date="2024-01-02")
+
+    with patch("backfill.save_news_to_big_query") as save:
+        progress = asyncio.run(run())
+
+    assert sorted(requested) == [("AAPL", "2024-01-02"), ("MSFT", "2024-01-01"),
+                                 ("MSFT", "2024-01-02")]
+    assert save.call_count == 3
+    assert progress["units_total"] == 4
+    assert progress["units_skipped"] == 1
+    assert progress["units_remaining"] == 0
+    assert progress["articles"] == 3
+
+
+def test_run_backfill_pages_through_busy_days():
+    # 150 artiklar samma dag: två sidor, och enheten är klar först efter sidan 2
+    pages = []
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        pages.append(page)
+        count = 100 if page == 1 else 50
+        return httpx.Response(200, json={"status": "ok", "totalResults": 150,
+                                         "articles": [{"title": "x"}] * count})
+
+    bq_client = Mock()
+    bq_client.query.return_value.result.return_value = []
+    bq_client.insert_rows_json.return_value = []
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await run_backfill(client, bq_client, "fake-api-key",
+                                      companies=["AAPL"], from_date="2024-01-01",
+                                      to_date="2024-01-01", run_id="busy")
+
+    with patch("backfill.save_news_to_big_query") as save:
+        progress = asyncio.run(run())
+
+    assert pages == [1, 2]
+    assert save.call_count == 2
+    assert progress["articles"] == 150
+    checkpoint = bq_client.insert_rows_json.call_args.args[1][0]
+    assert (checkpoint["status"], checkpoint["articles"]) == ("done", 150)
+
+
+def test_run_backfill_marks_interrupted_unit_partial():
+    def handler(request):
+        if request.url.params["page"] == "2":
+            return httpx.Response(200, json={"status": "error", "code": "unexpectedError",
+                                             "message": "boom"})
+        return httpx.Response(200, json={"status": "ok", "totalResults": 150,
+                                         "articles": [{"title": "x"}] * 100})
+
+    bq_client = Mock()
+    bq_client.query.return_value.result.return_value = []
+    bq_client.insert_rows_json.return_value = []
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await run_backfill(client, bq_client, "fake-api-key",
+                                      companies=["AAPL"], from_date="2024-01-02",
+                                      to_date="2024-01-02", run_id="partial")
+
+    with patch("backfill.save_news_to_big_query"):
+        progress = asyncio.run(run())
+
+    checkpoint = bq_client.insert_rows_json.call_args.args[1][0]
+    assert (checkpoint["status"], checkpoint["articles"]) == ("partial", 100)
+    assert progress["units_remaining"] == 1
@@ -0,0 +1,34 @@
+from company_matcher import (AhoCorasick, CompanyMatcher, aliases_for,
+                             build_or_queries)
+
+
+def test_aho_corasick_finds_overlapping_whole_words():
+    automaton = AhoCorasick({"he": 1, "she": 2, "hers": 3, "apple": 4})
+
+    assert automaton.find("She said hers, not his") == {2, 3}
+    assert automaton.find("Pineapple juice") == set()
+
+
+def test_articles_are_routed_to_every_company_they_mention():
+    matcher = CompanyMatcher(aliases_for(["AAPL", "MSFT", "TSLA"]))
+
+    routed, unmatched = matcher.route([
+        {"title": "Apple and Microsoft agree on cloud deal", "description": None},
+        {"title": "Markets", "description": "New iPhone lifts AAPL"},
+        {"title": "Weather", "description": "Rain"},
+    ])
+
+    assert [a["title"] for a in routed["AAPL"]] == [
+        "Apple and Microsoft agree on cloud deal", "Markets"]
+    assert len(routed["MSFT"]) == 1
+    assert "TSLA" not in routed
+    assert unmatched == 1
+
+
+def test_build_or_queries_respects_length_limit():
+    companies = [f"T{i:03d}" for i in range(500)]
+    queries = build_or_queries(aliases_for(companies), max_length=500)
+
+    assert all(len(query) <= 500 for query, _ in queries)
+    assert sum(len(group) for _, group in queries) == 500
+    assert len(queries) < 20
@@ -1,7 +1,12 @@
+import asyncio
 import os
 import pytest
 from unittest.mock import patch, Mock
-from fetch_raw_data import get_project_id, fetch_news
+from fetch_raw_data import (NewsApiQuotaError, NewsApiRateLimitError,
+                            get_project_id, fetch_news, fetch_news_async,
+                            iter_news_chunks, iter_news_chunks_async,
+                            articles_to_rows)
+import httpx
 import requests
 
 
@@ -70,4 +75,198 @@ def test_fetch_news_network_error(mock_requests_get):
             api_key="fake-api-key",
             from_date="2023-01-01",
             to_date="2023-01-02"
-        )
\ No newline at end of file
+        )
+
+def test_fetch_news_async_shares_client():
+    # Alla företag ska gå genom samma klient och anslutningspool
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.params["q"])
+        return httpx.Response(200, json={
+            "status": "ok",
+            "totalResults": 1,
+            "articles": [{"title": f"{request.url.params['q']} Article"}]
+        })
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await asyncio.gather(*(
+                fetch_news_async(client=client, company=company,
+                                 api_key="fake-api-key",
+                                 from_date="2023-01-01", to_date="2023-01-02")
+                for company in ["AAPL", "MSFT"]))
+
+    results = asyncio.run(run())
+
+    assert sorted(requested) == ["AAPL", "MSFT"]
+    assert results[0]["articles"][0]["title"] == "AAPL Article"
+    assert results[1]["articles"][0]["title"] == "MSFT Article"
+
+
+def test_fetch_news_encodes_or_query():
+    # '&' och '#' i ett alias får inte dela upp eller korta frågesträngen
+    query = '"AT&T" OR "Procter & Gamble" OR C#'
+    received = []
+
+    def handler(request):
+        received.append(request.url.params["q"])
+        return httpx.Response(200, json={"status": "ok", "totalResults": 0,
+                                         "articles": []})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await fetch_news_async(client=client, company=query,
+                                   api_key="fake-api-key",
+                                   from_date="2023-01-01", to_date="2023-01-02")
+
+    asyncio.run(run())
+    assert received == [query]
+
+    with patch("requests.get") as mock_get:
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {"status": "ok", "articles": []}
+        fetch_news(company=query, api_key="fake-api-key",
+                   from_date="2023-01-01", to_date="2023-01-02")
+    assert mock_get.call_args.kwargs["params"]["q"] == query
+
+
+@pytest.mark.parametrize("status, code, message, expected", [
+    # Meddelandet nämner timmar, men felkoden säger att det går över
+    (429, "rateLimited", "You have made too many requests recently. "
+                         "Developer accounts are limited to 100 requests over a 24 hour period.",
+     NewsApiRateLimitError),
+    (429, "apiKeyExhausted", "Your API key has no more requests available.",
+     NewsApiQuotaError),
+    (401, "apiKeyExhausted", "Your API key has no more requests available.",
+     NewsApiQuotaError),
+])
+def test_rate_limit_errors_are_classified_on_code(status, code, message, expected):
+    def handler(request):
+        return httpx.Response(status, json={"status": "error", "code": code,
+                                            "message": message})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await fetch_news_async(client=client, company="Test Company",
+                                   api_key="fake-api-key",
+                                   from_date="2023-01-01", to_date="2023-01-02")
+
+    with pytest.raises(expected) as caught:
+        asyncio.run(run())
+    assert type(caught.value) is expected
+    assert caught.value.code == code
+
+
+def test_fetch_news_async_api_error():
+    def handler(request):
+        return httpx.Response(200, json={"status": "error",
+                                         "message": "API Key invalid."})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await fetch_news_async(client=client, company="Test Company",
+                                   api_key="fake-api-key",
+                                   from_date="2023-01-01", to_date="2023-01-02")
+
+    with pytest.raises(ValueError, match="API Error: API Key invalid."):
+        asyncio.run(run())
+
+
+def test_iter_news_chunks_walks_all_pages(mock_requests_get):
+    # Tre sidor med 2, 2 och 1 artikel ska ge bitar om högst 3 artiklar
+    pages = [
+        [{"title": "a"}, {"title": "b"}],
+        [{"title": "c"}, {"title": "d"}],
+        [{"title": "e"}],
+    ]
+    responses = []
+    for articles in pages:
+        mock_response = Mock()
+        mock_response.json.return_value = {
+            "status": "ok", "totalResults": 5, "articles": articles}
+        responses.append(mock_response)
+    mock_requests_get.side_effect = responses
+
+    chunks = iter_news_chunks(company="Test Company",
+                              api_key="fake-api-key",
+                              from_date="2023-01-01",
+                              to_date="2023-01-02",
+                              page_size=2,
+                              chunk_size=3)
+
+    # Generatorn är lat: inga anrop innan första biten begärs
+    assert mock_requests_get.call_count == 0
+
+    result = [[a["title"] for a in chunk["articles"]] for chunk in chunks]
+
+    assert result == [["a", "b", "c"], ["d", "e"]]
+    assert mock_requests_get.call_count == 3
+    params = mock_requests_get.call_args.kwargs["params"]
+    assert (params["page"], params["pageSize"]) == (3, 2)
+
+
+def test_iter_news_chunks_stops_at_result_cap(mock_requests_get):
+    first_page = Mock()
+    first_page.json.return_value = {
+        "status": "ok", "totalResults": 500,
+        "articles": [{"title": "a"}, {"title": "b"}]}
+    capped = Mock()
+    capped.json.return_value = {
+        "status": "error", "code": "maximumResultsReached",
+        "message": "You have requested too many results."}
+    mock_requests_get.side_effect = [first_page, capped]
+
+    chunks = list(iter_news_chunks(company="Test Company",
+                                   api_key="fake-api-key",
+                                   from_date="2023-01-01",
+                                   to_date="2023-01-02",
+                                   page_size=2))
+
+    assert [len(chunk["articles"]) for chunk in chunks] == [2]
+
+
+def test_iter_news_chunks_async_pages_like_sync():
+    # Samma sidlogik som den synkrona varianten, via den delade klienten
+    def handler(request):
+        page = int(request.url.params["page"])
+        if page == 3:
+            return httpx.Response(426, json={
+                "status": "error", "code": "maximumResultsReached",
+                "message": "You have requested too many results."})
+        return httpx.Response(200, json={
+            "status": "ok", "totalResults": 500,
+            "articles": [{"title": f"{page}a"}, {"title": f"{page}b"}]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return [[a["title"] for a in chunk["articles"]]
+                    async for chunk in iter_news_chunks_async(
+                        client=client, company="Test Company",
+                        api_key="fake-api-key", from_date="2023-01-01",
+                        to_date="2023-01-02", page_size=2, chunk_size=3)]
+
+    assert asyncio.run(run()) == [["1a", "1b", "2a"], ["2b"]]
+
+
+def test_articles_to_rows_splits_response():
+    data = {
+        "status": "ok",
+        "totalResults": 2,
+        "articles": [
+            {"source": {"id": None, "name": "Reuters"}, "title": "A",
+             "url": "https://a", "publishedAt": "2024-09-01T10:00:00Z"},
+            {"source": {"id": "bbc", "name": "BBC"}, "title": "B",
+             "url": "https://b", "publishedAt": "2024-09-01T11:00:00Z"},
+        ]
+    }
+
+    rows = articles_to_rows(data, company="AAPL",
+                            fetch_date="2024-09-02 00:00:00")
+
+    assert [row["title"] for row in rows] == ["A", "B"]
+    assert [row["source_name"] for row in rows] == ["Reuters", "BBC"]
+    assert rows[0]["published_at"] == "2024-09-01T10:00:00Z"
+    # Samma svar, men unika rader
+    assert rows[0]["response_id"] == rows[1]["response_id"]
+    assert rows[0]["unique_id"] != rows[1]["unique_id"]
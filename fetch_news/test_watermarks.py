@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+import httpx
+from company_matcher import CompanyMatcher, aliases_for
+from main import (BatchQueryParameters, MultiQueryParameters,
+                  fetch_and_save_company, fetch_and_save_query)
+from watermarks import (filter_new_articles, incremental_from_date,
+                        latest_published_at)
+
+
+def test_filter_new_articles_drops_seen_articles():
+    watermark = datetime(2024, 1, 2, 10, 0, tzinfo=timezone.utc)
+    data = {"status": "ok", "totalResults": 3, "articles": [
+        {"title": "old", "publishedAt": "2024-01-01T09:00:00Z"},
+        {"title": "same", "publishedAt": "2024-01-02T10:00:00Z"},
+        {"title": "new", "publishedAt": "2024-01-02T11:30:00Z"},
+    ]}
+
+    result = filter_new_articles(data, watermark)
+
+    assert [a["title"] for a in result["articles"]] == ["new"]
+    assert result["totalResults"] == 1
+    assert latest_published_at(result["articles"]) == \
+        datetime(2024, 1, 2, 11, 30, tzinfo=timezone.utc)
+    assert incremental_from_date(watermark, "2024-01-01") == "2024-01-02T10:00:00"
+    assert incremental_from_date(None, "2024-01-01") == "2024-01-01"
+
+
+def test_incremental_batch_reads_every_page_before_advancing():
+    # Fönstret har tre artiklar men bara två per sida
+    pages = {"1": [{"title": "c", "publishedAt": "2024-01-03T12:00:00Z"},
+                   {"title": "b", "publishedAt": "2024-01-03T11:00:00Z"}],
+             "2": [{"title": "a", "publishedAt": "2024-01-03T10:00:00Z"}]}
+    requested = []
+
+    def handler(request):
+        requested.append((request.url.params["sortBy"], request.url.params["page"]))
+        return httpx.Response(200, json={"status": "ok", "totalResults": 3,
+                                         "articles": pages[request.url.params["page"]]})
+
+    watermark = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    watermarks = {"AAPL": watermark}
+    params = BatchQueryParameters(companies=["AAPL"], incremental=True)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await fetch_and_save_company(client, Mock(), "AAPL",
+                                                "fake-api-key", params, watermarks)
+
+    with patch("main.save_news_to_big_query") as save, \
+            patch("fetch_raw_data.NEWS_API_MAX_PAGE_SIZE", 2):
+        result = asyncio.run(run())
+
+    assert requested == [("publishedAt", "1"), ("publishedAt", "2")]
+    assert [a["title"] for call in save.call_args_list
+            for a in call.kwargs["data"]["articles"]] == ["c", "b", "a"]
+    assert result == {"Number of articels saved: ": 3}
+    assert watermarks["AAPL"] == datetime(2024, 1, 3, 12, tzinfo=timezone.utc)
+
+
+def test_incremental_multi_query_saves_each_chunk_once_per_company():
+    pages = {
+        "Apple": [{"title": "Apple and Microsoft team up", "url": "u1",
+                   "publishedAt": "2024-01-03T12:00:00Z"},
+                  {"title": "Apple before the watermark", "url": "u2",
+                   "publishedAt": "2024-01-01T12:00:00Z"}],
+        "Microsoft": [{"title": "Apple and Microsoft team up", "url": "u1",
+                       "publishedAt": "2024-01-03T12:00:00Z"},
+                      {"title": "Microsoft news", "url": "u3",
+                       "publishedAt": "2024-01-03T09:00:00Z"}],
+    }
+    requested = []
+
+    def handler(request):
+        requested.append((request.url.params["q"], request.url.params["from"]))
+        return httpx.Response(200, json={"status": "ok", "totalResults": 2,
+                                         "articles": pages[request.url.params["q"]]})
+
+    company_aliases = aliases_for(["AAPL", "MSFT"], {"AAPL": ["Apple"], "MSFT": ["Microsoft"]})
+    matcher = CompanyMatcher(company_aliases)
+    watermarks = {"AAPL": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+    params = MultiQueryParameters(companies=["AAPL", "MSFT"], from_date="2023-12-01",
+                                  incremental=True)
+    state = {"fetched": 0, "unmatched": 0, "saved": {}, "urls": {}, "newest": {}}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            for query, companies in [("Apple", ["AAPL"]), ("Microsoft", ["MSFT"])]:
+                await fetch_and_save_query(client, Mock(), query, companies, matcher,
+                                           "fake-api-key", params, watermarks, state)
+
+    with patch("main.save_news_to_big_query") as save:
+        asyncio.run(run())
+
+    assert requested == [("Apple", "2024-01-02T00:00:00"), ("Microsoft", "2023-12-01")]
+    # En bit per fråga och företag, sparad direkt; u1 sparas bara en gång per företag
+    assert [(call.kwargs["company"], [a["url"] for a in call.kwargs["data"]["articles"]])
+            for call in save.call_args_list] == [
+        ("AAPL", ["u1"]), ("MSFT", ["u1"]), ("MSFT", ["u3"])]
+    assert state["saved"] == {"AAPL": 1, "MSFT": 2}
+    assert state["newest"] == {"AAPL": datetime(2024, 1, 3, 12, tzinfo=timezone.utc),
+                               "MSFT": datetime(2024, 1, 3, 12, tzinfo=timezone.utc)}
+    assert (state["fetched"], state["unmatched"]) == (4, 0)
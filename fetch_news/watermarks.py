@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from google.cloud import bigquery
+from shared.gcp import get_project_id, get_secret
+
+# Tabell av typen news_watermarks i create_table/main.py
+WATERMARK_TABLE = 'news_watermarks'
+
+
+def watermark_table_id(table: str = WATERMARK_TABLE) -> str:
+    return f"{get_project_id()}.{get_secret('dataset')}.{table}"
+
+
+def parse_published_at(value: str) -> Optional[datetime]:
+    """Tolkar NewsAPI:s `publishedAt` ('2024-01-02T10:00:00Z') som UTC-tid."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def get_watermarks(client: bigquery.Client, table_id: str,
+                   companies: List[str]) -> Dict[str, datetime]:
+    """
+    Hämtar senast sedda `publishedAt` per företag i ett enda anrop.
+
+    Returns:
+        dict: Företag -> tidsstämpel. Företag utan vattenmärke saknas.
+    """
+    query = f"""
+        SELECT company, last_published_at
+        FROM `{table_id}`
+        WHERE company IN UNNEST(@companies)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("companies", "STRING", list(companies))
+        ]
+    )
+    return {row.company: row.last_published_at
+            for row in client.query(query, job_config=job_config).result()}
+
+
+def update_watermarks(client: bigquery.Client, table_id: str,
+                      watermarks: Dict[str, datetime]):
+    """
+    Flyttar fram vattenmärkena med en MERGE. Ett vattenmärke flyttas aldrig
+    bakåt, så samtidiga körningar kan inte skriva över varandras framsteg.
+    """
+    watermarks = {company: published_at
+                  for company, published_at in watermarks.items()
+                  if published_at is not None}
+    if not watermarks:
+        return
+
+    rows = [bigquery.StructQueryParameter(
+        None,
+        bigquery.ScalarQueryParameter("company", "STRING", company),
+        bigquery.ScalarQueryParameter("last_published_at", "TIMESTAMP", published_at))
+        for company, published_at in watermarks.items()]
+
+    query = f"""
+        MERGE `{table_id}` T
+        USING (SELECT company, last_published_at FROM UNNEST(@rows)) S
+        ON T.company = S.company
+        WHEN MATCHED AND S.last_published_at > T.last_published_at THEN
+            UPDATE SET last_published_at = S.last_published_at,
+                       updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (company, last_published_at, updated_at)
+            VALUES (S.company, S.last_published_at, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", rows)]
+    )
+    client.query(query, job_config=job_config).result()
+
+
+def incremental_from_date(watermark: Optional[datetime], default: str) -> str:
+    """
+    Startpunkt för nästa anrop: vattenmärket om det finns, annars `default`.
+    NewsAPI tar emot tider i UTC utan tidszon.
+    """
+    if watermark is None:
+        return default
+    return watermark.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def filter_new_articles(data: dict, watermark: Optional[datetime]) -> dict:
+    """
+    Tar bort artiklar som inte är nyare än vattenmärket.
+
+    NewsAPI:s `from` är inklusive, så artikeln som satte vattenmärket
+    kommer tillbaka i nästa svar och måste sorteras bort här.
+
+    Returns:
+        dict: Samma svar med bara nya artiklar och `totalResults` uppdaterat.
+    """
+    articles = data.get('articles', [])
+    if watermark is not None:
+        articles = [article for article in articles
+                    if (parse_published_at(article.get('publishedAt'))
+                        or watermark) > watermark]
+    return {**data, "totalResults": len(articles), "articles": articles}
+
+
+def latest_published_at(articles: List[dict]) -> Optional[datetime]:
+    """Nyaste `publishedAt` bland artiklarna, eller None."""
+    published = [parse_published_at(article.get('publishedAt'))
+                 for article in articles]
+    published = [value for value in published if value is not None]
+    return max(published) if published else None
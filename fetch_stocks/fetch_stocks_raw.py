@@ -1,97 +1,229 @@
+import asyncio
 import os
 import json
-from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import httpx
 import requests
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 from google.cloud import bigquery
-from google.oauth2 import service_account
-from google.cloud import secretmanager
 import uvicorn
 from pydantic import BaseModel
-from google.auth import default
+from shared.gcp import cache_stats, get_bigquery_client, get_project_id, get_secret
+from intraday import (INTRADAY_FLUSH_ROWS, INTRADAY_INTERVALS, IntradayBuffer,
+                      get_intraday_latest, parse_intraday_payload)
+from shared.http_cache import (MODE_RECORD, MODE_REPLAY, CacheMissError,
+                               cache_key, get_response_cache, http_cache_stats)
+from shared.payload_codec import (ENCODING_ZLIB, ENCODING_ZLIB_DELTA,
+                                  STOCK_TIME_SERIES_KEY, encode_payload,
+                                  stock_payload_delta)
+from shared.rate_limit import (QuotaExhaustedError, RateLimitError,
+                               call_with_retry, call_with_retry_async,
+                               get_rate_limiter, rate_limit_stats)
+from shared.shard_leases import lease_table_id, run_sharded
+from shared.symbols import load_symbol_universe
 
-def get_project_id():
-    """Retrieve project ID from environment."""
-    #GOOGLE_CLOUD_PROJECT: This specific environment variable is used to store the Google Cloud project ID. 
-    #It allows the application to know which Google Cloud project it should interact with.
-    project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
 
-    if project_id is None:
-        # If not set, use google.auth.default to fetch the project ID
-        credentials, project_id = default()
-    
-    return project_id
+def get_stock_api_key():
+    """Returns the Alpha Vantage API key from the shared secret cache."""
+    return get_secret('STOCK_API_KEY')
 
-STOCK_API_KEY = None  # Initialize as None
 
-def get_stock_api_key():
-    global STOCK_API_KEY
-    if STOCK_API_KEY is None:  # Only fetch the key if it's not already set
-        STOCK_API_KEY = get_secret('STOCK_API_KEY')
-    return STOCK_API_KEY
+PROJECT_ID = get_project_id()
+RAW_DATA_TABLE_ID = get_secret('RAW_DATA_TABLE_ID') 
 
+# 'json' writes raw_stock_data rows. 'zlib' and 'zlib+delta' write compressed
+# raw_stock_data_compact rows, so RAW_DATA_TABLE_ID must point at such a table.
+RAW_PAYLOAD_ENCODING = os.getenv('RAW_PAYLOAD_ENCODING', 'json')
 
-def get_secret(secret_name='bigquery-accout-secret') -> str:
-    """Fetches a secret from Google Cloud Secret Manager.
+ALPHA_VANTAGE_URL = 'https://www.alphavantage.co/query'
 
-    Args:
-        secret_name (str): The name of the secret in Secret Manager.
+# outputsize=compact returns the latest 100 trading days, about 140 calendar days
+COMPACT_WINDOW_DAYS = 140
 
-    Returns:
-        str: The secret data as a string.
-    """
-    # Instansiera en klient för Secret Manager
-    client = secretmanager.SecretManagerServiceClient()
+# Shared connection pool for every Alpha Vantage call from this instance
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+HTTP_TIMEOUT = httpx.Timeout(30.0)
 
-    # Bygg sökvägen till den hemlighet du vill hämta
-    project_id = get_project_id()  # Ersätt med ditt projekt-ID
-    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
 
-    # Hämta den senaste versionen av hemligheten
-    response = client.access_secret_version(name=secret_path)
+# Intraday bars waiting for the next load job
+INTRADAY_BUFFER = IntradayBuffer()
 
-    # Dekoda hemligheten till en sträng
-    secret_data = response.payload.data.decode('UTF-8')
 
-    return secret_data
- 
-PROJECT_ID = get_project_id()
-RAW_DATA_TABLE_ID = get_secret('RAW_DATA_TABLE_ID') 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http_client = httpx.AsyncClient(limits=HTTP_LIMITS,
+                                              timeout=HTTP_TIMEOUT)
+    app.state.intraday_table_id = None
+    yield
+    await app.state.http_client.aclose()
+    # Write what is left before the instance goes away
+    if app.state.intraday_table_id and len(INTRADAY_BUFFER):
+        await asyncio.to_thread(INTRADAY_BUFFER.flush, get_bigquery_client(),
+                                app.state.intraday_table_id)
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # Define a Pydantic model for the stock request
 class StockRequest(BaseModel):
     stock_symbol: str
+    encoding: Optional[str] = None
+
+
+class StockBatchRequest(BaseModel):
+    stock_symbols: Optional[List[str]] = None  # defaults to the symbol universe
+    encoding: Optional[str] = None
+    # Always fetch the full history, e.g. to repair a table
+    force_full: Optional[bool] = False
+    # Above 1, the universe is split into hash shards leased by instance
+    shard_count: Optional[int] = 1
+    shard: Optional[int] = None
+    run_key: Optional[str] = None  # defaults to today's UTC date
+
+
+class IntradayRequest(BaseModel):
+    stock_symbols: Optional[List[str]] = None  # defaults to the symbol universe
+    interval: Optional[str] = '5min'
+    outputsize: Optional[str] = 'compact'
+    # False keeps the bars buffered until INTRADAY_FLUSH_ROWS is reached
+    flush: Optional[bool] = True
+
+def request_raw_stock_data(stock_symbol: str) -> dict:
+    """
+    Sends one TIME_SERIES_DAILY request to Alpha Vantage.
+
+    Args:
+        stock_symbol: The stock symbol to fetch data for.
+
+    Returns:
+        dict: The raw stock data fetched from the API.
+
+    Raises:
+        QuotaExhaustedError: If the daily request limit for the key is used up.
+        RateLimitError: If Alpha Vantage asks us to slow down.
+        ValueError: If the API response contains an error message.
+        requests.exceptions.RequestException: On network errors.
+    """
+    params = {
+        "function": "TIME_SERIES_DAILY",
+        "symbol": stock_symbol,
+        "apikey": get_stock_api_key(),
+    }
+    response = requests.get(ALPHA_VANTAGE_URL, params=params)
+    if response.status_code == 429:
+        raise RateLimitError("API Rate Limit Exceeded (HTTP 429)", retry_after=60)
+    if response.status_code >= 400:
+        # raise_for_status() would put the URL, and with it the API key, in the message
+        raise ValueError(f"HTTP {response.status_code} from Alpha Vantage for {stock_symbol}")
+    return check_stock_response(response.json())
+
+
+class PremiumFeatureError(ValueError):
+    """Alpha Vantage refused a parameter that the key's plan does not include."""
+
+
+# Wording of the replies that can be waited out. Other "Information" replies,
+# such as premium-only notices, fail the same way every time.
+RATE_LIMIT_MARKERS = ('rate limit', 'per minute', 'per second', 'spreading out')
+
+
+def check_stock_response(data: dict) -> dict:
+    """
+    Raises the matching error if an Alpha Vantage response is not data.
+
+    Alpha Vantage answers with HTTP 200 and a message instead of data when a
+    limit is hit, a premium feature is requested or the symbol is unknown.
+    Only the per-minute limit is raised as a retryable RateLimitError;
+    retrying anything else would spend the daily budget for nothing.
+    """
+    if "Information" in data:
+        information = data["Information"]
+        lowered = information.lower()
+        # The daily cap cannot be waited out, the per-minute cap can
+        if "per day" in lowered and "rate limit" in lowered:
+            raise QuotaExhaustedError(f"API Rate Limit Exceeded: {information}")
+        if any(marker in lowered for marker in RATE_LIMIT_MARKERS):
+            raise RateLimitError(f"API Rate Limit Exceeded: {information}", retry_after=60)
+        if "premium" in lowered:
+            raise PremiumFeatureError(f"API Error: {information}")
+        raise ValueError(f"API Error: {information}")
+
+    if "Error Message" in data:
+        raise ValueError(f"API Error: {data['Error Message']}")
+
+    return data
+
+
+async def request_raw_stock_data_async(client: httpx.AsyncClient,
+                                       stock_symbol: str,
+                                       api_key: str,
+                                       outputsize: str = 'compact',
+                                       interval: Optional[str] = None) -> dict:
+    """
+    Sends one TIME_SERIES_DAILY request without blocking the event loop.
+
+    Args:
+        client: Shared client with a keep-alive pool.
+        stock_symbol: The stock symbol to fetch data for.
+        api_key: The Alpha Vantage API key.
+        outputsize: 'compact' for the latest 100 bars or 'full' for all.
+        interval: If given, e.g. '5min', a TIME_SERIES_INTRADAY request
+            for that bar size is sent instead.
+
+    Returns:
+        dict: The raw stock data fetched from the API.
+    """
+    params = {
+        "function": "TIME_SERIES_DAILY",
+        "symbol": stock_symbol,
+        "outputsize": outputsize,
+        "apikey": api_key,
+    }
+    if interval is not None:
+        params.update(function="TIME_SERIES_INTRADAY", interval=interval)
+    response = await client.get(ALPHA_VANTAGE_URL, params=params)
+    if response.status_code == 429:
+        raise RateLimitError("API Rate Limit Exceeded (HTTP 429)", retry_after=60)
+    if response.status_code >= 400:
+        # httpx's own error includes the URL, and with it the API key
+        raise ValueError(f"HTTP {response.status_code} from Alpha Vantage for {stock_symbol}")
+    return check_stock_response(response.json())
+
 
 def fetch_raw_stock_data(stock_symbol: str) -> dict:
     """
     Fetches raw stock data from Alpha Vantage API and returns the data.
 
+    The request goes through the shared rate limiter for the API key, so it
+    waits for a free slot instead of tripping the per-minute limit, and is
+    retried with jittered backoff if Alpha Vantage still says slow down.
+    Responses also go through the response cache (HTTP_CACHE_MODE), so a
+    cached symbol costs neither a network call nor quota.
+
     Args:
         stock_symbol: The stock symbol to fetch data for.
 
     Returns:
         dict: The raw stock data fetched from the API.
     """
-    url = f'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={stock_symbol}&apikey={STOCK_API_KEY}'
-    
     try:
-        response = requests.get(url=url)
-        response.raise_for_status()
-        data = response.json()
-
-        if "Information" in data and "Alpha Vantage" in data["Information"]:
-            raise ValueError(f"API Rate Limit Exceeded: {data['Information']}")
+        key = cache_key('alphavantage', {'function': 'TIME_SERIES_DAILY',
+                                         'symbol': stock_symbol})
+        return get_response_cache('alphavantage').fetch(
+            key, call_with_retry, request_raw_stock_data, stock_symbol,
+            limiter=get_rate_limiter('alphavantage', get_stock_api_key()))
 
+    except CacheMissError as e:
+        print(f"Replay mode: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
 
-        if "Error Message" in data:
-            raise ValueError(f"API Error: {data['Error Message']}")
-
-        return data
+    except RateLimitError as e:
+        print(f"Rate limit reached: {e}")
+        raise HTTPException(status_code=429, detail=f"API rate limit: {e}")
 
     except requests.exceptions.RequestException as e:
         print(f"Network error or connection problem: {e}")
@@ -101,7 +233,125 @@ def fetch_raw_stock_data(stock_symbol: str) -> dict:
         print(f"Error in API response: {ve}")
         raise HTTPException(status_code=500, detail=f"API response error: {ve}")
 
-def save_raw_stock_data(stock_symbol: str, stock_data : dict, raw_data_table_id: str) -> JSONResponse:
+def get_latest_stored_dates(client, raw_data_table_id: str,
+                            stock_symbols: List[str]) -> Dict[str, str]:
+    """
+    Returns the newest bar date ('YYYY-MM-DD') stored per symbol, in one query.
+
+    Compact tables keep it in `latest_date`. For JSON tables it is read from
+    the payload's "3. Last Refreshed". Symbols without rows are left out.
+    """
+    schema = client.get_table(raw_data_table_id).schema
+    if any(field.name == 'latest_date' for field in schema):
+        latest = "latest_date"
+    else:
+        latest = """SAFE_CAST(SUBSTR(JSON_VALUE(raw_data, '$."Meta Data"."3. Last Refreshed"'), 1, 10) AS DATE)"""
+
+    query = f"""
+        SELECT stock_symbol, FORMAT_DATE('%Y-%m-%d', MAX({latest})) AS latest_date
+        FROM `{raw_data_table_id}`
+        WHERE stock_symbol IN UNNEST(@stock_symbols)
+        GROUP BY stock_symbol
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("stock_symbols", "STRING", list(stock_symbols))
+        ]
+    )
+    return {row.stock_symbol: row.latest_date
+            for row in client.query(query, job_config=job_config).result()
+            if row.latest_date is not None}
+
+
+def last_trading_day(today: date) -> date:
+    """The latest weekday on or before `today`. Holidays are not known."""
+    while today.weekday() >= 5:
+        today -= timedelta(days=1)
+    return today
+
+
+def choose_outputsize(latest_stored: Optional[str], today: date,
+                      force_full: bool = False) -> Optional[str]:
+    """
+    Picks the smallest Alpha Vantage response that covers the gap.
+
+    Returns:
+        str: None when the symbol is already up to date, 'compact' when the
+        gap fits in the latest 100 days, otherwise 'full'.
+    """
+    if force_full or latest_stored is None:
+        return 'full'
+    latest = datetime.strptime(latest_stored, '%Y-%m-%d').date()
+    if latest >= last_trading_day(today):
+        return None
+    if (today - latest).days < COMPACT_WINDOW_DAYS:
+        return 'compact'
+    return 'full'
+
+
+def get_latest_stored_date(client, raw_data_table_id: str, stock_symbol: str):
+    """
+    Returns the newest bar date ('YYYY-MM-DD') stored for the symbol in a
+    compact raw table, or None if the symbol has no rows yet.
+    """
+    query = f"""
+        SELECT FORMAT_DATE('%Y-%m-%d', MAX(latest_date)) AS latest_date
+        FROM `{raw_data_table_id}`
+        WHERE stock_symbol = @stock_symbol
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("stock_symbol", "STRING", stock_symbol)
+        ]
+    )
+    for row in client.query(query, job_config=job_config).result():
+        return row.latest_date
+    return None
+
+
+def build_raw_stock_row(stock_symbol: str, stock_data: dict, fetch_date: str,
+                        encoding: str = 'json', since_date: Optional[str] = None):
+    """
+    Builds the row to insert for one raw payload.
+
+    Args:
+        stock_symbol (str): The stock symbol.
+        stock_data (dict): The raw stock data to save.
+        fetch_date (str): When the payload was fetched.
+        encoding (str): 'json' for the raw_stock_data table, 'zlib' or
+            'zlib+delta' for the raw_stock_data_compact table.
+        since_date (str): For 'zlib+delta', the newest date already stored.
+
+    Returns:
+        dict: The row, or None when a delta holds no new bars.
+    """
+    if encoding == 'json':
+        return {
+            "stock_symbol": stock_symbol,
+            "raw_data": json.dumps(stock_data),
+            "fetch_date": fetch_date
+        }
+
+    if encoding == ENCODING_ZLIB_DELTA:
+        stock_data = stock_payload_delta(stock_data, since_date)
+    elif encoding != ENCODING_ZLIB:
+        raise ValueError(f"Unknown raw payload encoding '{encoding}'")
+
+    dates = stock_data.get(STOCK_TIME_SERIES_KEY, {}).keys()
+    if not dates:
+        return None
+
+    return {
+        "stock_symbol": stock_symbol,
+        "raw_data_z": encode_payload(stock_data),
+        "encoding": encoding,
+        "latest_date": max(dates),
+        "fetch_date": fetch_date
+    }
+
+
+def save_raw_stock_data(stock_symbol: str, stock_data : dict, raw_data_table_id: str,
+                        encoding: str = 'json', since_date: Optional[str] = None) -> JSONResponse:
     """
     Saves raw stock data to BigQuery.
 
@@ -109,22 +359,26 @@ def save_raw_stock_data(stock_symbol: str, stock_data : dict, raw_data_table_id:
         stock_symbol (str): The stock symbol.
         stock_data (dict): The raw stock data to save.
         raw_data_table_id (str): The ID of the BigQuery table to save the data to.
+        encoding (str): 'json' (default), 'zlib' or 'zlib+delta'. The
+            compressed encodings need a table of type raw_stock_data_compact.
+        since_date (str): Latest date already stored, if the caller knows
+            it. Saves a query for 'zlib+delta'.
     """
     try: 
         fetch_date = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
-        # Create a BigQuery client
-        credentials = service_account.Credentials.from_service_account_info(json.loads(get_secret()))
-        client = bigquery.Client(credentials=credentials, project=PROJECT_ID)
+        # Shared BigQuery client, built once per process
+        client = get_bigquery_client()
+
+        if encoding == ENCODING_ZLIB_DELTA and since_date is None:
+            since_date = get_latest_stored_date(client, raw_data_table_id, stock_symbol)
 
         # Prepare data for insertion
-        rows_to_insert = [
-            {
-                "stock_symbol": stock_symbol,
-                "raw_data": json.dumps(stock_data),
-                "fetch_date": fetch_date  
-            }
-        ]
+        row = build_raw_stock_row(stock_symbol, stock_data, fetch_date,
+                                  encoding=encoding, since_date=since_date)
+        if row is None:
+            return JSONResponse(content={"message": f"No new data since {since_date}."})
+        rows_to_insert = [row]
 
         # Insert rows into BigQuery
         errors = client.insert_rows_json(raw_data_table_id, rows_to_insert)
@@ -139,22 +393,279 @@ def save_raw_stock_data(stock_symbol: str, stock_data : dict, raw_data_table_id:
         raise HTTPException(status_code=500, detail=f"An error occurred while saving data: {e}")
 
 @app.post("/raw-stock-data/")
-async def handle_raw_stock_data(stock_request: StockRequest):
+def handle_raw_stock_data(stock_request: StockRequest):
+    # A plain def runs in FastAPI's thread pool, so the blocking calls below
+    # do not hold up the event loop
     try:
         # Fetch raw stock data
         data = fetch_raw_stock_data(stock_request.stock_symbol)
     
 
         # Save raw stock data to BigQuery
-        save_raw_stock_data(stock_symbol=stock_request.stock_symbol, stock_data=data, raw_data_table_id=get_secret('RAW_DATA_TABLE_ID') ) 
-        
-        return JSONResponse(content={"message": "Rows successfully inserted."})
+        return save_raw_stock_data(stock_symbol=stock_request.stock_symbol, stock_data=data, raw_data_table_id=get_secret('RAW_DATA_TABLE_ID'),
+                                   encoding=stock_request.encoding or RAW_PAYLOAD_ENCODING)
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# API keys that Alpha Vantage refused outputsize=full for
+_COMPACT_ONLY_KEYS = set()
+
+
+async def request_daily_cached(http_client: httpx.AsyncClient,
+                               stock_symbol: str, api_key: str,
+                               outputsize: str) -> dict:
+    """One daily request through the response cache and the rate limiter."""
+    key = cache_key('alphavantage', {'function': 'TIME_SERIES_DAILY',
+                                     'symbol': stock_symbol,
+                                     'outputsize': outputsize})
+    return await get_response_cache('alphavantage').fetch_async(
+        key, call_with_retry_async, request_raw_stock_data_async,
+        http_client, stock_symbol, api_key, outputsize,
+        limiter=get_rate_limiter('alphavantage', api_key))
+
+
+async def fetch_and_save_symbol(http_client: httpx.AsyncClient,
+                                stock_symbol: str,
+                                api_key: str,
+                                outputsize: str,
+                                raw_data_table_id: str,
+                                encoding: str,
+                                since_date: Optional[str]) -> dict:
+    """
+    Fetches and stores one symbol for the batch endpoint.
+
+    The API call is awaited on the shared client and the BigQuery insert runs
+    in a worker thread, so other symbols keep going meanwhile.
+
+    outputsize=full is a premium feature. Once a key has been refused it,
+    this and later symbols for that key fall back to compact.
+    """
+    if outputsize == 'full' and api_key in _COMPACT_ONLY_KEYS:
+        outputsize = 'compact'
+    try:
+        data = await request_daily_cached(http_client, stock_symbol, api_key,
+                                          outputsize)
+    except PremiumFeatureError:
+        if outputsize != 'full':
+            raise
+        print(f"outputsize=full is premium for this key, using compact for {stock_symbol}")
+        _COMPACT_ONLY_KEYS.add(api_key)
+        outputsize = 'compact'
+        data = await request_daily_cached(http_client, stock_symbol, api_key,
+                                          outputsize)
+
+    response = await asyncio.to_thread(save_raw_stock_data,
+                                       stock_symbol=stock_symbol,
+                                       stock_data=data,
+                                       raw_data_table_id=raw_data_table_id,
+                                       encoding=encoding,
+                                       since_date=since_date)
+    return {**json.loads(response.body), "outputsize": outputsize,
+            "latest_stored_date": since_date}
+
+
+async def fetch_symbols(symbols: List[str], api_key: str, raw_data_table_id: str,
+                        bq_client: bigquery.Client, encoding: str,
+                        force_full: bool = False) -> dict:
+    """
+    Fetches and stores raw data for several symbols concurrently.
+
+    One query reads the latest stored date for every symbol. Symbols that
+    are up to date are skipped, and the rest request outputsize=compact
+    when the gap fits in the last 100 days and full otherwise. The calls
+    share the rate limiter, so they queue within the key's limits.
+
+    Returns:
+        dict: A summary message and the result or error per symbol.
+    """
+    latest_dates = await asyncio.to_thread(get_latest_stored_dates,
+                                           bq_client, raw_data_table_id,
+                                           symbols)
+
+    today = datetime.now(timezone.utc).date()
+    plans = {symbol: choose_outputsize(latest_dates.get(symbol), today, force_full)
+             for symbol in symbols}
+    pending = [symbol for symbol, outputsize in plans.items() if outputsize]
+
+    outcomes = await asyncio.gather(
+        *(fetch_and_save_symbol(app.state.http_client, symbol, api_key,
+                                plans[symbol], raw_data_table_id, encoding,
+                                latest_dates.get(symbol))
+          for symbol in pending),
+        return_exceptions=True)
+
+    results = {symbol: {"message": "Already up to date.",
+                        "latest_stored_date": latest_dates.get(symbol)}
+               for symbol, outputsize in plans.items() if outputsize is None}
+    errors = {}
+    for symbol, outcome in zip(pending, outcomes):
+        if isinstance(outcome, HTTPException):
+            errors[symbol] = outcome.detail
+        elif isinstance(outcome, Exception):
+            errors[symbol] = str(outcome) or type(outcome).__name__
+        else:
+            results[symbol] = outcome
+
+    return {"message": f"Fetched {len(pending) - len(errors)} of {len(symbols)} symbols, {len(symbols) - len(pending)} already up to date.",
+            "results": results,
+            "errors": errors}
+
+
+@app.post("/raw-stock-data/batch/")
+async def handle_raw_stock_data_batch(stock_request: StockBatchRequest):
+    """
+    Fetches and stores raw data for several symbols concurrently, see
+    `fetch_symbols`. The response holds the result or error per symbol.
+
+    With shard_count above 1 the symbol universe is split into hash shards.
+    This instance leases and fetches open shards until none are left, or
+    only `shard` if given, so several instances can share a large universe
+    without fetching a symbol twice.
+    """
+    encoding = stock_request.encoding or RAW_PAYLOAD_ENCODING
+    symbols = list(dict.fromkeys(stock_request.stock_symbols or load_symbol_universe()))
+    try:
+        api_key, raw_data_table_id, bq_client = await asyncio.gather(
+            asyncio.to_thread(get_stock_api_key),
+            asyncio.to_thread(get_secret, 'RAW_DATA_TABLE_ID'),
+            asyncio.to_thread(get_bigquery_client))
+
+        shard_count = stock_request.shard_count or 1
+        if shard_count == 1 and stock_request.shard is None:
+            return await fetch_symbols(symbols, api_key, raw_data_table_id,
+                                       bq_client, encoding, stock_request.force_full)
+
+        # Lease-logiken är synkron och körs i en tråd; varje shard hämtas
+        # i den här event-loopen så att klienten och rate-limitern delas
+        loop = asyncio.get_running_loop()
+
+        def process(shard_symbols: List[str]) -> dict:
+            outcome = asyncio.run_coroutine_threadsafe(
+                fetch_symbols(shard_symbols, api_key, raw_data_table_id,
+                              bq_client, encoding, stock_request.force_full),
+                loop).result()
+            if outcome["errors"] and not outcome["results"]:
+                # Hela sharden misslyckades, så den ska kunna tas om
+                raise RuntimeError(f"All symbols failed: {outcome['errors']}")
+            return outcome
+
+        sharded = await asyncio.to_thread(
+            run_sharded, bq_client, lease_table_id(raw_data_table_id),
+            'fetch_stocks', symbols, shard_count, process,
+            run_key=stock_request.run_key,
+            shards=None if stock_request.shard is None else [stock_request.shard])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {"message": f"Fetched {len(sharded['shards'])} of {shard_count} shards.",
+            **sharded}
+
+
+async def fetch_intraday_symbol(http_client: httpx.AsyncClient,
+                                stock_symbol: str,
+                                api_key: str,
+                                interval: str,
+                                outputsize: str) -> int:
+    """Fetches one symbol's intraday bars into the buffer. Returns new bars."""
+    limiter = get_rate_limiter('alphavantage', api_key)
+    cache = get_response_cache('alphavantage')
+    # Intraday data goes stale within minutes, so the cache is only used to
+    # record and replay runs, never to serve a fresh request
+    if cache.mode in (MODE_RECORD, MODE_REPLAY):
+        key = cache_key('alphavantage', {'function': 'TIME_SERIES_INTRADAY',
+                                         'symbol': stock_symbol,
+                                         'interval': interval,
+                                         'outputsize': outputsize})
+        data = await cache.fetch_async(key, call_with_retry_async,
+                                       request_raw_stock_data_async,
+                                       http_client, stock_symbol, api_key,
+                                       outputsize, interval, limiter=limiter)
+    else:
+        data = await call_with_retry_async(request_raw_stock_data_async,
+                                           http_client, stock_symbol, api_key,
+                                           outputsize, interval, limiter=limiter)
+
+    bars = await asyncio.to_thread(parse_intraday_payload, data, interval,
+                                   INTRADAY_BUFFER.latest(stock_symbol, interval))
+    return INTRADAY_BUFFER.extend(stock_symbol, interval, bars)
+
+
+@app.post("/raw-stock-data/intraday/")
+async def handle_intraday_stock_data(request: IntradayRequest):
+    """
+    Fetches intraday bars for several symbols into the in-memory buffer.
+
+    Only bars newer than the latest stored one are kept. The buffer is
+    written to the day-partitioned INTRADAY_TABLE_ID table in one load job
+    when it reaches INTRADAY_FLUSH_ROWS bars, at the end of the request
+    (unless flush is false) and when the instance shuts down.
+    """
+    if request.interval not in INTRADAY_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {INTRADAY_INTERVALS}")
+
+    symbols = list(dict.fromkeys(request.stock_symbols or load_symbol_universe()))
+    try:
+        api_key, table_id, bq_client = await asyncio.gather(
+            asyncio.to_thread(get_stock_api_key),
+            asyncio.to_thread(get_secret, 'INTRADAY_TABLE_ID'),
+            asyncio.to_thread(get_bigquery_client))
+        app.state.intraday_table_id = table_id
+
+        # After a restart, read where each series stopped from the table
+        unknown = [(symbol, request.interval) for symbol in symbols
+                   if not INTRADAY_BUFFER.known(symbol, request.interval)]
+        if unknown:
+            stored = await asyncio.to_thread(get_intraday_latest, bq_client,
+                                             table_id, unknown)
+            for symbol, interval in unknown:
+                INTRADAY_BUFFER.set_latest(symbol, interval,
+                                           stored.get((symbol, interval)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    outcomes = await asyncio.gather(
+        *(fetch_intraday_symbol(app.state.http_client, symbol, api_key,
+                                request.interval, request.outputsize)
+          for symbol in symbols),
+        return_exceptions=True)
+
+    results = {}
+    errors = {}
+    for symbol, outcome in zip(symbols, outcomes):
+        if isinstance(outcome, Exception):
+            errors[symbol] = str(outcome) or type(outcome).__name__
+        else:
+            results[symbol] = {"new_bars": outcome}
+
+    flushed = 0
+    if request.flush or len(INTRADAY_BUFFER) >= INTRADAY_FLUSH_ROWS:
+        try:
+            flushed = await asyncio.to_thread(INTRADAY_BUFFER.flush, bq_client,
+                                              table_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Bars fetched but not written, they stay buffered: {e}")
+
+    return {"message": f"Fetched {request.interval} bars for {len(results)} of {len(symbols)} symbols.",
+            "rows_flushed": flushed,
+            "buffer": INTRADAY_BUFFER.stats(),
+            "results": results,
+            "errors": errors}
+
+
+@app.get("/cache-stats/")
+def get_cache_stats():
+    """Hit/miss counters for the secret, client and API response caches."""
+    return {**cache_stats(), "http": http_cache_stats()}
+
+
+@app.get("/rate-limits/")
+def get_rate_limits():
+    """Daily usage and queueing time per API key on this instance."""
+    return rate_limit_stats()
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
@@ -0,0 +1,281 @@
+import io
+import threading
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+
+INTRADAY_INTERVALS = ("1min", "5min", "15min", "30min", "60min")
+
+# Flush to BigQuery once this many bars are buffered
+INTRADAY_FLUSH_ROWS = 50_000
+
+INTRADAY_SCHEMA = [
+    bigquery.SchemaField("stock_symbol", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("interval", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("open", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("high", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("low", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("close", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("volume", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("fetch_date", "TIMESTAMP", mode="NULLABLE"),
+]
+
+# The same columns as Arrow types. REQUIRED columns are non-nullable so the
+# Parquet file matches the table's modes.
+INTRADAY_ARROW_SCHEMA = pa.schema([
+    pa.field("stock_symbol", pa.dictionary(pa.int32(), pa.string()), nullable=False),
+    pa.field("interval", pa.dictionary(pa.int32(), pa.string()), nullable=False),
+    pa.field("timestamp", pa.timestamp("s", tz="UTC"), nullable=False),
+    pa.field("open", pa.float64()),
+    pa.field("high", pa.float64()),
+    pa.field("low", pa.float64()),
+    pa.field("close", pa.float64()),
+    pa.field("volume", pa.int64()),
+    pa.field("fetch_date", pa.timestamp("s", tz="UTC")),
+])
+
+
+def _arrow_view(values: array, type_: pa.DataType) -> pa.Array:
+    """Wraps a typed array's buffer as an Arrow array without copying it."""
+    return pa.Array.from_buffers(type_, len(values), [None, pa.py_buffer(values)])
+
+
+def parse_intraday_payload(payload: dict, interval: str,
+                           after: Optional[int] = None) -> List[Tuple]:
+    """
+    Turns a TIME_SERIES_INTRADAY response into bars.
+
+    Alpha Vantage gives local exchange times, with the zone in the
+    payload's Meta Data. They are converted to UTC epoch seconds here.
+
+    Args:
+        payload (dict): The raw API response.
+        interval (str): The interval that was requested, e.g. '5min'.
+        after (int): Only keep bars newer than this epoch second.
+
+    Returns:
+        list: (epoch_seconds, open, high, low, close, volume), oldest first.
+    """
+    meta = payload.get("Meta Data", {})
+    zone_name = next((value for key, value in meta.items()
+                      if key.endswith("Time Zone")), "US/Eastern")
+    zone = ZoneInfo(zone_name)
+
+    bars = []
+    for stamp, bar in payload.get(f"Time Series ({interval})", {}).items():
+        local = datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=zone)
+        epoch = int(local.timestamp())
+        if after is not None and epoch <= after:
+            continue
+        bars.append((epoch,
+                     float(bar["1. open"]),
+                     float(bar["2. high"]),
+                     float(bar["3. low"]),
+                     float(bar["4. close"]),
+                     int(bar["5. volume"])))
+    bars.sort()
+    return bars
+
+
+class IntradayBuffer:
+    """
+    Column-wise in-memory buffer for intraday bars.
+
+    Bars are kept in typed arrays (8 bytes per number) instead of one dict
+    per row, and the symbol and interval are stored as small integer codes.
+    `flush` turns the arrays into an Arrow table without a per-bar loop and
+    writes it in one Parquet load job, which is free, unlike streaming
+    inserts, and lands in the day partitions of the table.
+
+    The buffer also remembers the newest bar per symbol and interval, so
+    overlapping API responses only add bars that are new.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._labels = []  # code -> (symbol, interval)
+        self._codes = {}   # (symbol, interval) -> code
+        self._latest = {}  # (symbol, interval) -> epoch seconds
+        self._reset()
+        self.flushed_rows = 0
+        self.flushes = 0
+
+    def _reset(self):
+        self._series = array("H")
+        self._timestamp = array("q")
+        self._open = array("d")
+        self._high = array("d")
+        self._low = array("d")
+        self._close = array("d")
+        self._volume = array("q")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._timestamp)
+
+    def latest(self, symbol: str, interval: str) -> Optional[int]:
+        with self._lock:
+            return self._latest.get((symbol, interval))
+
+    def known(self, symbol: str, interval: str) -> bool:
+        with self._lock:
+            return (symbol, interval) in self._latest
+
+    def set_latest(self, symbol: str, interval: str, epoch: Optional[int]):
+        """Seeds the high-water mark, e.g. from the table after a restart."""
+        with self._lock:
+            current = self._latest.get((symbol, interval))
+            if current is None or (epoch is not None and epoch > current):
+                self._latest[(symbol, interval)] = epoch
+
+    def extend(self, symbol: str, interval: str, bars: List[Tuple]) -> int:
+        """Buffers the bars newer than the high-water mark. Returns the count."""
+        with self._lock:
+            key = (symbol, interval)
+            latest = self._latest.get(key)
+            if latest is not None:
+                bars = [bar for bar in bars if bar[0] > latest]
+            if not bars:
+                return 0
+
+            code = self._codes.get(key)
+            if code is None:
+                code = self._codes[key] = len(self._labels)
+                self._labels.append(key)
+
+            self._series.extend([code] * len(bars))
+            timestamps, opens, highs, lows, closes, volumes = zip(*bars)
+            self._timestamp.extend(timestamps)
+            self._open.extend(opens)
+            self._high.extend(highs)
+            self._low.extend(lows)
+            self._close.extend(closes)
+            self._volume.extend(volumes)
+            self._latest[key] = max(timestamps)
+            return len(bars)
+
+    def _take(self):
+        with self._lock:
+            columns = (self._series, self._timestamp, self._open, self._high,
+                       self._low, self._close, self._volume)
+            labels = list(self._labels)
+            self._reset()
+            return columns, labels
+
+    def to_arrow(self, columns, labels, fetch_date: datetime) -> pa.Table:
+        """
+        Builds the load table straight from the buffered arrays.
+
+        The series codes become the indices of two dictionary columns, so
+        each symbol and interval string is stored once.
+        """
+        series, timestamps, opens, highs, lows, closes, volumes = columns
+        codes = _arrow_view(series, pa.uint16()).cast(pa.int32())
+        symbols = pa.array([symbol for symbol, _ in labels], pa.string())
+        intervals = pa.array([interval for _, interval in labels], pa.string())
+        return pa.table({
+            "stock_symbol": pa.DictionaryArray.from_arrays(codes, symbols),
+            "interval": pa.DictionaryArray.from_arrays(codes, intervals),
+            "timestamp": _arrow_view(timestamps, pa.int64()).cast(pa.timestamp("s", tz="UTC")),
+            "open": _arrow_view(opens, pa.float64()),
+            "high": _arrow_view(highs, pa.float64()),
+            "low": _arrow_view(lows, pa.float64()),
+            "close": _arrow_view(closes, pa.float64()),
+            "volume": _arrow_view(volumes, pa.int64()),
+            "fetch_date": pa.repeat(pa.scalar(fetch_date, pa.timestamp("s", tz="UTC")),
+                                    len(timestamps)),
+        }, schema=INTRADAY_ARROW_SCHEMA)
+
+    def to_parquet(self, columns, labels, fetch_date: datetime) -> io.BytesIO:
+        buffer = io.BytesIO()
+        pq.write_table(self.to_arrow(columns, labels, fetch_date), buffer)
+        buffer.seek(0)
+        return buffer
+
+    def flush(self, client: bigquery.Client, table_id: str) -> int:
+        """
+        Loads everything buffered into `table_id` in one load job.
+
+        If the load fails the bars are put back, so a later flush retries.
+
+        Returns:
+            int: Number of bars written.
+        """
+        with self._flush_lock:
+            columns, labels = self._take()
+            rows = len(columns[1])
+            if rows == 0:
+                return 0
+
+            fetch_date = datetime.now(timezone.utc).replace(microsecond=0)
+            job_config = bigquery.LoadJobConfig(
+                schema=INTRADAY_SCHEMA,
+                source_format=bigquery.SourceFormat.PARQUET,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                time_partitioning=bigquery.TimePartitioning(
+                    type_=bigquery.TimePartitioningType.DAY, field="timestamp"),
+                clustering_fields=["stock_symbol", "interval"],
+            )
+            try:
+                client.load_table_from_file(
+                    self.to_parquet(columns, labels, fetch_date),
+                    table_id, job_config=job_config).result()
+            except Exception:
+                self._restore(columns)
+                raise
+
+            self.flushed_rows += rows
+            self.flushes += 1
+            return rows
+
+    def _restore(self, columns):
+        """Puts taken bars back in front of anything buffered since."""
+        with self._lock:
+            # Koderna ändras aldrig, så kolumnerna kan läggas tillbaka som de är
+            series, timestamps, opens, highs, lows, closes, volumes = columns
+            self._series = series + self._series
+            self._timestamp = timestamps + self._timestamp
+            self._open = opens + self._open
+            self._high = highs + self._high
+            self._low = lows + self._low
+            self._close = closes + self._close
+            self._volume = volumes + self._volume
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = len(self._timestamp)
+        return {"buffered_rows": buffered,
+                "buffered_bytes": buffered * (2 + 6 * 8),
+                "flushed_rows": self.flushed_rows,
+                "flushes": self.flushes}
+
+
+def get_intraday_latest(client: bigquery.Client, table_id: str,
+                        keys: List[Tuple[str, str]],
+                        lookback_days: int = 7) -> Dict[Tuple[str, str], int]:
+    """
+    Newest stored bar per (symbol, interval), as epoch seconds.
+
+    Only the last `lookback_days` partitions are scanned.
+    """
+    query = f"""
+        SELECT stock_symbol, interval, UNIX_SECONDS(MAX(timestamp)) AS latest
+        FROM `{table_id}`
+        WHERE timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(lookback_days)} DAY)
+          AND stock_symbol IN UNNEST(@stock_symbols)
+        GROUP BY stock_symbol, interval
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("stock_symbols", "STRING",
+                                         sorted({symbol for symbol, _ in keys}))
+        ]
+    )
+    return {(row.stock_symbol, row.interval): row.latest
+            for row in client.query(query, job_config=job_config).result()}
@@ -0,0 +1,81 @@
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+import requests
+from fastapi.testclient import TestClient
+import fetch_stocks_raw
+from fetch_stocks_raw import (ALPHA_VANTAGE_URL, COMPACT_WINDOW_DAYS, app,
+                              choose_outputsize, last_trading_day,
+                              request_raw_stock_data)
+
+
+def test_request_raw_stock_data_keeps_key_out_of_url():
+    with patch.object(fetch_stocks_raw, "get_stock_api_key", return_value="secret-key"), \
+            patch("requests.get") as mock_get:
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {"Time Series (Daily)": {}}
+        request_raw_stock_data("AAPL")
+
+    assert mock_get.call_args.args == (ALPHA_VANTAGE_URL,)
+    assert mock_get.call_args.kwargs["params"] == {
+        "function": "TIME_SERIES_DAILY", "symbol": "AAPL", "apikey": "secret-key"}
+
+
+def test_request_raw_stock_data_http_error_hides_key():
+    response = requests.Response()
+    response.status_code = 500
+    response.url = f"{ALPHA_VANTAGE_URL}?apikey=secret-key"
+    with patch.object(fetch_stocks_raw, "get_stock_api_key", return_value="secret-key"), \
+            patch("requests.get", return_value=response):
+        with pytest.raises(ValueError) as caught:
+            request_raw_stock_data("AAPL")
+
+    assert "secret-key" not in str(caught.value)
+
+
+WEDNESDAY = date(2024, 5, 15)
+
+
+@pytest.mark.parametrize("latest_stored, today, force_full, expected", [
+    (None, WEDNESDAY, False, "full"),
+    ("2024-05-14", WEDNESDAY, True, "full"),
+    ("2024-05-15", WEDNESDAY, False, None),
+    # Fredagens stapel är den senaste en söndag
+    ("2024-05-17", date(2024, 5, 19), False, None),
+    ("2024-05-14", WEDNESDAY, False, "compact"),
+    (str(WEDNESDAY - timedelta(days=COMPACT_WINDOW_DAYS - 1)), WEDNESDAY, False, "compact"),
+    (str(WEDNESDAY - timedelta(days=COMPACT_WINDOW_DAYS)), WEDNESDAY, False, "full"),
+])
+def test_choose_outputsize(latest_stored, today, force_full, expected):
+    assert choose_outputsize(latest_stored, today, force_full) == expected
+
+
+def test_batch_endpoint_picks_outputsize_per_symbol():
+    today = datetime.now(timezone.utc).date()
+    latest_dates = {
+        "AAPL": str(last_trading_day(today)),
+        "MSFT": str(today - timedelta(days=10)),
+        "TSLA": str(today - timedelta(days=COMPACT_WINDOW_DAYS + 30)),
+    }
+
+    async def fetch_and_save(http_client, symbol, api_key, outputsize,
+                             raw_data_table_id, encoding, since_date):
+        return {"message": "saved", "outputsize": outputsize,
+                "latest_stored_date": since_date}
+
+    with patch.object(fetch_stocks_raw, "get_stock_api_key", return_value="key"), \
+            patch.object(fetch_stocks_raw, "get_secret", return_value="p.d.raw"), \
+            patch.object(fetch_stocks_raw, "get_bigquery_client", return_value=MagicMock()), \
+            patch.object(fetch_stocks_raw, "get_latest_stored_dates", return_value=latest_dates), \
+            patch.object(fetch_stocks_raw, "fetch_and_save_symbol",
+                         AsyncMock(side_effect=fetch_and_save)) as mock_fetch, \
+            TestClient(app) as client:
+        response = client.post("/raw-stock-data/batch/", json={
+            "stock_symbols": ["AAPL", "MSFT", "TSLA", "NVDA"]})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results["AAPL"]["message"] == "Already up to date."
+    assert {symbol: results[symbol]["outputsize"] for symbol in ("MSFT", "TSLA", "NVDA")} == {
+        "MSFT": "compact", "TSLA": "full", "NVDA": "full"}
+    assert mock_fetch.await_count == 3
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+import pyarrow.parquet as pq
+from intraday import INTRADAY_ARROW_SCHEMA, IntradayBuffer, parse_intraday_payload
+
+FETCH_DATE = datetime(2024, 5, 1, 21, 0, tzinfo=timezone.utc)
+
+
+def bars(*epochs):
+    return [(epoch, 1.0 + i, 2.0 + i, 0.5 + i, 1.5 + i, 100 * (i + 1))
+            for i, epoch in enumerate(epochs)]
+
+
+def test_parse_intraday_payload_converts_exchange_time_to_utc():
+    payload = {
+        "Meta Data": {"6. Time Zone": "US/Eastern"},
+        "Time Series (5min)": {
+            "2024-05-01 09:35:00": {"1. open": "2", "2. high": "3", "3. low": "1",
+                                    "4. close": "2.5", "5. volume": "20"},
+            "2024-05-01 09:30:00": {"1. open": "1", "2. high": "2", "3. low": "0.5",
+                                    "4. close": "1.5", "5. volume": "10"},
+        },
+    }
+    opening = int(datetime(2024, 5, 1, 13, 30, tzinfo=timezone.utc).timestamp())
+
+    assert parse_intraday_payload(payload, "5min") == [
+        (opening, 1.0, 2.0, 0.5, 1.5, 10), (opening + 300, 2.0, 3.0, 1.0, 2.5, 20)]
+    assert [bar[0] for bar in parse_intraday_payload(payload, "5min", after=opening)] == [
+        opening + 300]
+
+
+def test_extend_skips_bars_at_or_before_the_high_water_mark():
+    buffer = IntradayBuffer()
+
+    assert buffer.extend("AAPL", "5min", bars(100, 200)) == 2
+    assert buffer.extend("AAPL", "5min", bars(200, 300)) == 1
+    assert buffer.extend("MSFT", "5min", bars(200)) == 1
+    assert len(buffer) == 4
+    assert buffer.latest("AAPL", "5min") == 300
+
+
+def test_to_arrow_builds_typed_columns_from_the_buffer():
+    buffer = IntradayBuffer()
+    buffer.extend("AAPL", "5min", bars(100, 200))
+    buffer.extend("MSFT", "1min", bars(150))
+
+    columns, labels = buffer._take()
+    table = buffer.to_arrow(columns, labels, FETCH_DATE)
+
+    assert table.schema == INTRADAY_ARROW_SCHEMA
+    assert table.column("stock_symbol").to_pylist() == ["AAPL", "AAPL", "MSFT"]
+    assert table.column("interval").to_pylist() == ["5min", "5min", "1min"]
+    # Varje symbol lagras en gång i ordboken
+    assert table.column("stock_symbol").chunk(0).dictionary.to_pylist() == ["AAPL", "MSFT"]
+    assert [stamp.timestamp() for stamp in table.column("timestamp").to_pylist()] == [100, 200, 150]
+    assert table.column("open").to_pylist() == [1.0, 2.0, 1.0]
+    assert table.column("volume").to_pylist() == [100, 200, 100]
+    assert set(table.column("fetch_date").to_pylist()) == {FETCH_DATE}
+    # Bufferten är tom efter _take, men minns vattenmärkena
+    assert len(buffer) == 0
+    assert buffer.extend("AAPL", "5min", bars(200)) == 0
+
+
+def test_to_parquet_round_trips():
+    buffer = IntradayBuffer()
+    buffer.extend("AAPL", "5min", bars(100, 200, 300))
+    columns, labels = buffer._take()
+
+    table = pq.read_table(buffer.to_parquet(columns, labels, FETCH_DATE))
+
+    assert table.num_rows == 3
+    assert table.column("stock_symbol").to_pylist() == ["AAPL"] * 3
+    assert table.column("close").to_pylist() == [1.5, 2.5, 3.5]
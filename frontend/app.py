@@ -3,7 +3,9 @@ import plotly.graph_objs as go
 import json
 import pandas as pd
 import plotly
-from google.cloud import secretmanager, bigquery
+from shared import gcp as shared_gcp
+
+PROJECT_ID = "tomastestproject-433206"
 
 
 def get_secret(secret_name="bigquery-accout-secret") -> str:
@@ -15,30 +17,13 @@ def get_secret(secret_name="bigquery-accout-secret") -> str:
     Returns:
         str: The secret data as a string.
     """
-    # Insantiate a Secret Manager client
-    client = secretmanager.SecretManagerServiceClient()
-
-    # Set the secret path
-    project_id = "tomastestproject-433206" 
-    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-
-    # Access the secret version
-    response = client.access_secret_version(name=secret_path)
-
-    # decode the secret data
-    secret_data = response.payload.data.decode("UTF-8")
-
-    return secret_data
+    # Cached with a TTL in the shared access layer, see shared/gcp.py
+    return shared_gcp.get_secret(secret_name, project_id=PROJECT_ID)
 
 
 def get_data_from_bigquery() -> pd.DataFrame:
-    secret_data = get_secret()
-
-    # Load the json data into a dictionary
-    service_account_info = json.loads(secret_data)
-
-    # Initialize a BigQuery client
-    client = bigquery.Client.from_service_account_info(service_account_info)
+    # Shared BigQuery client, built on the first request only
+    client = shared_gcp.get_bigquery_client(project_id=PROJECT_ID)
 
     # Query to fetch the latest predictions and stock data
     query = """
@@ -1,17 +1,10 @@
 import os
-from google.cloud import secretmanager
+from shared.gcp import get_secret
 
 
 def load_env_from_secret(secret_name: str, project_id: str):
-    # Skapa en klient för Secret Manager
-    client = secretmanager.SecretManagerServiceClient()
-
-    # Bygg sökvägen till hemligheten
-    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-
-    # Hämta och dekoda hemligheten
-    response = client.access_secret_version(name=secret_path)
-    secret_data = response.payload.data.decode('UTF-8')
+    # Hämta hemligheten via den delade cachen
+    secret_data = get_secret(secret_name, project_id=project_id)
 
     # Ladda miljövariabler från hemligheten
     for line in secret_data.splitlines():
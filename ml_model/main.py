@@ -1,7 +1,8 @@
 from pipline_to_ml import get_data_by_company, calculate_rolling_average, transform_data_to_model, train_model, make_prediction, transform_predictions_for_bq, save_predictions_to_big_query, save_model, get_latest_date, insert_true_value_to_bigquery
 from load_env import load_env_from_secret
+from shared.symbols import load_symbol_universe
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional , List
 import os
 from datetime import datetime, timedelta, timezone
@@ -12,7 +13,7 @@ load_env_from_secret(project_id=os.getenv("PROJECT_ID"),
 app = FastAPI()
 
 class ModelRequest(BaseModel):
-    company_list: Optional[List[str]] = ['AAPL', 'GOOGL', 'TSLA', 'AMZN', 'MSFT']
+    company_list: Optional[List[str]] = Field(default_factory=load_symbol_universe)
     project_id: Optional[str] = os.getenv("PROJECT_ID")
     dataset: Optional[str] = os.getenv("DATA_SET")
     table_from: Optional[str] = 'avg_scores_and_stock_data_right'
@@ -57,7 +58,8 @@ def train_model_endpoint(request: ModelRequest):
 
         # Train the model
         try:
-            models, predictions_rows, date = train_model(df_rolling_avg)
+            models, predictions_rows, date = train_model(
+                df_rolling_avg, company_list=request.company_list)
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Error training the model: {str(e)}")
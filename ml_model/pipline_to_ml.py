@@ -1,14 +1,13 @@
 import io
 import pandas as pd
 import json
-from google.cloud import bigquery
-from google.cloud import secretmanager
+from shared import gcp as shared_gcp
+from shared.symbols import load_symbol_universe
 from google.api_core.exceptions import GoogleAPICallError, NotFound, BadRequest
-from typing import List
+from typing import List, Optional
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LinearRegression
 import joblib
-from google.cloud import storage
 from datetime import datetime, timedelta, timezone
 import pandas_market_calendars as mcal
 import numpy as np
@@ -25,11 +24,7 @@ def get_secret(project_id: str, secret_name = 'bigquery-accout-secret') -> str:
         str: The secret data as a string.
     """
     try:
-        client = secretmanager.SecretManagerServiceClient()
-        secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-        response = client.access_secret_version(name=secret_path)
-        secret_data = response.payload.data.decode('UTF-8')
-        return secret_data
+        return shared_gcp.get_secret(secret_name, project_id=project_id)
     except NotFound:
         raise Exception(
             f"Secret '{secret_name}' not found in project '{project_id}'.")
@@ -52,10 +47,8 @@ def get_data_by_company(company: List[str],
     :return: A pandas DataFrame containing the query results filtered by the specified companies.
     """
     try:
-        secret_data = get_secret(project_id=os.getenv("PROJECT_ID"))
-        service_account_info = json.loads(secret_data)
-        client = bigquery.Client.from_service_account_info(
-            service_account_info)
+        client = shared_gcp.get_bigquery_client(
+            project_id=os.getenv("PROJECT_ID"))
 
         view_id = f"{project_id}.{dataset}.{table}"
         company_str = ", ".join([f"'{c}'" for c in company])
@@ -183,10 +176,8 @@ def save_predictions_to_big_query(data: list,
     :param table: BigQuery table name.
     """
     try:
-        secret_data = get_secret(project_id=os.getenv("PROJECT_ID"))
-        service_account_info = json.loads(secret_data)
-        client = bigquery.Client.from_service_account_info(
-            service_account_info)
+        client = shared_gcp.get_bigquery_client(
+            project_id=os.getenv("PROJECT_ID"))
 
         table_id = f"{project_id}.{dataset}.{table}"
 
@@ -206,7 +197,7 @@ def save_predictions_to_big_query(data: list,
         raise Exception(f"Failed to save predictions to BigQuery: {e}")
 
 
-def train_model(df: pd.DataFrame, company_list=['AAPL', 'GOOGL', 'TSLA', 'AMZN', 'MSFT']) -> dict:
+def train_model(df: pd.DataFrame, company_list: Optional[List[str]] = None) -> dict:
     """
     Trains a linear regression model for each company in the given list using their historical data.
 
@@ -220,8 +211,9 @@ def train_model(df: pd.DataFrame, company_list=['AAPL', 'GOOGL', 'TSLA', 'AMZN',
         df (pd.DataFrame): A DataFrame containing the historical data for multiple companies,
                            with columns including 'company', 'pub_date', 'target', and feature columns.
         company_list (list of str, optional): A list of company identifiers (e.g., stock ticker symbols)
-                                              for which models will be trained. Default is
-                                              ['AAPL', 'GOOGL', 'TSLA', 'AMZN', 'MSFT'].
+                                              for which models will be trained. Default is the
+                                              symbol universe from `shared.symbols.load_symbol_universe`.
+                                              Companies with fewer than two rows are skipped.
 
     Returns:
         dict: A dictionary containing:
@@ -244,9 +236,13 @@ def train_model(df: pd.DataFrame, company_list=['AAPL', 'GOOGL', 'TSLA', 'AMZN',
     """
     model_dict = {}
     prediction_rows = {}
-    for company in company_list:
+    date = None
+    for company in company_list or load_symbol_universe():
 
         company_df = df[df["company"] == company]
+        # Med ett stort universum saknar vissa symboler data; de hoppas över
+        if len(company_df) < 2:
+            continue
         company_df_sorted = company_df.sort_values(by="pub_date")
 
         date = company_df_sorted["pub_date"].tail(1)
@@ -266,7 +262,8 @@ def train_model(df: pd.DataFrame, company_list=['AAPL', 'GOOGL', 'TSLA', 'AMZN',
         model.fit(X_train, y_train)
         model_dict[f'{company}_model'] = model
 
-   
+    if date is None:
+        raise ValueError("No company has enough data to train a model")
     return model_dict, prediction_rows, date.iloc[0]
 
 
@@ -387,7 +384,7 @@ def save_model(model_dict: dict, date: str):
         google.cloud.exceptions.GoogleCloudError: If any other errors occur when interacting with
                                                   Google Cloud Storage.
     """
-    storage_client = storage.Client()
+    storage_client = shared_gcp.get_storage_client()
     bucket_name = 'machine-models'
     bucket = storage_client.get_bucket(bucket_name)
     for model_name, model in model_dict.items():
@@ -435,10 +432,9 @@ def insert_true_value_to_bigquery(
         google.cloud.exceptions.GoogleCloudError: If an error occurs when executing the query or 
                                                   interacting with BigQuery.
     """
-    # Fetch secret data and create a BigQuery client
-    secret_data = get_secret(project_id=os.getenv("PROJECT_ID"))
-    service_account_info = json.loads(secret_data)
-    client = bigquery.Client.from_service_account_info(service_account_info)
+    # Shared BigQuery client for the process
+    client = shared_gcp.get_bigquery_client(
+        project_id=os.getenv("PROJECT_ID"))
     table_from_id = f"{project_id}.{dataset}.{table_from}"
     prediction_table_id = f"{project_id}.{dataset}.{prediction_table}"
     # Define the SQL query for updating the true_value column
@@ -475,10 +471,8 @@ def get_latest_date():
         google.cloud.exceptions.GoogleCloudError: If an error occurs when executing the query or
                                                   interacting with BigQuery.
     """
-    secret_data = get_secret(project_id=os.getenv("PROJECT_ID"))
-    service_account_info = json.loads(secret_data)
-    client = bigquery.Client.from_service_account_info(
-        service_account_info)
+    client = shared_gcp.get_bigquery_client(
+        project_id=os.getenv("PROJECT_ID"))
 
     # view_id = f"{project_id}.{dataset}.{table}"
 
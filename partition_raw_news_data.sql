@@ -0,0 +1,32 @@
+-- Engångsmigrering innan clean_news körs med mode 'watermark'.
+-- Befintliga tabeller kan inte partitioneras på plats, så raw_news_data
+-- kopieras till en tabell partitionerad per dag på fetch_date. Byt sedan
+-- namn på tabellerna (eller peka hemligheten RAW_NEWS_DATA på den nya).
+CREATE TABLE `tomastestproject-433206.testdb_1.raw_news_data_partitioned`
+PARTITION BY DATE(fetch_date)
+AS
+SELECT
+  data,
+  fetch_date,
+  company,
+  unique_id
+FROM
+  `tomastestproject-433206.testdb_1.raw_news_data`;
+
+-- Startvärde för vattenmärket (tabellen skapas med create_table, typ
+-- news_transform_watermarks): den senaste fetch_date som redan är
+-- bearbetad. Töm backloggen med mode 'meta' först, så att inget hoppas över.
+-- source_table ska vara samma tabell-id som clean_news läser från.
+INSERT INTO `tomastestproject-433206.testdb_1.news_transform_watermarks`
+  (source_table, last_fetch_date, updated_at)
+SELECT
+  'tomastestproject-433206.testdb_1.raw_news_data',
+  MAX(r.fetch_date),
+  CURRENT_TIMESTAMP()
+FROM
+  `tomastestproject-433206.testdb_1.raw_news_data` r
+JOIN
+  `tomastestproject-433206.testdb_1.raw_news_meta_data` m
+USING (unique_id)
+WHERE
+  m.is_processed;
@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+from google.auth import default
+from google.cloud import bigquery
+from google.cloud import secretmanager
+from typing import Optional
+
+DEFAULT_SERVICE_ACCOUNT_SECRET = 'bigquery-accout-secret'
+
+# Hur länge en hemlighet får återanvändas innan den hämtas på nytt
+SECRET_TTL_SECONDS = float(os.getenv('SECRET_CACHE_TTL_SECONDS', '300'))
+
+
+class CacheStats:
+    """
+    Thread-safe hit/miss counters for one cache.
+
+    Besides the counters it keeps the total time spent on misses, so the
+    average cost of a miss can be multiplied by the number of hits to
+    estimate the latency the cache has saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, seconds: float):
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            avg_miss = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "avg_miss_seconds": round(avg_miss, 4),
+                "estimated_seconds_saved": round(avg_miss * self.hits, 4),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.miss_seconds = 0.0
+
+
+_secret_stats = CacheStats()
+_client_stats = CacheStats()
+
+_secrets = {}  # (project_id, secret_name) -> (value, expires_at)
+_clients = {}  # (kind, secret_name) -> client
+_project_id = None
+
+# Globalt lås skyddar bara ordlistorna; nätverksanrop görs under nyckellås
+_lock = threading.Lock()
+_key_locks = {}
+
+
+def _key_lock(key) -> threading.Lock:
+    with _lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = threading.Lock()
+        return lock
+
+
+def get_project_id() -> str:
+    """Retrieve project ID either from environment or default credentials.
+
+    The environment is read on every call. The lookup through default
+    credentials is slow, so its result is kept for the life of the process.
+    """
+    project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
+    if project_id:
+        return project_id
+
+    global _project_id
+    with _key_lock('project_id'):
+        if _project_id is None:
+            _, _project_id = default()
+    return _project_id
+
+
+def _get_client(kind: str, secret_name, factory):
+    key = (kind, secret_name)
+    client = _clients.get(key)
+    if client is not None:
+        _client_stats.record_hit()
+        return client
+
+    with _key_lock(key):
+        client = _clients.get(key)
+        if client is not None:
+            _client_stats.record_hit()
+            return client
+        started = time.perf_counter()
+        client = factory()
+        _clients[key] = client
+        _client_stats.record_miss(time.perf_counter() - started)
+        return client
+
+
+def get_secret_manager_client() -> secretmanager.SecretManagerServiceClient:
+    """Returns the process-wide Secret Manager client."""
+    return _get_client('secretmanager', None,
+                       secretmanager.SecretManagerServiceClient)
+
+
+def get_secret(secret_name: str = DEFAULT_SERVICE_ACCOUNT_SECRET,
+               project_id: Optional[str] = None,
+               ttl: Optional[float] = None) -> str:
+    """Fetches a secret from Google Cloud Secret Manager, with a TTL cache.
+
+    Args:
+        secret_name (str): The name of the secret in Secret Manager.
+        project_id (str): Project that owns the secret. Defaults to
+            `get_project_id()`.
+        ttl (float): Seconds a cached value stays valid. Defaults to
+            SECRET_TTL_SECONDS (env `SECRET_CACHE_TTL_SECONDS`).
+
+    Returns:
+        str: The secret data as a string.
+    """
+    project_id = project_id or get_project_id()
+    ttl = SECRET_TTL_SECONDS if ttl is None else ttl
+    key = (project_id, secret_name)
+
+    cached = _secrets.get(key)
+    if cached is not None and cached[1] > time.monotonic():
+        _secret_stats.record_hit()
+        return cached[0]
+
+    with _key_lock(('secret',) + key):
+        # En annan tråd kan ha hämtat hemligheten medan vi väntade
+        cached = _secrets.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            _secret_stats.record_hit()
+            return cached[0]
+
+        started = time.perf_counter()
+        secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+        response = get_secret_manager_client().access_secret_version(
+            name=secret_path)
+        secret_data = response.payload.data.decode('UTF-8')
+        _secrets[key] = (secret_data, time.monotonic() + ttl)
+        _secret_stats.record_miss(time.perf_counter() - started)
+        return secret_data
+
+
+def get_bigquery_client(secret_name: str = DEFAULT_SERVICE_ACCOUNT_SECRET,
+                        project_id: Optional[str] = None) -> bigquery.Client:
+    """Returns a pooled BigQuery client built from a service account secret.
+
+    The client is created once per secret and then shared by every caller
+    in the process. BigQuery clients are safe to share between threads.
+
+    Args:
+        secret_name (str): Secret holding the service account JSON.
+        project_id (str): Project that owns the secret.
+
+    Returns:
+        bigquery.Client: The shared client.
+    """
+    def factory():
+        service_account_info = json.loads(get_secret(secret_name,
+                                                     project_id=project_id))
+        return bigquery.Client.from_service_account_info(service_account_info)
+
+    return _get_client('bigquery', (project_id, secret_name), factory)
+
+
+def get_bigquery_read_client(secret_name: str = DEFAULT_SERVICE_ACCOUNT_SECRET,
+                             project_id: Optional[str] = None):
+    """Returns a pooled BigQuery Storage Read API client.
+
+    Uses the same service account as `get_bigquery_client`.
+
+    Args:
+        secret_name (str): Secret holding the service account JSON.
+        project_id (str): Project that owns the secret.
+
+    Returns:
+        bigquery_storage.BigQueryReadClient: The shared client.
+    """
+    # Importeras här eftersom inte alla tjänster har google-cloud-bigquery-storage
+    from google.cloud import bigquery_storage
+    from google.oauth2 import service_account
+
+    def factory():
+        service_account_info = json.loads(get_secret(secret_name,
+                                                     project_id=project_id))
+        credentials = service_account.Credentials.from_service_account_info(
+            service_account_info)
+        return bigquery_storage.BigQueryReadClient(credentials=credentials)
+
+    return _get_client('bigquery_read', (project_id, secret_name), factory)
+
+
+def get_storage_client(secret_name: Optional[str] = None, project_id: Optional[str] = None):
+    """Returns a pooled Cloud Storage client.
+
+    Args:
+        secret_name (str): Secret holding the service account JSON. When
+            omitted the client uses the default credentials.
+        project_id (str): Project that owns the secret.
+
+    Returns:
+        storage.Client: The shared client.
+    """
+    # Importeras här eftersom inte alla tjänster har google-cloud-storage
+    from google.cloud import storage
+
+    def factory():
+        if secret_name is None:
+            return storage.Client()
+        service_account_info = json.loads(get_secret(secret_name,
+                                                     project_id=project_id))
+        return storage.Client.from_service_account_info(service_account_info)
+
+    return _get_client('storage', (project_id, secret_name), factory)
+
+
+def cache_stats() -> dict:
+    """Returns hit/miss counters for the secret and client caches."""
+    return {"secrets": _secret_stats.as_dict(),
+            "clients": _client_stats.as_dict()}
+
+
+def clear_caches():
+    """Drops every cached secret and client and resets the counters."""
+    global _project_id
+    with _lock:
+        _secrets.clear()
+        _clients.clear()
+        _project_id = None
+    _secret_stats.reset()
+    _client_stats.reset()
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from shared.gcp import CacheStats
+
+# Lägen för HTTP_CACHE_MODE
+MODE_OFF = 'off'          # alltid nätverket, inget sparas
+MODE_CACHE = 'cache'      # läs från cachen om svaret är färskt, annars hämta och spara
+MODE_RECORD = 'record'    # alltid nätverket, men spara varje svar
+MODE_REPLAY = 'replay'    # bara cachen, aldrig nätverket, TTL ignoreras
+MODES = (MODE_OFF, MODE_CACHE, MODE_RECORD, MODE_REPLAY)
+
+# Parametrar som aldrig får ingå i nyckeln
+SECRET_PARAMS = ('apikey', 'apiKey', 'api_key')
+
+
+class CacheMissError(LookupError):
+    """Replay mode found no recorded response for the request."""
+
+
+def cache_key(provider: str, params: dict) -> str:
+    """Content address for one request: a SHA-256 of provider and params.
+
+    API keys are dropped first, so recordings can be shared between keys
+    and the key never ends up on disk.
+
+    Args:
+        provider (str): Provider name, e.g. 'newsapi'.
+        params (dict): The query parameters that decide the response.
+
+    Returns:
+        str: Hex digest used as the file name.
+    """
+    clean = {key: value for key, value in params.items()
+             if key not in SECRET_PARAMS and value is not None}
+    canonical = json.dumps([provider, clean], sort_keys=True,
+                           separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk cache for JSON API responses with an in-memory LRU in front.
+
+    Each response is one file named after its `cache_key`. The mtime is when
+    it was stored and the atime when it was last read. When the directory
+    grows past `max_bytes`, the least recently used files are removed until
+    it is back under 90 % of it.
+    Only successful responses should be stored; errors are never cached.
+
+    Args:
+        directory (str): Where the files live. Created on first write.
+        mode (str): One of MODES.
+        ttl (float): Seconds a stored response counts as fresh in 'cache'
+            mode. Replay ignores it.
+        max_bytes (int): Size limit for the directory.
+        memory_entries (int): Responses also kept in memory.
+    """
+
+    def __init__(self, directory: str,
+                 mode: str = MODE_CACHE,
+                 ttl: float = 86400.0,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 memory_entries: int = 256,
+                 clock=time.time):
+        if mode not in MODES:
+            raise ValueError(f"Unknown HTTP cache mode '{mode}', expected one of {MODES}")
+        self.directory = directory
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (stored_at, json bytes)
+        self._disk_bytes = None  # räknas fram vid första skrivningen
+        self.stats = CacheStats()
+        self.memory_hits = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _fresh(self, stored_at: float) -> bool:
+        return self.mode == MODE_REPLAY or self._clock() - stored_at < self.ttl
+
+    def _remember(self, key: str, stored_at: float, body: bytes):
+        with self._lock:
+            self._memory[key] = (stored_at, body)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """Returns the stored response for `key`, or None if missing or stale."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._fresh(entry[0]):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(entry[1])
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            stored_at = os.path.getmtime(path)
+        except OSError:
+            return None
+        if not self._fresh(stored_at):
+            return None
+
+        # Läsningen räknas som användning för LRU-städningen, utan att
+        # påverka när svaret blir inaktuellt
+        try:
+            os.utime(path, (self._clock(), stored_at))
+        except OSError:
+            pass
+        self._remember(key, stored_at, body)
+        return json.loads(body)
+
+    def put(self, key: str, payload: dict):
+        """Stores `payload` under `key`, then evicts if the directory is full."""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+
+        # Skriv till en temporär fil och byt namn, så att ingen läser en halv fil
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        stored_at = self._clock()
+        os.utime(path, (stored_at, stored_at))
+        self._remember(key, stored_at, body)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._entries())
+            else:
+                self._disk_bytes += len(body) - old_size
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """Yields (atime, path, size) for every stored response."""
+        if not os.path.isdir(self.directory):
+            return
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    yield stat.st_atime, entry.path, stat.st_size
+
+    def _evict(self):
+        """Removes least recently used files. Caller holds the lock."""
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+            self._memory.pop(os.path.basename(path)[:-len('.json')], None)
+        self._disk_bytes = total
+
+    def fetch(self, key: str, fetch, *args, **kwargs):
+        """
+        Returns the response for `key` according to the cache mode.
+
+        Args:
+            key (str): From `cache_key`.
+            fetch: Called as fetch(*args, **kwargs) when the network is needed.
+
+        Raises:
+            CacheMissError: In replay mode when nothing was recorded.
+        """
+        if self.mode in (MODE_CACHE, MODE_REPLAY):
+            payload = self.get(key)
+            if payload is not None:
+                self.stats.record_hit()
+                return payload
+            if self.mode == MODE_REPLAY:
+                raise CacheMissError(f"No recorded response for request {key[:12]}")
+
+        started = time.perf_counter()
+        payload = fetch(*args, **kwargs)
+        if self.mode != MODE_OFF:
+            self.stats.record_miss(time.perf_counter() - started)
+            self.put(key, payload)
+        return payload
+
+    async def fetch_async(self, key: str, fetch, *args, **kwargs):
+        """Like `fetch` but for coroutine functions."""
+        if self.mode in (MODE_CACHE, MODE_REPLAY):
+            payload = self.get(key)
+            if payload is not None:
+                self.stats.record_hit()
+                return payload
+            if self.mode == MODE_REPLAY:
+                raise CacheMissError(f"No recorded response for request {key[:12]}")
+
+        started = time.perf_counter()
+        payload = await fetch(*args, **kwargs)
+        if self.mode != MODE_OFF:
+            self.stats.record_miss(time.perf_counter() - started)
+            self.put(key, payload)
+        return payload
+
+    def as_dict(self) -> dict:
+        stats = self.stats.as_dict()
+        with self._lock:
+            stats.update({"mode": self.mode,
+                          "memory_hits": self.memory_hits,
+                          "evictions": self.evictions,
+                          "disk_bytes": self._disk_bytes})
+        return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(provider: str) -> ResponseCache:
+    """Returns the process-wide response cache for one provider.
+
+    Configured with HTTP_CACHE_MODE (default 'off'), HTTP_CACHE_DIR,
+    HTTP_CACHE_TTL_SECONDS, HTTP_CACHE_MAX_BYTES and
+    HTTP_CACHE_MEMORY_ENTRIES. Each provider gets its own subdirectory.
+
+    Args:
+        provider (str): Provider name, e.g. 'newsapi' or 'alphavantage'.
+
+    Returns:
+        ResponseCache: The shared cache.
+    """
+    with _caches_lock:
+        cache = _caches.get(provider)
+        if cache is None:
+            directory = os.getenv('HTTP_CACHE_DIR',
+                                  os.path.join(tempfile.gettempdir(), 'http_cache'))
+            cache = _caches[provider] = ResponseCache(
+                directory=os.path.join(directory, provider),
+                mode=os.getenv('HTTP_CACHE_MODE', MODE_OFF),
+                ttl=float(os.getenv('HTTP_CACHE_TTL_SECONDS', '86400')),
+                max_bytes=int(os.getenv('HTTP_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+                memory_entries=int(os.getenv('HTTP_CACHE_MEMORY_ENTRIES', '256')))
+        return cache
+
+
+def http_cache_stats() -> dict:
+    """Returns counters for every response cache in the process."""
+    with _caches_lock:
+        return {provider: cache.as_dict() for provider, cache in _caches.items()}
+
+
+def clear_response_caches():
+    """Forgets the configured caches, e.g. after changing HTTP_CACHE_MODE.
+
+    Files on disk are kept.
+    """
+    with _caches_lock:
+        _caches.clear()
@@ -0,0 +1,77 @@
+import base64
+import json
+import zlib
+from typing import Optional
+
+# Värdena i kolumnen `encoding` för komprimerade rådata
+ENCODING_ZLIB = 'zlib'
+ENCODING_ZLIB_DELTA = 'zlib+delta'
+
+STOCK_TIME_SERIES_KEY = 'Time Series (Daily)'
+
+
+def encode_payload(payload: dict) -> str:
+    """Serialises and compresses a raw API payload for a BYTES column.
+
+    Args:
+        payload (dict): The raw API response.
+
+    Returns:
+        str: Base64 text, which is how insert_rows_json expects BYTES values.
+    """
+    text = json.dumps(payload, separators=(',', ':'))
+    return base64.b64encode(zlib.compress(text.encode('utf-8'), 9)).decode('ascii')
+
+
+def decode_payload_text(value, encoding: str = ENCODING_ZLIB) -> str:
+    """Turns a stored payload back into its JSON text.
+
+    Args:
+        value: The stored value. BigQuery returns BYTES columns as bytes,
+            while rows built for insert_rows_json hold base64 text.
+        encoding (str): The row's `encoding` value. Plain JSON is passed
+            through unchanged.
+
+    Returns:
+        str: The payload as a JSON string.
+    """
+    if value is None:
+        return None
+    if encoding not in (ENCODING_ZLIB, ENCODING_ZLIB_DELTA):
+        return value if isinstance(value, str) else json.dumps(value)
+    if isinstance(value, str):
+        value = base64.b64decode(value)
+    return zlib.decompress(value).decode('utf-8')
+
+
+def decode_payload(value, encoding: str = ENCODING_ZLIB) -> dict:
+    """Like `decode_payload_text` but returns the parsed payload."""
+    if isinstance(value, dict):
+        return value
+    text = decode_payload_text(value, encoding)
+    return json.loads(text) if text is not None else {}
+
+
+def stock_payload_delta(payload: dict, since_date: Optional[str] = None) -> dict:
+    """Keeps only the daily bars newer than the previous snapshot.
+
+    Alpha Vantage returns the last ~100 trading days on every call, so
+    consecutive snapshots overlap almost completely. The union of all deltas
+    for a symbol holds the same bars as the full snapshots.
+
+    Args:
+        payload (dict): A TIME_SERIES_DAILY response.
+        since_date (str): Latest date ('YYYY-MM-DD') already stored for the
+            symbol. None keeps every bar.
+
+    Returns:
+        dict: A payload of the same shape with the older bars removed.
+    """
+    time_series = payload.get(STOCK_TIME_SERIES_KEY, {})
+    if since_date is not None:
+        time_series = {date: bar for date, bar in time_series.items()
+                       if date > since_date}
+    delta = {key: value for key, value in payload.items()
+             if key != STOCK_TIME_SERIES_KEY}
+    delta[STOCK_TIME_SERIES_KEY] = time_series
+    return delta
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class RateLimitError(Exception):
+    """The provider asked us to slow down. The call may succeed later.
+
+    Args:
+        message (str): Description of the error.
+        retry_after (float): Seconds the provider asked us to wait, if known.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QuotaExhaustedError(RateLimitError):
+    """The daily budget for the API key is spent. Retrying today is pointless."""
+
+
+# Standardgränser per leverantör, kan skrivas över med miljövariabler
+PROVIDER_LIMITS = {
+    # NewsAPI Developer: 100 anrop per dygn
+    'newsapi': {'requests_per_minute': 60, 'burst': 10, 'daily_budget': 100},
+    # Alpha Vantage gratisnyckel: 5 anrop per minut, 25 per dygn
+    'alphavantage': {'requests_per_minute': 5, 'burst': 1, 'daily_budget': 25},
+}
+
+
+def _utc_day() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+class RateLimiter:
+    """
+    Token bucket with a daily budget for one API key.
+
+    Callers reserve a slot with `acquire`. When the bucket is empty the
+    reservation is still made and the caller sleeps until its slot comes up,
+    so concurrent callers queue in arrival order instead of failing. Once the
+    daily budget is used, `acquire` raises QuotaExhaustedError until the next
+    UTC day.
+
+    Args:
+        name (str): Name used in error messages and stats.
+        requests_per_minute (float): Sustained request rate.
+        daily_budget (int): Max requests per UTC day. None means no limit.
+        burst (int): Requests allowed back-to-back before pacing starts.
+        max_wait (float): Longest a caller may be queued before acquire
+            gives up with RateLimitError.
+    """
+
+    def __init__(self, name: str,
+                 requests_per_minute: float,
+                 daily_budget: Optional[int] = None,
+                 burst: int = 1,
+                 max_wait: float = 300.0,
+                 clock=time.monotonic,
+                 day=_utc_day):
+        self.name = name
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(max(burst, 1))
+        self.daily_budget = daily_budget
+        self.max_wait = max_wait
+        self._clock = clock
+        self._day = day
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._current_day = day()
+        self._used_today = 0
+        self._exhausted = False
+        self._waited_seconds = 0.0
+
+    def _reserve(self) -> float:
+        """Reserves one request and returns how long the caller must wait."""
+        with self._lock:
+            now = self._clock()
+
+            today = self._day()
+            if today != self._current_day:
+                self._current_day = today
+                self._used_today = 0
+                self._exhausted = False
+
+            if self._exhausted or (self.daily_budget is not None
+                                   and self._used_today >= self.daily_budget):
+                raise QuotaExhaustedError(
+                    f"Daily budget for {self.name} is used up "
+                    f"({self._used_today}/{self.daily_budget}).")
+
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # Negativa tokens betyder att anroparen står i kö
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            wait = max(wait, self._blocked_until - now)
+            if wait > self.max_wait:
+                raise RateLimitError(
+                    f"{self.name} queue is {wait:.0f}s long, over the "
+                    f"{self.max_wait:.0f}s limit.", retry_after=wait)
+
+            self._tokens -= 1
+            self._used_today += 1
+            self._waited_seconds += wait
+            return wait
+
+    def acquire(self):
+        """Blocks until the caller may send one request."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Like `acquire` but yields to the event loop while queued."""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Holds back every caller for `seconds`, e.g. after a provider 429."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                                      self._clock() + seconds)
+
+    def exhaust(self):
+        """Marks today's budget as spent, e.g. when the provider says so."""
+        with self._lock:
+            self._exhausted = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "used_today": self._used_today,
+                "exhausted": self._exhausted,
+                "daily_budget": self.daily_budget,
+                "queued_seconds_total": round(self._waited_seconds, 3),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _limits_for(provider: str) -> dict:
+    limits = dict(PROVIDER_LIMITS.get(provider, {'requests_per_minute': 60}))
+    prefix = f"RATE_LIMIT_{provider.upper()}_"
+    for key, cast in (('requests_per_minute', float), ('burst', int),
+                      ('daily_budget', int)):
+        value = os.getenv(prefix + key.upper())
+        if value:
+            limits[key] = cast(value)
+    return limits
+
+
+def get_rate_limiter(provider: str, api_key: str = '') -> RateLimiter:
+    """Returns the process-wide limiter for one provider and API key.
+
+    Limits come from PROVIDER_LIMITS and can be overridden with
+    RATE_LIMIT_<PROVIDER>_REQUESTS_PER_MINUTE, _BURST and _DAILY_BUDGET.
+
+    Args:
+        provider (str): Provider name, e.g. 'newsapi' or 'alphavantage'.
+        api_key (str): The key the budget belongs to. Only a hash is kept.
+
+    Returns:
+        RateLimiter: The shared limiter.
+    """
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    key = (provider, key_hash)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(f"{provider}:{key_hash}",
+                                                   **_limits_for(provider))
+        return limiter
+
+
+def rate_limit_stats() -> list:
+    """Returns usage counters for every limiter in the process."""
+    with _limiters_lock:
+        return [limiter.stats() for limiter in _limiters.values()]
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0,
+                  max_delay: float = 60.0, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter, never shorter than retry_after."""
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def call_with_retry(func, *args, limiter: RateLimiter,
+                    max_attempts: int = 5,
+                    base_delay: float = 1.0,
+                    max_delay: float = 60.0,
+                    retry_on: tuple = (RateLimitError,),
+                    **kwargs):
+    """
+    Calls `func` through `limiter` and retries with jittered backoff.
+
+    Every attempt takes a slot from the limiter first. When `func` raises one
+    of `retry_on`, the whole limiter is paused for the backoff delay so other
+    callers do not hit the provider either. QuotaExhaustedError is never
+    retried.
+
+    Returns:
+        Whatever `func` returns.
+    """
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except QuotaExhaustedError:
+            limiter.exhaust()
+            raise
+        except retry_on as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay,
+                                  getattr(e, 'retry_after', None))
+            print(f"{limiter.name}: {e}. Retrying in {delay:.1f}s "
+                  f"({attempt + 1}/{max_attempts}).")
+            limiter.pause(delay)
+
+
+async def call_with_retry_async(func, *args, limiter: RateLimiter,
+                                max_attempts: int = 5,
+                                base_delay: float = 1.0,
+                                max_delay: float = 60.0,
+                                retry_on: tuple = (RateLimitError,),
+                                **kwargs):
+    """Async version of `call_with_retry` for coroutine functions."""
+    for attempt in range(max_attempts):
+        await limiter.acquire_async()
+        try:
+            return await func(*args, **kwargs)
+        except QuotaExhaustedError:
+            limiter.exhaust()
+            raise
+        except retry_on as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay,
+                                  getattr(e, 'retry_after', None))
+            print(f"{limiter.name}: {e}. Retrying in {delay:.1f}s "
+                  f"({attempt + 1}/{max_attempts}).")
+            limiter.pause(delay)
@@ -0,0 +1,308 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Optional
+from google.api_core.exceptions import GoogleAPICallError
+from google.cloud import bigquery
+from shared.symbols import shard_of, symbols_for_shard
+
+# Tabell av typen stock_shard_leases i create_table/main.py
+LEASE_TABLE = 'stock_shard_leases'
+
+# A lease not renewed or finished within this time can be taken over
+DEFAULT_LEASE_SECONDS = 900
+
+# While a shard is processed its lease is renewed this many times per lease
+# period, so one failed renewal still leaves time for the next
+LEASE_RENEWALS_PER_PERIOD = 3
+
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def lease_table_id(sibling_table_id: str, table: str = LEASE_TABLE) -> str:
+    """The lease table in the same dataset as `sibling_table_id`."""
+    project, dataset, _ = sibling_table_id.split('.')
+    return f"{project}.{dataset}.{table}"
+
+
+def default_run_key() -> str:
+    """One run per UTC day, so each shard is processed once a day."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+def default_owner() -> str:
+    """Identifies this worker: Cloud Run revision or host, pid and a random part."""
+    host = os.getenv('K_REVISION') or socket.gethostname()
+    return f"{host}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _lease_parameters(job: str, run_key: str, shard_count: int, shard: int) -> list:
+    return [bigquery.ScalarQueryParameter("job", "STRING", job),
+            bigquery.ScalarQueryParameter("run_key", "STRING", run_key),
+            bigquery.ScalarQueryParameter("shard_count", "INT64", shard_count),
+            bigquery.ScalarQueryParameter("shard", "INT64", shard)]
+
+
+def open_shards(client: bigquery.Client, table_id: str, job: str, run_key: str,
+                shard_count: int) -> List[int]:
+    """
+    The shards of a run that nobody holds and that are not done, in one query.
+
+    The answer can be stale by the time a shard is acquired, which is fine:
+    `try_acquire` makes the final decision.
+    """
+    query = f"""
+        SELECT shard
+        FROM `{table_id}`
+        WHERE job = @job AND run_key = @run_key AND shard_count = @shard_count
+          AND (status = '{STATUS_DONE}'
+               OR (status = '{STATUS_LEASED}' AND lease_until >= CURRENT_TIMESTAMP()))
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("job", "STRING", job),
+            bigquery.ScalarQueryParameter("run_key", "STRING", run_key),
+            bigquery.ScalarQueryParameter("shard_count", "INT64", shard_count),
+        ])
+    taken = {row.shard for row in client.query(query, job_config=job_config).result()}
+    return [shard for shard in range(shard_count) if shard not in taken]
+
+
+def try_acquire(client: bigquery.Client, table_id: str, job: str, run_key: str,
+                shard_count: int, shard: int, owner: str,
+                lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    """
+    Takes the lease on one shard with a MERGE.
+
+    BigQuery runs DML against one table one statement at a time, so when
+    two workers race for a shard, the second MERGE sees the first one's
+    lease and changes nothing. A shard that failed or whose lease ran out
+    can be taken again; a finished shard cannot.
+
+    Returns:
+        bool: True if this worker now holds the shard.
+    """
+    query = f"""
+        MERGE `{table_id}` T
+        USING (SELECT @job AS job, @run_key AS run_key,
+                      @shard_count AS shard_count, @shard AS shard) S
+        ON T.job = S.job AND T.run_key = S.run_key
+           AND T.shard_count = S.shard_count AND T.shard = S.shard
+        WHEN MATCHED AND (T.status = '{STATUS_FAILED}'
+                          OR (T.status = '{STATUS_LEASED}'
+                              AND T.lease_until < CURRENT_TIMESTAMP())) THEN
+            UPDATE SET status = '{STATUS_LEASED}', owner = @owner,
+                       lease_until = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND),
+                       attempts = T.attempts + 1, error = NULL,
+                       updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (job, run_key, shard_count, shard, status, owner, lease_until,
+                    attempts, symbols, error, updated_at)
+            VALUES (S.job, S.run_key, S.shard_count, S.shard, '{STATUS_LEASED}', @owner,
+                    TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND),
+                    1, NULL, NULL, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=_lease_parameters(job, run_key, shard_count, shard) + [
+            bigquery.ScalarQueryParameter("owner", "STRING", owner),
+            bigquery.ScalarQueryParameter("lease_seconds", "INT64", int(lease_seconds)),
+        ])
+    query_job = client.query(query, job_config=job_config)
+    query_job.result()
+    return (query_job.num_dml_affected_rows or 0) == 1
+
+
+def renew(client: bigquery.Client, table_id: str, job: str, run_key: str,
+          shard_count: int, shard: int, owner: str,
+          lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+    """
+    Extends a held lease by `lease_seconds` from now.
+
+    Returns:
+        bool: False if the lease is no longer this worker's.
+    """
+    query = f"""
+        UPDATE `{table_id}`
+        SET lease_until = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND),
+            updated_at = CURRENT_TIMESTAMP()
+        WHERE job = @job AND run_key = @run_key AND shard_count = @shard_count
+          AND shard = @shard AND owner = @owner AND status = '{STATUS_LEASED}'
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=_lease_parameters(job, run_key, shard_count, shard) + [
+            bigquery.ScalarQueryParameter("owner", "STRING", owner),
+            bigquery.ScalarQueryParameter("lease_seconds", "INT64", int(lease_seconds)),
+        ])
+    query_job = client.query(query, job_config=job_config)
+    query_job.result()
+    return (query_job.num_dml_affected_rows or 0) == 1
+
+
+class LeaseHeartbeat:
+    """
+    Renews a lease in a background thread while the shard is processed.
+
+    A shard can take longer than one lease, e.g. fetch_stocks at Alpha
+    Vantage's 5 requests a minute needs about 15 minutes for 75 symbols.
+    Without renewals another worker would take it over and process it again.
+    """
+
+    def __init__(self, client: bigquery.Client, table_id: str, job: str,
+                 run_key: str, shard_count: int, shard: int, owner: str,
+                 lease_seconds: int = DEFAULT_LEASE_SECONDS):
+        self._renew_args = (client, table_id, job, run_key, shard_count, shard,
+                            owner, lease_seconds)
+        self._interval = lease_seconds / LEASE_RENEWALS_PER_PERIOD
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"lease-{job}-{shard}")
+        self.renewals = 0
+        self.lost = False
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                if not renew(*self._renew_args):
+                    print(f"Lost the lease on shard {self._renew_args[5]}")
+                    self.lost = True
+                    return
+                self.renewals += 1
+            except GoogleAPICallError as e:
+                # Krockar med andra workers DML; nästa försök kommer snart
+                print(f"Could not renew lease on shard {self._renew_args[5]}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+def release(client: bigquery.Client, table_id: str, job: str, run_key: str,
+            shard_count: int, shard: int, owner: str, status: str,
+            symbols: Optional[int] = None, error: Optional[str] = None):
+    """Marks a held shard as done or failed. Does nothing if the lease was lost."""
+    query = f"""
+        UPDATE `{table_id}`
+        SET status = @status, symbols = @symbols, error = @error,
+            updated_at = CURRENT_TIMESTAMP()
+        WHERE job = @job AND run_key = @run_key AND shard_count = @shard_count
+          AND shard = @shard AND owner = @owner
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=_lease_parameters(job, run_key, shard_count, shard) + [
+            bigquery.ScalarQueryParameter("owner", "STRING", owner),
+            bigquery.ScalarQueryParameter("status", "STRING", status),
+            bigquery.ScalarQueryParameter("symbols", "INT64", symbols),
+            bigquery.ScalarQueryParameter("error", "STRING", error),
+        ])
+    client.query(query, job_config=job_config).result()
+
+
+def next_shard(client: bigquery.Client, table_id: str, job: str, run_key: str,
+               shard_count: int, owner: str, shards: Optional[Iterable[int]] = None,
+               lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[int]:
+    """
+    Acquires the next open shard, or returns None when none is left.
+
+    Each worker starts looking at a different shard, chosen from its owner
+    id, so workers started together rarely race for the same one.
+
+    Args:
+        shards (list): Only consider these shards, e.g. the task index of
+            a Cloud Run job. Default is every shard.
+    """
+    candidates = open_shards(client, table_id, job, run_key, shard_count)
+    if shards is not None:
+        allowed = set(shards)
+        candidates = [shard for shard in candidates if shard in allowed]
+    if not candidates:
+        return None
+
+    start = shard_of(owner, len(candidates))
+    for shard in candidates[start:] + candidates[:start]:
+        try:
+            acquired = try_acquire(client, table_id, job, run_key, shard_count,
+                                   shard, owner, lease_seconds)
+        except GoogleAPICallError as e:
+            # Två samtidiga MERGE kan krocka; den som förlorar får ta nästa shard
+            if 'concurrent update' not in str(e):
+                raise
+            acquired = False
+        if acquired:
+            return shard
+    return None
+
+
+def run_sharded(client: bigquery.Client, table_id: str, job: str,
+                universe: List[str], shard_count: int,
+                process: Callable[[List[str]], dict],
+                run_key: Optional[str] = None, shards: Optional[Iterable[int]] = None,
+                owner: Optional[str] = None,
+                lease_seconds: int = DEFAULT_LEASE_SECONDS) -> dict:
+    """
+    Processes shards of the symbol universe until no open shard is left.
+
+    Each shard is leased before `process` is called with its symbols and
+    released as done or failed afterwards, so several workers can run
+    this at once without doing a shard twice. The lease is renewed while
+    `process` runs, however long that takes. A worker that dies loses its
+    lease after `lease_seconds`, and another worker then takes the shard.
+
+    Args:
+        client (bigquery.Client): Client for the lease table.
+        table_id (str): Table of type stock_shard_leases.
+        job (str): Name of the work, e.g. 'clean_stocks'.
+        universe (list): All symbols, see `load_symbol_universe`.
+        shard_count (int): Number of shards to split the universe into.
+        process: Called with the symbols of one shard.
+        run_key (str): Identifies the run. Default is today's UTC date.
+        shards (list): Only take these shards. Default is any.
+        owner (str): Worker id. Default from `default_owner`.
+        lease_seconds (int): How long a lease lasts.
+
+    Returns:
+        dict: The owner, the run key and the result or error per shard. A
+        shard whose lease was taken over while it ran has an error, since
+        the worker that took it processes it again.
+    """
+    run_key = run_key or default_run_key()
+    owner = owner or default_owner()
+    allowed = list(range(shard_count) if shards is None else shards)
+    results = {}
+    while True:
+        # En shard som misslyckades lämnas åt nästa körning eller en annan worker
+        shard = next_shard(client, table_id, job, run_key, shard_count, owner,
+                           [shard for shard in allowed if shard not in results],
+                           lease_seconds)
+        if shard is None:
+            break
+        symbols = symbols_for_shard(universe, shard, shard_count)
+        heartbeat = LeaseHeartbeat(client, table_id, job, run_key, shard_count,
+                                   shard, owner, lease_seconds)
+        try:
+            with heartbeat:
+                outcome = process(symbols) if symbols else {}
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            release(client, table_id, job, run_key, shard_count, shard, owner,
+                    STATUS_FAILED, len(symbols), error[:1024])
+            results[shard] = {"symbols": len(symbols), "error": error}
+            continue
+        if heartbeat.lost:
+            # En annan worker har tagit sharden och gör om den, så den här
+            # körningen får inte räknas som klar
+            results[shard] = {"symbols": len(symbols), "result": outcome,
+                              "error": "Lease lost while the shard was processed"}
+            continue
+        release(client, table_id, job, run_key, shard_count, shard, owner,
+                STATUS_DONE, len(symbols))
+        results[shard] = {"symbols": len(symbols), "result": outcome}
+    return {"owner": owner, "run_key": run_key, "shard_count": shard_count,
+            "shards": results}
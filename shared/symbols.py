@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+# The stocks the pipeline follows, shared by fetch_stocks and transform_stocks
+STOCK_SYMBOLS = ["TSLA", "MSFT", "AMZN", "GOOGL", "AAPL"]
+
+
+def load_symbol_universe(path: Optional[str] = None) -> List[str]:
+    """Returns the symbols the pipeline follows.
+
+    The universe is read from a file (one symbol per line, or a JSON list)
+    named by `path` or STOCK_SYMBOLS_FILE, else from a comma-separated
+    STOCK_SYMBOLS variable, else STOCK_SYMBOLS. Symbols are upper-cased and
+    duplicates and blank lines dropped.
+
+    Args:
+        path (str): Optional file to read instead of the environment.
+
+    Returns:
+        list: Symbols in the order given.
+    """
+    path = path or os.getenv('STOCK_SYMBOLS_FILE')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        if text.lstrip().startswith('['):
+            symbols = json.loads(text)
+        else:
+            # Tillåt kommentarer i textfilen
+            symbols = [line.split('#')[0] for line in text.splitlines()]
+    elif os.getenv('STOCK_SYMBOLS'):
+        symbols = os.getenv('STOCK_SYMBOLS').split(',')
+    else:
+        symbols = STOCK_SYMBOLS
+
+    cleaned = (symbol.strip().upper() for symbol in symbols)
+    return list(dict.fromkeys(symbol for symbol in cleaned if symbol))
+
+
+def shard_of(symbol: str, shard_count: int) -> int:
+    """The shard a symbol belongs to.
+
+    Uses SHA-1 instead of hash(), which is salted per process, so every
+    worker and every run agrees on the split.
+    """
+    if shard_count < 1:
+        raise ValueError("shard_count must be at least 1")
+    digest = hashlib.sha1(symbol.upper().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def symbols_for_shard(symbols: List[str], shard: int, shard_count: int) -> List[str]:
+    """The symbols of one shard, in the order of `symbols`."""
+    if not 0 <= shard < shard_count:
+        raise ValueError(f"shard must be between 0 and {shard_count - 1}")
+    return [symbol for symbol in symbols if shard_of(symbol, shard_count) == shard]
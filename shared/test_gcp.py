@@ -0,0 +1,49 @@
+import os
+from unittest.mock import Mock, patch
+import pytest
+from shared import gcp
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    gcp.clear_caches()
+    yield
+    gcp.clear_caches()
+
+
+@pytest.fixture
+def mock_secret_manager():
+    client = Mock()
+    client.access_secret_version.return_value.payload.data = b"secret-value"
+    with patch.dict(os.environ, {"GOOGLE_CLOUD_PROJECT": "test-project"}), \
+            patch("shared.gcp.secretmanager.SecretManagerServiceClient",
+                  return_value=client):
+        yield client
+
+
+def test_get_secret_is_cached(mock_secret_manager):
+    assert gcp.get_secret("NEWS_API_KEY") == "secret-value"
+    assert gcp.get_secret("NEWS_API_KEY") == "secret-value"
+
+    mock_secret_manager.access_secret_version.assert_called_once_with(
+        name="projects/test-project/secrets/NEWS_API_KEY/versions/latest")
+    stats = gcp.cache_stats()
+    assert stats["secrets"]["hits"] == 1
+    assert stats["secrets"]["misses"] == 1
+
+
+def test_get_secret_expires_after_ttl(mock_secret_manager):
+    gcp.get_secret("NEWS_API_KEY", ttl=0)
+    gcp.get_secret("NEWS_API_KEY", ttl=0)
+
+    assert mock_secret_manager.access_secret_version.call_count == 2
+
+
+def test_bigquery_client_is_shared(mock_secret_manager):
+    with patch("shared.gcp.bigquery.Client.from_service_account_info") as factory:
+        mock_secret_manager.access_secret_version.return_value.payload.data = b"{}"
+        first = gcp.get_bigquery_client()
+        second = gcp.get_bigquery_client()
+
+    assert first is second
+    factory.assert_called_once_with({})
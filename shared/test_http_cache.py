@@ -0,0 +1,68 @@
+from unittest.mock import Mock
+import pytest
+from shared.http_cache import (MODE_CACHE, MODE_RECORD, MODE_REPLAY,
+                               CacheMissError, ResponseCache, cache_key)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_key_ignores_api_key_and_param_order():
+    assert cache_key('newsapi', {'q': 'Apple', 'apiKey': 'a', 'page': 1}) == \
+        cache_key('newsapi', {'page': 1, 'q': 'Apple', 'apiKey': 'b'})
+    assert cache_key('newsapi', {'q': 'Apple'}) != cache_key('newsapi', {'q': 'Tesla'})
+
+
+def test_cache_mode_serves_hits_until_ttl(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(str(tmp_path), mode=MODE_CACHE, ttl=60, clock=clock)
+    fetch = Mock(return_value={"status": "ok", "articles": []})
+
+    assert cache.fetch('k' * 64, fetch) == {"status": "ok", "articles": []}
+    assert cache.fetch('k' * 64, fetch) == {"status": "ok", "articles": []}
+    assert fetch.call_count == 1
+
+    # En ny process utan minnescache läser från disk
+    assert ResponseCache(str(tmp_path), mode=MODE_CACHE, ttl=60,
+                         clock=clock).get('k' * 64) is not None
+
+    clock.now += 61
+    cache.fetch('k' * 64, fetch)
+    assert fetch.call_count == 2
+
+
+def test_record_then_replay_without_network(tmp_path):
+    ResponseCache(str(tmp_path), mode=MODE_RECORD).fetch(
+        'a' * 64, lambda: {"answer": 42})
+
+    replay = ResponseCache(str(tmp_path), mode=MODE_REPLAY, ttl=0)
+    network = Mock()
+    assert replay.fetch('a' * 64, network) == {"answer": 42}
+    network.assert_not_called()
+    with pytest.raises(CacheMissError):
+        replay.fetch('b' * 64, network)
+
+
+def test_size_limit_evicts_least_recently_used(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(str(tmp_path), mode=MODE_CACHE, max_bytes=2500,
+                          memory_entries=0, clock=clock)
+    body = {"data": "x" * 1000}
+
+    cache.put('a' * 64, body)
+    clock.now += 1
+    cache.put('b' * 64, body)
+    clock.now += 1
+    assert cache.get('a' * 64) is not None  # a används, b blir äldst
+    clock.now += 1
+    cache.put('c' * 64, body)
+
+    assert cache.get('b' * 64) is None
+    assert cache.get('a' * 64) is not None
+    assert cache.get('c' * 64) is not None
+    assert cache.evictions == 1
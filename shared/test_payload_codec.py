@@ -0,0 +1,26 @@
+import base64
+from shared.payload_codec import (ENCODING_ZLIB, STOCK_TIME_SERIES_KEY,
+                                  decode_payload, decode_payload_text,
+                                  encode_payload, stock_payload_delta)
+
+
+def test_encode_round_trip_from_text_and_bytes():
+    payload = {"status": "ok", "articles": [{"title": "Åäö"}] * 50}
+    encoded = encode_payload(payload)
+
+    assert decode_payload(encoded, ENCODING_ZLIB) == payload
+    # BigQuery returnerar BYTES-kolumner som bytes
+    assert decode_payload(base64.b64decode(encoded), ENCODING_ZLIB) == payload
+    # Okomprimerade rader passerar oförändrade
+    assert decode_payload_text('{"a": 1}', None) == '{"a": 1}'
+
+
+def test_stock_payload_delta_keeps_only_new_bars():
+    payload = {"Meta Data": {"2. Symbol": "AAPL"},
+               STOCK_TIME_SERIES_KEY: {"2024-01-03": {}, "2024-01-02": {},
+                                       "2024-01-01": {}}}
+
+    delta = stock_payload_delta(payload, since_date="2024-01-02")
+
+    assert delta["Meta Data"] == payload["Meta Data"]
+    assert list(delta[STOCK_TIME_SERIES_KEY]) == ["2024-01-03"]
@@ -0,0 +1,59 @@
+from unittest.mock import Mock, patch
+import pytest
+from shared.rate_limit import (QuotaExhaustedError, RateLimitError,
+                               RateLimiter, call_with_retry)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_callers_queue_instead_of_failing():
+    clock = FakeClock()
+    limiter = RateLimiter("test", requests_per_minute=60, burst=2, clock=clock)
+
+    waits = [limiter._reserve() for _ in range(4)]
+
+    # Två anrop ryms i bursten, sedan ett per sekund i kö
+    assert waits == [0.0, 0.0, 1.0, 2.0]
+
+
+def test_daily_budget_is_enforced_and_resets():
+    day = Mock(return_value="2024-01-01")
+    limiter = RateLimiter("test", requests_per_minute=600, burst=10,
+                          daily_budget=2, clock=FakeClock(), day=day)
+    limiter._reserve()
+    limiter._reserve()
+
+    with pytest.raises(QuotaExhaustedError):
+        limiter._reserve()
+
+    day.return_value = "2024-01-02"
+    assert limiter._reserve() == 0.0
+
+
+def test_call_with_retry_backs_off_and_succeeds():
+    limiter = RateLimiter("test", requests_per_minute=600, burst=10)
+    func = Mock(side_effect=[RateLimitError("slow down"), {"ok": True}])
+
+    with patch("shared.rate_limit.time.sleep"):
+        result = call_with_retry(func, "AAPL", limiter=limiter, base_delay=0.01)
+
+    assert result == {"ok": True}
+    assert func.call_count == 2
+
+
+def test_call_with_retry_does_not_retry_spent_quota():
+    limiter = RateLimiter("test", requests_per_minute=600, burst=10)
+    func = Mock(side_effect=QuotaExhaustedError("25 requests per day"))
+
+    with pytest.raises(QuotaExhaustedError):
+        call_with_retry(func, limiter=limiter)
+
+    assert func.call_count == 1
+    with pytest.raises(QuotaExhaustedError):
+        limiter._reserve()
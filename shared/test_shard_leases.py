@@ -0,0 +1,95 @@
+import time
+from unittest.mock import patch
+import pytest
+from shared import shard_leases
+from shared.symbols import shard_of
+
+
+class FakeLeaseTable:
+    """In-memory stand-in for the lease table, keyed on shard."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def open_shards(self, client, table_id, job, run_key, shard_count):
+        return [shard for shard in range(shard_count)
+                if self.rows.get(shard, {}).get("status") not in ("leased", "done")]
+
+    def try_acquire(self, client, table_id, job, run_key, shard_count, shard,
+                    owner, lease_seconds):
+        if self.rows.get(shard, {}).get("status") in ("leased", "done"):
+            return False
+        self.rows[shard] = {"status": "leased", "owner": owner}
+        return True
+
+    def renew(self, client, table_id, job, run_key, shard_count, shard, owner,
+              lease_seconds):
+        self.rows[shard]["renewals"] = self.rows[shard].get("renewals", 0) + 1
+        return self.rows[shard]["owner"] == owner
+
+    def release(self, client, table_id, job, run_key, shard_count, shard, owner,
+                status, symbols=None, error=None):
+        if self.rows[shard]["owner"] == owner:
+            self.rows[shard]["status"] = status
+
+
+@pytest.fixture
+def lease_table():
+    table = FakeLeaseTable()
+    with patch.object(shard_leases, "open_shards", table.open_shards), \
+            patch.object(shard_leases, "try_acquire", table.try_acquire), \
+            patch.object(shard_leases, "renew", table.renew), \
+            patch.object(shard_leases, "release", table.release):
+        yield table
+
+
+def test_run_sharded_processes_each_shard_once(lease_table):
+    universe = [f"SYM{i}" for i in range(40)]
+    processed = []
+
+    first = shard_leases.run_sharded(None, "p.d.leases", "clean", universe, 4,
+                                     processed.extend, owner="worker-a")
+    second = shard_leases.run_sharded(None, "p.d.leases", "clean", universe, 4,
+                                      processed.extend, owner="worker-b")
+
+    assert sorted(first["shards"]) == [0, 1, 2, 3]
+    assert second["shards"] == {}
+    assert sorted(processed) == sorted(universe)
+
+
+def test_failed_shard_is_released_for_a_retry(lease_table):
+    def process(symbols):
+        raise RuntimeError("boom")
+
+    result = shard_leases.run_sharded(None, "p.d.leases", "clean", ["AAPL"], 2,
+                                      process, shards=[shard_of("AAPL", 2)],
+                                      owner="worker-a")
+
+    assert result["shards"][shard_of("AAPL", 2)]["error"] == "boom"
+    assert lease_table.rows[shard_of("AAPL", 2)]["status"] == "failed"
+
+
+def test_lease_is_renewed_while_a_slow_shard_runs(lease_table):
+    def process(symbols):
+        time.sleep(0.8)
+        return {}
+
+    shard_leases.run_sharded(None, "p.d.leases", "fetch", ["AAPL"], 1, process,
+                             owner="worker-a", lease_seconds=1)
+
+    assert lease_table.rows[0]["renewals"] >= 2
+    assert lease_table.rows[0]["status"] == "done"
+
+
+def test_shard_whose_lease_is_lost_is_not_reported_done(lease_table):
+    def process(symbols):
+        # En annan worker tar över sharden medan den här arbetar
+        lease_table.rows[0]["owner"] = "worker-b"
+        time.sleep(0.5)
+        return {"fetched": len(symbols)}
+
+    result = shard_leases.run_sharded(None, "p.d.leases", "fetch", ["AAPL"], 1,
+                                      process, owner="worker-a", lease_seconds=1)
+
+    assert "Lease lost" in result["shards"][0]["error"]
+    assert lease_table.rows[0]["status"] == "leased"
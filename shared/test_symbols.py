@@ -0,0 +1,30 @@
+import os
+from unittest.mock import patch
+from shared.symbols import (STOCK_SYMBOLS, load_symbol_universe, shard_of,
+                            symbols_for_shard)
+
+
+def test_universe_defaults_to_stock_symbols():
+    with patch.dict(os.environ, {}, clear=True):
+        assert load_symbol_universe() == STOCK_SYMBOLS
+
+
+def test_universe_from_text_file(tmp_path):
+    path = tmp_path / "symbols.txt"
+    path.write_text("aapl\nMSFT  # Microsoft\n\nAAPL\n", encoding="utf-8")
+    assert load_symbol_universe(str(path)) == ["AAPL", "MSFT"]
+
+
+def test_universe_from_env_list():
+    with patch.dict(os.environ, {"STOCK_SYMBOLS": "ibm, nvda,IBM"}, clear=True):
+        assert load_symbol_universe() == ["IBM", "NVDA"]
+
+
+def test_shards_are_disjoint_and_stable():
+    universe = [f"SYM{i}" for i in range(1000)]
+    shards = [symbols_for_shard(universe, shard, 8) for shard in range(8)]
+
+    assert sorted(sum(shards, [])) == sorted(universe)
+    assert all(shards)
+    # Pinned, so a change of hash function that would reshuffle shards is caught
+    assert shard_of("AAPL", 8) == shard_of("aapl", 8) == 3
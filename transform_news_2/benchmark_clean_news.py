@@ -0,0 +1,80 @@
+"""
+Jämför clean_news med flatten='pandas' och flatten='arrow'.
+
+Payloads läses från en fil med ett NewsAPI-svar per rad, eller skapas som
+syntetiska svar med fullständiga artiklar. Skriptet skriver ut tid och
+artiklar per sekund för varje väg och kontrollerar att båda ger samma
+DataFrame.
+
+    python benchmark_clean_news.py --payloads 2000 --articles 100
+    python benchmark_clean_news.py --file payloads.jsonl
+"""
+import argparse
+import json
+import random
+import time
+import pandas as pd
+from clean_news import FLATTEN_ARROW, FLATTEN_PANDAS, clean_news
+
+
+def synthetic_payloads(count: int, articles: int, seed: int = 0) -> list:
+    """NewsAPI-liknande svar med `articles` artiklar vardera."""
+    rng = random.Random(seed)
+    words = "apple tesla shares market quarter earnings record growth falls rises".split()
+
+    def article(i):
+        return {"source": {"id": None, "name": rng.choice(["Reuters", "CNBC", "Yahoo"])},
+                "author": rng.choice([None, "Jane Doe", "John Roe"]),
+                "title": " ".join(rng.choices(words, k=8)),
+                "description": " ".join(rng.choices(words, k=30)),
+                "url": f"https://example.com/{i}",
+                "urlToImage": f"https://example.com/{i}.jpg",
+                "publishedAt": f"2024-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00Z",
+                "content": " ".join(rng.choices(words, k=60))}
+
+    return [json.dumps({"status": "ok", "totalResults": articles,
+                        "articles": [article(i * articles + j) for j in range(articles)]})
+            for i in range(count)]
+
+
+def raw_frame(payloads: list) -> pd.DataFrame:
+    return pd.DataFrame({"unique_id": [str(i) for i in range(len(payloads))],
+                         "data": payloads,
+                         "company": ["AAPL"] * len(payloads)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", help="NewsAPI-svar, ett per rad")
+    parser.add_argument("--payloads", type=int, default=2000)
+    parser.add_argument("--articles", type=int, default=100, help="Artiklar per syntetiskt svar")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            payloads = [line for line in f if line.strip()][:args.payloads]
+    else:
+        payloads = synthetic_payloads(args.payloads, args.articles)
+
+    results = {}
+    for flatten in (FLATTEN_PANDAS, FLATTEN_ARROW):
+        # clean_news skriver över 'data', så varje väg får en egen kopia
+        df = raw_frame(payloads)
+        started = time.perf_counter()
+        results[flatten] = clean_news(df, flatten=flatten)
+        seconds = time.perf_counter() - started
+        print(json.dumps({"flatten": flatten,
+                          "payloads": len(payloads),
+                          "articles": len(results[flatten]),
+                          "seconds": round(seconds, 3),
+                          "articles_per_second": round(len(results[flatten]) / seconds, 1)}))
+
+    try:
+        pd.testing.assert_frame_equal(results[FLATTEN_PANDAS], results[FLATTEN_ARROW])
+        print("The paths produced identical DataFrames")
+    except AssertionError as e:
+        print(f"The paths differ: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Jämför poängsättarna i sentiment.SCORERS på samma rubriker.
+
+Rubrikerna läses från en fil (en per rad) eller slumpas fram ur VADER:s
+lexikon. Skriptet skriver ut tid och rubriker per sekund för varje
+poängsättare, och hur många poäng som skiljer sig från 'vader'. Ingen
+cache används, så varje text poängsätts.
+
+    python benchmark_sentiment.py --count 100000
+    python benchmark_sentiment.py --file rubriker.txt
+"""
+import argparse
+import json
+import random
+import time
+from sentiment import SCORERS, get_analyzer
+
+
+def synthetic_headlines(count: int, seed: int = 0) -> list:
+    """Rubriker med några vanliga ord och lexikonord, versaler och skiljetecken."""
+    rng = random.Random(seed)
+    lexicon = sorted(get_analyzer().lexicon)
+    filler = ("stock shares Apple Tesla Microsoft Amazon Google earnings quarter "
+              "market analysts the of to in for on after but not very").split()
+    headlines = []
+    for _ in range(count):
+        words = [rng.choice(lexicon) if rng.random() < 0.25 else rng.choice(filler)
+                 for _ in range(rng.randint(4, 14))]
+        if rng.random() < 0.1:
+            words[0] = words[0].upper()
+        headlines.append(" ".join(words) + rng.choice(["", "", ".", "!", "?"]))
+    return headlines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", help="Rubriker, en per rad")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            headlines = [line.rstrip("\n") for line in f][:args.count]
+    else:
+        headlines = synthetic_headlines(args.count)
+
+    results = {}
+    for name, scorer_class in SCORERS.items():
+        scorer = scorer_class(get_analyzer())
+        started = time.perf_counter()
+        results[name] = scorer.score_batch(headlines)
+        seconds = time.perf_counter() - started
+        differences = sum(a != b for a, b in zip(results[name], results["vader"]))
+        print(json.dumps({"scorer": name,
+                          "headlines": len(headlines),
+                          "seconds": round(seconds, 3),
+                          "headlines_per_second": round(len(headlines) / seconds, 1),
+                          "differences_from_vader": differences}))
+
+
+if __name__ == "__main__":
+    main()
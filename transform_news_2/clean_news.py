@@ -1,144 +1,443 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, Optional
+import numpy as np
 import pandas as pd
-from google.cloud import bigquery
-from nltk.sentiment import SentimentIntensityAnalyzer
-from google.cloud import secretmanager
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
 import json
 from google.api_core.exceptions import GoogleAPIError, NotFound
-import os
-from google.auth import default
+from google.cloud import bigquery, bigquery_storage
+from shared.gcp import get_bigquery_client, get_bigquery_read_client
+from shared.payload_codec import decode_payload_text
+from sentiment import SentimentEngine, get_analyzer, get_sentiment_engine
+
+
+# Råa rader per batch. Varje batch rensas, poängsätts och skrivs innan
+# nästa läses, så minnet beror på batchstorleken och inte på backloggen.
+NEWS_BATCH_ROWS = int(os.getenv('NEWS_BATCH_ROWS', '500'))
+
+# Max antal läsströmmar från Storage Read API, som kan bearbetas parallellt
+NEWS_READ_STREAMS = int(os.getenv('NEWS_READ_STREAMS', '4'))
+
+# Hur backloggen hittas: 'meta' läser rader som inte är markerade i
+# raw_news_meta_data, 'watermark' läser rader med fetch_date efter förra
+# körningens vattenmärke och behöver ingen metadatatabell
+MODE_META = 'meta'
+MODE_WATERMARK = 'watermark'
+NEWS_PROCESSING_MODE = os.getenv('NEWS_PROCESSING_MODE', MODE_META)
+
+# Tabell av typen news_transform_watermarks i create_table/main.py
+TRANSFORM_WATERMARK_TABLE = os.getenv('NEWS_TRANSFORM_WATERMARK_TABLE',
+                                      'news_transform_watermarks')
+
+# Rader yngre än så här läses av nästa körning, så att rader som fortfarande
+# strömmas in med en något äldre fetch_date inte hoppas över
+NEWS_WATERMARK_LAG = timedelta(minutes=int(os.getenv('NEWS_WATERMARK_LAG_MINUTES', '10')))
+
+# Fler ID:n än så markeras som bearbetade via en tillfällig tabell i
+# stället för som en arrayparameter
+PROCESSED_IDS_PARAM_LIMIT = int(os.getenv('PROCESSED_IDS_PARAM_LIMIT', '10000'))
+PROCESSED_IDS_SCHEMA = [bigquery.SchemaField("unique_id", "STRING", mode="REQUIRED")]
+STAGING_TABLE_EXPIRY = timedelta(hours=6)
+
+# Hur clean_news packar upp JSON-svaren: 'arrow' eller 'pandas'
+FLATTEN_ARROW = 'arrow'
+FLATTEN_PANDAS = 'pandas'
+NEWS_FLATTEN = os.getenv('NEWS_FLATTEN', FLATTEN_ARROW)
+
+# De delar av NewsAPI-svaret som clean_news_data behöver. Övriga fält
+# (content, urlToImage, source.id, status, ...) hoppar parsern över.
+NEWS_PAYLOAD_SCHEMA = pa.schema([
+    pa.field('articles', pa.list_(pa.struct([
+        pa.field('source', pa.struct([pa.field('name', pa.string())])),
+        pa.field('author', pa.string()),
+        pa.field('title', pa.string()),
+        pa.field('description', pa.string()),
+        pa.field('url', pa.string()),
+        pa.field('publishedAt', pa.string()),
+    ]))),
+])
+
+PUBLISHED_AT_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Samma upplösning som pd.to_datetime ger i den här pandas-versionen
+# (ns i pandas 2, us i pandas 3), så att båda vägarna ger samma dtype
+_PUB_DATE_UNIT = pd.to_datetime(pd.Series(['2024-01-01T00:00:00Z']),
+                                format=PUBLISHED_AT_FORMAT, utc=True).dtype.unit
+
+
+def raw_news_columns(client, raw_data_table_id: str, source_format: str = 'blob'):
+    """
+    The columns to read from a raw news table.
 
+    'blob' reads the JSON responses of `raw_news_data`, or the compressed
+    payloads of `raw_news_data_compact`. 'articles' reads `raw_news_articles`
+    and selects only the columns the clean table needs, so BigQuery prunes
+    `content` and `url_to_image` and no JSON has to be parsed in Python.
+
+    Args:
+        client (bigquery.Client): Used to look up the raw table's schema.
+        raw_data_table_id (str): Fully qualified raw table.
+        source_format (str): 'blob' or 'articles'.
 
-def get_project_id():
-    """Retrieve project ID either from environment or default credentials."""
-    # First, check if the GOOGLE_CLOUD_PROJECT env var is set
-    project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
+    Returns:
+        str: The SELECT list.
+        bool: True if the payloads are compressed (`data_z`, `encoding`).
+    """
+    if source_format == 'articles':
+        return ("unique_id, author, title, description, url, "
+                "published_at AS pub_date, source_name, company"), False
 
-    if not project_id:
-        # If not set, retrieve the project ID from default credentials
-        _, project_id = default()
-    return project_id
+    # Komprimerade tabeller (raw_news_data_compact) packas upp transparent
+    compact = any(field.name == 'data_z'
+                  for field in client.get_table(raw_data_table_id).schema)
+    return f"unique_id, {'data_z, encoding' if compact else 'data'}, company", compact
 
-def get_secret(secret_name='bigquery-accout-secret') -> str:
-    """Fetches a secret from Google Cloud Secret Manager.
 
-    Args:
-        secret_name (str): The name of the secret in Secret Manager.
+def unprocessed_news_query(client, raw_data_table_id: str, meta_data_table_id: str,
+                           source_format: str = 'blob'):
+    """
+    Builds the query selecting rows not yet marked as processed in
+    `meta_data_table_id`.
 
     Returns:
-        str: The secret data as a string.
+        str: The query.
+        bool: True if the payloads are compressed, see `raw_news_columns`.
     """
-    # Instansiera en klient för Secret Manager
-    client = secretmanager.SecretManagerServiceClient()
+    columns, compact = raw_news_columns(client, raw_data_table_id, source_format)
+    query = f"""
+        SELECT {columns}
+        FROM `{raw_data_table_id}`
+        WHERE unique_id IN (SELECT unique_id FROM `{meta_data_table_id}`
+        WHERE is_processed IS FALSE)
+        """
+    return query, compact
 
-    # Bygg sökvägen till den hemlighet du vill hämta
-    project_id = get_project_id()  # Ersätt med ditt projekt-ID
-    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
 
-    # Hämta den senaste versionen av hemligheten
-    response = client.access_secret_version(name=secret_path)
+def news_since_query(client, raw_data_table_id: str, source_format: str = 'blob'):
+    """
+    Builds the query selecting rows fetched in the window (@since, @until].
+
+    On a table partitioned by `fetch_date` BigQuery reads only the
+    partitions in the window, so the cost follows the new data.
+
+    Returns:
+        str: The query.
+        bool: True if the payloads are compressed, see `raw_news_columns`.
+    """
+    columns, compact = raw_news_columns(client, raw_data_table_id, source_format)
+    query = f"""
+        SELECT {columns}
+        FROM `{raw_data_table_id}`
+        WHERE fetch_date > @since AND fetch_date <= @until
+        """
+    return query, compact
 
-    # Dekoda hemligheten till en sträng
-    secret_data = response.payload.data.decode('UTF-8')
 
-    return secret_data
+def rebatch(record_batches: Iterable[pa.RecordBatch], batch_rows: int) -> Iterator[pa.Table]:
+    """
+    Regroups Arrow record batches of any size into tables of `batch_rows`
+    rows. The last table may be smaller.
+    """
+    pending, rows = [], 0
+    for batch in record_batches:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= batch_rows:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, batch_rows)
+            rest = table.slice(batch_rows)
+            pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending)
+
+
+def raw_news_frame(table: pa.Table, compact: bool) -> pd.DataFrame:
+    """Converts a batch of raw rows to a DataFrame, decoding compressed payloads."""
+    df = table.to_pandas()
+    if compact:
+        df['data'] = [decode_payload_text(value, encoding)
+                      for value, encoding in zip(df.pop('data_z'), df.pop('encoding'))]
+    return df
+
+
+def stream_query_results(query: str, compact: bool, batch_rows: int, max_streams: int,
+                         job_config: Optional[bigquery.QueryJobConfig] = None) -> List[Iterator[pd.DataFrame]]:
+    """
+    Runs `query` and streams its result through the BigQuery Storage Read API.
 
+    The result table is read over up to `max_streams` Arrow read streams
+    instead of being downloaded whole with `to_dataframe()`. Each stream
+    yields DataFrames of at most `batch_rows` raw rows and reads the next
+    page only when asked, so a large backlog (e.g. after a backfill) never
+    has to fit in memory. The streams are independent and can be consumed
+    in parallel.
 
-def get_raw_news_from_big_query(raw_data_table:str,
-                                meta_data_table:str, 
-                                project_id:str, 
-                                dataset:str
-                                ):
+    Returns:
+        list: One lazy iterator of DataFrames per read stream. Empty if the
+        query returned no rows.
     """
-    Fetches unprocessed raw news data from a specified BigQuery table and returns it as a pandas DataFrame 
-    along with a string of row IDs that were used.
+    # Delade klienter för hela processen
+    client = get_bigquery_client()
+    read_client = get_bigquery_read_client()
 
-    This function connects to Google BigQuery using credentials from a service account, constructs and executes 
-    an SQL query to select rows where `is_processed` is FALSE from the specified table within the provided 
-    dataset and project. The results are returned as a pandas DataFrame. It also extracts the `unique_id` from 
-    the DataFrame and compiles them into a comma-separated string format for further processing.
+    job = client.query(query, job_config=job_config)
+    if job.result().total_rows == 0:
+        return []
+
+    # Resultatet ligger i en temporär tabell som Storage Read API kan läsa
+    destination = job.destination
+    session = read_client.create_read_session(
+        parent=f"projects/{client.project}",
+        read_session=bigquery_storage.types.ReadSession(
+            table=(f"projects/{destination.project}/datasets/"
+                   f"{destination.dataset_id}/tables/{destination.table_id}"),
+            data_format=bigquery_storage.types.DataFormat.ARROW),
+        max_stream_count=max_streams)
+
+    def stream_batches(stream_name: str) -> Iterator[pd.DataFrame]:
+        pages = read_client.read_rows(stream_name).rows(session).pages
+        for table in rebatch((page.to_arrow() for page in pages), batch_rows):
+            yield raw_news_frame(table, compact)
+
+    return [stream_batches(stream.name) for stream in session.streams]
+
+
+def read_unprocessed_news(raw_data_table: str,
+                          meta_data_table: str,
+                          project_id: str,
+                          dataset: str,
+                          source_format: str = 'blob',
+                          batch_rows: int = NEWS_BATCH_ROWS,
+                          max_streams: int = NEWS_READ_STREAMS) -> List[Iterator[pd.DataFrame]]:
+    """
+    Streams the raw news not yet marked as processed in `meta_data_table`.
 
     Args:
-        table (str): The name of the table in BigQuery to fetch data from. Default is 'raw_news'.
-        project_id (str): The Google Cloud project ID where the BigQuery dataset is located. Default is 'tomastestproject-433206'.
-        dataset (str): The BigQuery dataset name that contains the table. Default is 'testdb_1'.
+        raw_data_table (str): Raw table, see `raw_news_columns`.
+        meta_data_table (str): Table holding `unique_id` and `is_processed`.
+        project_id (str): The Google Cloud project ID.
+        dataset (str): The BigQuery dataset that contains the tables.
+        source_format (str): 'blob' or 'articles'.
+        batch_rows (int): Raw rows per DataFrame.
+        max_streams (int): Upper bound on read streams; BigQuery may use fewer.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the unprocessed raw news data.
-        str: A string of `unique_id`s from the fetched rows, formatted as comma-separated values in single quotes.
-
-    Raises:
-        ValueError: If no unprocessed data is found in the table.xw
+        list: See `stream_query_results`.
     """
-    secret_data = get_secret()
-
-    # Ladda JSON-strängen till en dictionary
-    service_account_info = json.loads(secret_data)
+    query, compact = unprocessed_news_query(
+        get_bigquery_client(), f"{project_id}.{dataset}.{raw_data_table}",
+        f"{project_id}.{dataset}.{meta_data_table}", source_format)
+    return stream_query_results(query, compact, batch_rows, max_streams)
+
+
+def read_news_since(raw_data_table: str,
+                    project_id: str,
+                    dataset: str,
+                    since: datetime,
+                    until: datetime,
+                    source_format: str = 'blob',
+                    batch_rows: int = NEWS_BATCH_ROWS,
+                    max_streams: int = NEWS_READ_STREAMS) -> List[Iterator[pd.DataFrame]]:
+    """
+    Streams the raw news fetched after `since` and up to `until`.
 
-    # Initiera BigQuery-klienten med service account
-    client = bigquery.Client.from_service_account_info(service_account_info)
+    Unlike `read_unprocessed_news` no meta data table is involved: the
+    window comes from the watermark, see `get_transform_watermark`.
 
-    raw_data_table_id = f"{project_id}.{dataset}.{raw_data_table}"
-    meta_data_table_id = f"{project_id}.{dataset}.{meta_data_table}"
+    Args:
+        raw_data_table (str): Raw table partitioned on `fetch_date`.
+        project_id (str): The Google Cloud project ID.
+        dataset (str): The BigQuery dataset that contains the table.
+        since (datetime): Exclusive lower bound on `fetch_date`.
+        until (datetime): Inclusive upper bound on `fetch_date`.
+        source_format (str): 'blob' or 'articles'.
+        batch_rows (int): Raw rows per DataFrame.
+        max_streams (int): Upper bound on read streams.
 
+    Returns:
+        list: See `stream_query_results`.
+    """
+    query, compact = news_since_query(
+        get_bigquery_client(), f"{project_id}.{dataset}.{raw_data_table}", source_format)
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+        bigquery.ScalarQueryParameter("until", "TIMESTAMP", until)])
+    return stream_query_results(query, compact, batch_rows, max_streams, job_config)
 
-    # Build your SQL query
-    query = f"""
-        SELECT unique_id, data,company
-        FROM `{raw_data_table_id}`
-        WHERE unique_id IN (SELECT unique_id FROM `{meta_data_table_id}` 
-        WHERE is_processed IS FALSE)
-        """
 
-    # Execute the SQL query
-    query_job = client.query(query)
+def watermark_window(last_fetch_date: Optional[datetime] = None, now: Optional[datetime] = None):
+    """
+    The `fetch_date` window for the next watermark run.
 
-    # Fetch the results
-    results = query_job.result()
+    The window starts at the last watermark (or the beginning of time) and
+    ends NEWS_WATERMARK_LAG before now, so rows still being streamed in with
+    a slightly older `fetch_date` are picked up by the next run instead of
+    being skipped.
 
-    # Convert results to a DataFrame
-    df = results.to_dataframe()
+    Returns:
+        datetime: Exclusive start.
+        datetime: Inclusive end.
+    """
+    now = now or datetime.now(timezone.utc)
+    since = last_fetch_date or datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return since, max(since, now - NEWS_WATERMARK_LAG)
 
-    # Check if DataFrame is empty and raise an error if needed
-    if df.empty:
-        raise ValueError("No unprocessed data found")
 
-    # Create a comma-separated string of unique IDs
-    processed_id_list = df["unique_id"].to_list()
-    id_str = ', '.join(f"'{id}'" for id in processed_id_list)
+def get_transform_watermark(client, watermark_table_id: str,
+                            source_table_id: str) -> Optional[datetime]:
+    """The last `fetch_date` processed from `source_table_id`, or None."""
+    query = f"""
+        SELECT last_fetch_date
+        FROM `{watermark_table_id}`
+        WHERE source_table = @source_table
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("source_table", "STRING", source_table_id)])
+    rows = list(client.query(query, job_config=job_config).result())
+    return rows[0].last_fetch_date if rows else None
 
-    return df, id_str
 
+def advance_transform_watermark(client, watermark_table_id: str,
+                                source_table_id: str, last_fetch_date: datetime):
+    """
+    Moves the watermark forward with a MERGE. It never moves backwards, so
+    an older, slower run cannot undo a newer run's progress.
+    """
+    query = f"""
+        MERGE `{watermark_table_id}` T
+        USING (SELECT @source_table AS source_table,
+                      @last_fetch_date AS last_fetch_date) S
+        ON T.source_table = S.source_table
+        WHEN MATCHED AND S.last_fetch_date > T.last_fetch_date THEN
+            UPDATE SET last_fetch_date = S.last_fetch_date,
+                       updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (source_table, last_fetch_date, updated_at)
+            VALUES (S.source_table, S.last_fetch_date, CURRENT_TIMESTAMP())
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("source_table", "STRING", source_table_id),
+        bigquery.ScalarQueryParameter("last_fetch_date", "TIMESTAMP", last_fetch_date)])
+    client.query(query, job_config=job_config).result()
 
-def update_is_processed(id_string: str,
-                        table:str, 
-                        project_id:str, 
-                        dataset:str):
 
-    table_id = f"{project_id}.{dataset}.{table}"
-    secret_data = get_secret()
+def update_is_processed(ids: Iterable[str],
+                        table: str,
+                        project_id: str,
+                        dataset: str) -> int:
+    """
+    Marks the given `unique_id`s as processed in the meta data table.
 
-    # Ladda JSON-strängen till en dictionary
-    service_account_info = json.loads(secret_data)
+    The IDs are sent as an array query parameter instead of being quoted
+    into the SQL, so the statement stays small however many IDs there are.
+    Sets larger than PROCESSED_IDS_PARAM_LIMIT are loaded into a short-lived
+    staging table and applied with one MERGE instead, which keeps the
+    request under BigQuery's size limits. Only rows that are still
+    unprocessed are touched.
 
-    # Initiera BigQuery-klienten med service account
-    client = bigquery.Client.from_service_account_info(
-        service_account_info)
-   
+    Args:
+        ids (Iterable[str]): `unique_id`s of the rows that were written.
+        table (str): The meta data table.
+        project_id (str): The Google Cloud project ID.
+        dataset (str): The BigQuery dataset that contains the table.
 
-        # Konstruera SQL-frågan
-    query = f"""
-    UPDATE `{table_id}`
-    SET is_processed = TRUE
-    WHERE unique_id IN ({id_string});
+    Returns:
+        int: Number of rows marked as processed.
     """
+    table_id = f"{project_id}.{dataset}.{table}"
+    # Delad BigQuery-klient för hela processen
+    client = get_bigquery_client()
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return 0
+
+    if len(ids) <= PROCESSED_IDS_PARAM_LIMIT:
+        query = f"""
+            UPDATE `{table_id}`
+            SET is_processed = TRUE
+            WHERE is_processed IS FALSE AND unique_id IN UNNEST(@ids)
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter("ids", "STRING", ids)])
+        return client.query(query, job_config=job_config).result().num_dml_affected_rows or 0
+
+    # Många ID:n: ladda dem till en tillfällig tabell och kör en MERGE
+    staging_table_id = f"{table_id}_staging_{uuid.uuid4().hex[:12]}"
+    staging_table = bigquery.Table(staging_table_id, schema=PROCESSED_IDS_SCHEMA)
+    staging_table.expires = datetime.now(timezone.utc) + STAGING_TABLE_EXPIRY
+    client.create_table(staging_table)
+    try:
+        client.load_table_from_json(
+            [{"unique_id": id} for id in ids], staging_table_id,
+            job_config=bigquery.LoadJobConfig(schema=PROCESSED_IDS_SCHEMA)).result()
+        query = f"""
+            MERGE `{table_id}` T
+            USING `{staging_table_id}` S
+            ON T.unique_id = S.unique_id
+            WHEN MATCHED AND T.is_processed IS FALSE THEN
+              UPDATE SET is_processed = TRUE
+        """
+        return client.query(query).result().num_dml_affected_rows or 0
+    finally:
+        client.delete_table(staging_table_id, not_found_ok=True)
 
-    # Kör frågan
-    job = client.query(query)
-    job.result()  # Vänta på att jobbet ska slutföras
-    return id_string
 
+def flatten_news_arrow(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The Arrow path of `clean_news`: one row per article, same columns.
 
-def clean_news(df: pd.DataFrame) -> pd.DataFrame:
+    All payloads are parsed in one call by Arrow's JSON reader straight into
+    columnar arrays, keeping only the fields in NEWS_PAYLOAD_SCHEMA. Articles
+    are unnested with list offsets instead of `explode`/`json_normalize`,
+    and the table is converted to pandas once at the end. Like the pandas
+    path, a payload without articles gives one row with only `company`.
+    """
+    payloads = [value if isinstance(value, str) else '{}' for value in df['data']]
+    text = '\n'.join(payloads).encode('utf-8')
+    parse_options = pa_json.ParseOptions(
+        explicit_schema=NEWS_PAYLOAD_SCHEMA,
+        unexpected_field_behavior='ignore',
+        # Bara indenterad JSON behöver den långsammare parsningen
+        newlines_in_values=any('\n' in payload for payload in payloads))
+    # Block som parsas parallellt; ett svar (upp till 4 bytes per tecken) måste rymmas
+    block_size = max(1 << 22, 4 * max(map(len, payloads), default=0) + 1)
+    table = pa_json.read_json(pa.py_buffer(text), parse_options=parse_options,
+                              read_options=pa_json.ReadOptions(block_size=block_size))
+    if table.num_rows != len(df):
+        raise ValueError(f"Expected {len(df)} payloads, parsed {table.num_rows}")
+
+    articles = table.column('articles').combine_chunks()
+    lengths = pc.list_value_length(articles).fill_null(0).to_numpy(zero_copy_only=False)
+
+    # Varje payload ger minst en rad, precis som explode på en tom lista
+    counts = np.maximum(lengths, 1)
+    row_of = np.repeat(np.arange(len(df)), counts)
+    first_article = np.cumsum(lengths) - lengths
+    first_row = np.cumsum(counts) - counts
+    take = first_article[row_of] + np.arange(len(row_of)) - first_row[row_of]
+    exploded = articles.flatten().take(pa.array(take, mask=(lengths == 0)[row_of]))
+
+    final = pa.table({
+        'author': pc.struct_field(exploded, 'author'),
+        'title': pc.struct_field(exploded, 'title'),
+        'description': pc.struct_field(exploded, 'description'),
+        'url': pc.struct_field(exploded, 'url'),
+        # Ogiltiga datum blir NULL, som errors='coerce' i pandas-vägen
+        'pub_date': pc.strptime(pc.struct_field(exploded, 'publishedAt'),
+                                format=PUBLISHED_AT_FORMAT, unit='s', error_is_null=True
+                                ).cast(pa.timestamp(_PUB_DATE_UNIT, tz='UTC')),
+        'source_name': pc.struct_field(pc.struct_field(exploded, 'source'), 'name'),
+    }).to_pandas()
+    final['company'] = df['company'].to_numpy()[row_of]
+    return final
+
+
+def clean_news(df: pd.DataFrame, flatten: str = NEWS_FLATTEN) -> pd.DataFrame:
     """
     Cleans and transforms raw news data extracted from BigQuery into a structured DataFrame format.
 
@@ -149,10 +448,16 @@ def clean_news(df: pd.DataFrame) -> pd.DataFrame:
 
     Args:
         df (pd.DataFrame): DataFrame containing raw news data with columns `unique_id`, `company`, `fetch_date`, `data`, and `is_processed`.
+        flatten (str): 'arrow' (default, see `flatten_news_arrow`) or 'pandas'.
 
     Returns:
         pd.DataFrame: A DataFrame where each row represents a single news article with additional columns from the `company` column.
     """
+    if flatten == FLATTEN_ARROW:
+        return flatten_news_arrow(df)
+    if flatten != FLATTEN_PANDAS:
+        raise ValueError(f"Unknown flatten '{flatten}', use '{FLATTEN_ARROW}' or '{FLATTEN_PANDAS}'")
+
     def extract_articles(json_obj):
         if isinstance(json_obj, dict) and 'articles' in json_obj:
             return json_obj['articles']
@@ -167,7 +472,9 @@ def clean_news(df: pd.DataFrame) -> pd.DataFrame:
     df_exploded = df.explode('data')
 
     # Normalisera JSON-data i 'data' kolumnen
-    articles_df = pd.json_normalize(df_exploded['data'])
+    # En lista, så att indexet blir 0..n även i pandas versioner som behåller
+    # seriens (efter explode icke-unika) index
+    articles_df = pd.json_normalize(df_exploded['data'].tolist())
 
     # Lägg till övriga kolumner
     final_df = pd.concat(
@@ -179,7 +486,7 @@ def clean_news(df: pd.DataFrame) -> pd.DataFrame:
 
     # Omvandla 'publishedAt' till datetime format
     final_df['publishedAt'] = pd.to_datetime(
-        final_df['publishedAt'], format='%Y-%m-%dT%H:%M:%SZ', utc=True, errors='coerce')
+        final_df['publishedAt'], format=PUBLISHED_AT_FORMAT, utc=True, errors='coerce')
 
     # Omvandla kolumnnamn för läsbarhet
     final_df.rename(columns={"source.name": "source_name",
@@ -188,23 +495,55 @@ def clean_news(df: pd.DataFrame) -> pd.DataFrame:
     return final_df
 
 
+def clean_articles(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Brings rows read with `source_format='articles'` to the same columns
+    that `clean_news` produces, so both paths write the same clean table.
+    """
+    final_df = df.drop(columns=['unique_id'], errors='ignore')
+    final_df['pub_date'] = pd.to_datetime(final_df['pub_date'], utc=True,
+                                          errors='coerce')
+    return final_df[['author', 'title', 'description', 'url', 'pub_date',
+                     'source_name', 'company']]
+
+
 def make_sentiment_score(string: str) -> float:
     """
     Predicts sentiment for a string. returns a float between -1 and 1.
     """
-    sia = SentimentIntensityAnalyzer()
     if string is None:
         return None
     else:
-        return sia.polarity_scores(string)['compound']
+        return get_analyzer().polarity_scores(string)['compound']
 
 
-def predict_sentiment(df: pd.DataFrame):
+def predict_sentiment(df: pd.DataFrame, engine: Optional[SentimentEngine] = None) -> dict:
     """
     Makes scores for each title and description and adds it as "score_description" and "score_title" to the Dataframe.
+
+    Titles and descriptions are scored in one batch by the shared
+    `SentimentEngine`, so repeated texts are only scored once. The scorer is
+    pluggable: pass an engine built with another scorer from
+    `sentiment.SCORERS`, or set SENTIMENT_SCORER=vectorized to score whole
+    columns with NumPy (same scores as NLTK's VADER).
+
+    Returns:
+        dict: Articles scored, time taken and articles per second.
     """
-    df['score_description'] = df['description'].apply(make_sentiment_score)
-    df['score_title'] = df['title'].apply(make_sentiment_score)
+    engine = engine or get_sentiment_engine()
+    started = time.perf_counter()
+
+    texts = [text if isinstance(text, str) else None
+             for text in list(df['description']) + list(df['title'])]
+    scores = engine.score_many(texts)
+    # None blir NaN, och NULL i BigQuery, precis som med Series.apply
+    df['score_description'] = np.array(scores[:len(df)], dtype=float)
+    df['score_title'] = np.array(scores[len(df):], dtype=float)
+
+    seconds = time.perf_counter() - started
+    return {"articles": len(df),
+            "seconds": round(seconds, 3),
+            "articles_per_second": round(len(df) / seconds, 1) if seconds else 0.0}
 
 
 def write_clean_news_to_bq(data: pd.DataFrame, 
@@ -215,14 +554,8 @@ def write_clean_news_to_bq(data: pd.DataFrame,
     Writes cleaned data to Big Query
     """
     #Initiera BigQuery-klienten
-    secret_data = get_secret()
-
-    # Ladda JSON-strängen till en dictionary
-    service_account_info = json.loads(secret_data)
-
-    # Initiera BigQuery-klienten med service account
-    client = bigquery.Client.from_service_account_info(
-        service_account_info)
+    # Delad BigQuery-klient för hela processen
+    client = get_bigquery_client()
 
 
     # Definiera fullständigt tabell-id
@@ -247,17 +580,8 @@ def transfer_ids_to_meta_data(table_from:str,
                               dataset:str, 
                               ):
     try:
-        # Initiera BigQuery-klienten
-
-        # Hämta JSON-sträng från Secret Manager
-        secret_data = get_secret()
-
-        # Ladda JSON-strängen till en dictionary
-        service_account_info = json.loads(secret_data)
-
-        # Initiera BigQuery-klienten med service account
-        client = bigquery.Client.from_service_account_info(
-            service_account_info)
+        # Delad BigQuery-klient för hela processen
+        client = get_bigquery_client()
 
         # Definiera din dataset och tabell
         meta_data_table = f"{project_id}.{dataset}.{table_to}"
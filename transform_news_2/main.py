@@ -1,15 +1,23 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import nltk
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from clean_news import (get_raw_news_from_big_query,
-                        clean_news, predict_sentiment, 
+from clean_news import (NEWS_BATCH_ROWS, NEWS_READ_STREAMS, MODE_META,
+                        MODE_WATERMARK, NEWS_PROCESSING_MODE,
+                        TRANSFORM_WATERMARK_TABLE,
+                        read_unprocessed_news, read_news_since, watermark_window,
+                        get_transform_watermark, advance_transform_watermark,
+                        clean_news, clean_articles, predict_sentiment, 
                         write_clean_news_to_bq, 
                         update_is_processed,
-                        transfer_ids_to_meta_data,
-                        get_project_id,
-                        get_secret
+                        transfer_ids_to_meta_data
                         )
+from dedupe import ArticleDeduper, recent_clean_keys
+from sentiment import get_sentiment_engine
+from shared.gcp import cache_stats, get_bigquery_client, get_project_id, get_secret
 import logging
 
 
@@ -29,6 +37,14 @@ class NewsRequest(BaseModel):
     fetch_table: Optional[str] = get_secret(secret_name='RAW_NEWS_DATA')
     write_table: Optional[str] = get_secret(secret_name='CLEAN_NEWS_DATA')
     meta_data_table: Optional[str] = get_secret(secret_name='RAW_NEWS_META_DATA')
+    # 'blob' läser JSON-svar ur raw_news_data, 'articles' läser raw_news_articles
+    source_format: Optional[str] = 'blob'
+    # Råa rader per batch och max antal parallella läsströmmar
+    batch_rows: Optional[int] = NEWS_BATCH_ROWS
+    read_streams: Optional[int] = NEWS_READ_STREAMS
+    # 'meta' (raw_news_meta_data) eller 'watermark' (fetch_date-vattenmärke)
+    mode: Optional[str] = NEWS_PROCESSING_MODE
+    watermark_table: Optional[str] = TRANSFORM_WATERMARK_TABLE
     
 class TransferData(BaseModel):
     project_id: Optional[str] = get_project_id()
@@ -40,33 +56,135 @@ class TransferData(BaseModel):
 # Definiera POST endpoint för att hämta, rensa och analysera nyheter
 
 
+# Samtidiga UPDATE mot metadatatabellen krockar i BigQuery, så batcherna
+# markeras som bearbetade en i taget
+_mark_processed_lock = threading.Lock()
+
+
+def process_batch(df, request: NewsRequest, deduper: ArticleDeduper) -> dict:
+    """
+    Rensar, poängsätter och skriver en batch. Dubletter av redan skrivna
+    artiklar tas bort innan poängsättningen. I läget 'meta' markeras batchen
+    sedan som bearbetad; i läget 'watermark' flyttas vattenmärket i stället
+    fram när hela körningen är klar.
+    """
+    ids = df['unique_id'].tolist()
+
+    # Rensa nyhetsdata
+    if request.source_format == 'articles':
+        cleaned_df = clean_articles(df=df)
+    else:
+        cleaned_df = clean_news(df=df)
+
+    # Släng artiklar som redan är skrivna eller finns tidigare i körningen
+    cleaned_df, dedupe_stats = deduper.drop_duplicates(cleaned_df)
+
+    sentiment_seconds = 0.0
+    if len(cleaned_df):
+        # Gör sentimentanalyser
+        sentiment_seconds = predict_sentiment(df=cleaned_df)["seconds"]
+
+        # Skriv de rensade nyheterna till BigQuery
+        write_clean_news_to_bq(data=cleaned_df, table=request.write_table)
+
+    # Först när batchen är skriven räknas den som bearbetad
+    rows_marked = 0
+    if request.mode == MODE_META:
+        with _mark_processed_lock:
+            rows_marked = update_is_processed(ids=ids, table=request.meta_data_table,
+                                              project_id=request.project_id,
+                                              dataset=request.dataset)
+
+    return {"rows_read": len(df), "rows_written": len(cleaned_df),
+            "rows_marked_processed": rows_marked,
+            "duplicates_dropped": dedupe_stats["duplicates_in_batch"] + dedupe_stats["duplicates_seen"],
+            "sentiment_seconds": sentiment_seconds}
+
+
+def process_stream(batches, request: NewsRequest, deduper: ArticleDeduper) -> dict:
+    """Bearbetar en läsströms batcher i tur och ordning."""
+    totals = {"batches": 0, "rows_read": 0, "rows_written": 0,
+              "rows_marked_processed": 0, "duplicates_dropped": 0,
+              "sentiment_seconds": 0.0}
+    for df in batches:
+        result = process_batch(df, request, deduper)
+        totals["batches"] += 1
+        for key, value in result.items():
+            totals[key] += value
+    return totals
+
+
 @app.post("/clean_news/")
 def clean_news_endpoint(request: NewsRequest):
     try:
-        # Hämta data från BigQuery
-        df,ids = get_raw_news_from_big_query(
+        started = time.perf_counter()
+        if request.mode not in (MODE_META, MODE_WATERMARK):
+            raise ValueError(f"Unknown mode '{request.mode}', use '{MODE_META}' or '{MODE_WATERMARK}'")
+
+        # Läs backloggen i batcher via Storage Read API, en iterator per ström
+        if request.mode == MODE_WATERMARK:
+            client = get_bigquery_client()
+            raw_data_table_id = f"{request.project_id}.{request.dataset}.{request.fetch_table}"
+            watermark_table_id = f"{request.project_id}.{request.dataset}.{request.watermark_table}"
+            since, until = watermark_window(
+                get_transform_watermark(client, watermark_table_id, raw_data_table_id))
+            streams = read_news_since(raw_data_table=request.fetch_table,
+                                      project_id=request.project_id,
+                                      dataset=request.dataset,
+                                      since=since, until=until,
+                                      source_format=request.source_format,
+                                      batch_rows=request.batch_rows,
+                                      max_streams=request.read_streams)
+        else:
+            streams = read_unprocessed_news(
                                             raw_data_table=request.fetch_table, 
                                             meta_data_table=request.meta_data_table, 
                                             project_id=request.project_id, 
-                                            dataset=request.dataset
+                                            dataset=request.dataset,
+                                            source_format=request.source_format,
+                                            batch_rows=request.batch_rows,
+                                            max_streams=request.read_streams
                                             )
         
-        if df is None or ids is None or df.empty:
+        if not streams:
+            if request.mode == MODE_WATERMARK:
+                # Inget nytt i fönstret, nästa körning kan börja vid until
+                advance_transform_watermark(client, watermark_table_id, raw_data_table_id, until)
             return {"message": "There is no unprocessed data to fetch."}
-            
-        # Rensa nyhetsdata
-        cleaned_df = clean_news(df=df)
-
-        # Gör sentimentanalyser
-        predict_sentiment(df=cleaned_df)
 
-        # Skriv de rensade nyheterna till BigQuery och få antalet rader som skrevs
-        rows_written = write_clean_news_to_bq(data=cleaned_df,table=request.write_table)
-
-        update_is_processed(id_string=ids, table=request.meta_data_table,project_id=request.project_id,dataset=request.dataset)
+        # Nycklar för nyligen skrivna artiklar; delas av alla strömmar så att
+        # dubletter mellan strömmar också fångas
+        deduper = ArticleDeduper(recent_clean_keys(
+            get_bigquery_client(), f"{request.project_id}.{request.dataset}.{request.write_table}"))
+
+        # Strömmarna bearbetas parallellt; varje batch skrivs innan nästa läses
+        with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+            results = list(executor.map(lambda batches: process_stream(batches, request, deduper),
+                                        streams))
+
+        totals = {key: sum(result[key] for result in results) for key in results[0]}
+
+        # Alla batcher i fönstret är skrivna; ett fel ovan gör att nästa
+        # körning läser om samma fönster
+        watermark = None
+        if request.mode == MODE_WATERMARK:
+            advance_transform_watermark(client, watermark_table_id, raw_data_table_id, until)
+            watermark = until.isoformat()
+        seconds = time.perf_counter() - started
+        sentiment_stats = {"articles": totals["rows_written"],
+                           "seconds": round(totals.pop("sentiment_seconds"), 3)}
+        logging.info(f"Sentiment: {sentiment_stats}")
+        dedupe_stats = deduper.stats()
+        logging.info(f"Dedupe: {dedupe_stats}")
 
         # Returnera resultat som JSON
-        return {"message": "Data cleaned and written to BigQuery successfully.", "rows_written": rows_written}
+        return {"message": "Data cleaned and written to BigQuery successfully.",
+                "streams": len(streams),
+                **totals,
+                "seconds": round(seconds, 3),
+                "watermark": watermark,
+                "sentiment": sentiment_stats,
+                "dedupe": dedupe_stats}
 
     except Exception as e:
             # Logga detaljer om felet och returnera ett HTTP-fel med detaljer
@@ -89,6 +207,13 @@ def transfer_to_meta_data_endpoint(request:TransferData):
             raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
         
 
+@app.get("/cache-stats/")
+def get_cache_stats():
+    # Träffar och missar i den delade cachen för hemligheter och klienter,
+    # och i sentimentcachen
+    return {**cache_stats(), "sentiment": get_sentiment_engine().stats()}
+
+
 # Kör appen om detta script är huvudscripten
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Iterable
+
+# Sökväg till cachefilen. Tom sträng stänger av den beständiga cachen.
+SENTIMENT_STORE_PATH = os.getenv(
+    'SENTIMENT_STORE_PATH',
+    os.path.join(tempfile.gettempdir(), 'sentiment_scores.sqlite'))
+
+# SQLite tillåter högst 999 parametrar per fråga i äldre versioner
+_MAX_PARAMS = 900
+
+
+class ScoreStore:
+    """
+    Beständig cache för sentimentpoäng i en SQLite-fil, mellan körningar.
+
+    Nyckeln är hashen av den normaliserade texten (se `sentiment.text_key`)
+    tillsammans med poängsättarens version. När versionen ändras, t.ex.
+    efter en ny NLTK-version eller ett nytt lexikon, tas alla poäng från
+    andra versioner bort när cachen öppnas, så gamla poäng används aldrig.
+
+    Args:
+        path (str): Filen. Skapas om den saknas.
+        version (str): Poängsättarens version, se `sentiment.VaderScorer`.
+    """
+
+    def __init__(self, path: str, version: str):
+        self.path = path
+        self.version = version
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL låter en annan process läsa medan vi skriver
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                version TEXT NOT NULL,
+                key BLOB NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (version, key)
+            ) WITHOUT ROWID
+        """)
+        with self._db:
+            self.invalidated = self._db.execute(
+                "DELETE FROM scores WHERE version != ?", (version,)).rowcount
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, float]:
+        """Sparade poäng för nycklarna. Nycklar som saknas är inte med."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                rows = self._db.execute(
+                    f"SELECT key, score FROM scores WHERE version = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})",
+                    [self.version, *chunk])
+                found.update(rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, scores: Dict[bytes, float]):
+        """Sparar poäng i en transaktion."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO scores (version, key, score) VALUES (?, ?, ?)",
+                [(self.version, key, score) for key, score in scores.items()])
+            self.writes += len(scores)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM scores WHERE version = ?",
+                                    (self.version,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"path": self.path,
+                    "version": self.version,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                    "writes": self.writes,
+                    "invalidated": self.invalidated}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,295 @@
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, List, Optional
+import nltk
+from nltk.sentiment import SentimentIntensityAnalyzer
+from score_cache import SENTIMENT_STORE_PATH, ScoreStore
+from vector_sentiment import VectorizedVaderScorer
+
+# Antal poäng som sparas i minnet per process
+SENTIMENT_CACHE_SIZE = int(os.getenv('SENTIMENT_CACHE_SIZE', '100000'))
+
+# Processer för stora batcher. 1 (standard på en Cloud Run-instans med en
+# CPU) betyder att allt körs i den egna processen.
+SENTIMENT_WORKERS = int(os.getenv('SENTIMENT_WORKERS', str(os.cpu_count() or 1)))
+
+# Färre ocachade texter än så här lönar sig inte att skicka till poolen
+SENTIMENT_PARALLEL_THRESHOLD = int(os.getenv('SENTIMENT_PARALLEL_THRESHOLD', '2000'))
+
+# Startmetod för poolens processer. 'fork' är inte säkert när andra trådar
+# samtidigt använder gRPC (Storage Read API), se SentimentEngine._get_pool.
+SENTIMENT_POOL_START_METHOD = os.getenv('SENTIMENT_POOL_START_METHOD', 'forkserver')
+
+# Poängsättare: 'vader' (NLTK, en text i taget) eller 'vectorized' (samma
+# poäng, hela batchen med NumPy)
+SENTIMENT_SCORER = os.getenv('SENTIMENT_SCORER', 'vader')
+
+# En varm analysator per process. Att ladda lexikonet tar mycket längre tid
+# än att räkna ut en poäng.
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer() -> SentimentIntensityAnalyzer:
+    """Processens delade VADER-analysator, skapad vid första anropet."""
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+def scorer_version() -> str:
+    """
+    Versionen av poängsättningen: NLTK-versionen och en hash av lexikonet.
+    Ändras någon av dem räknas alla sparade poäng som inaktuella.
+    """
+    lexicon = get_analyzer().lexicon_file
+    digest = hashlib.blake2b(lexicon.encode('utf-8'), digest_size=8).hexdigest()
+    return f"vader-nltk{nltk.__version__}-{digest}"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliserar texten innan den hashas.
+
+    VADER delar texten på blanksteg, så extra blanksteg påverkar inte
+    poängen och tas bort. Versaler och skiljetecken behålls eftersom de
+    förstärker poängen.
+    """
+    return ' '.join(text.split())
+
+
+def text_key(text: str) -> bytes:
+    """Cachenyckel: en 16 bytes BLAKE2b-hash av den normaliserade texten."""
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).digest()
+
+
+class VaderScorer:
+    """
+    NLTK:s VADER, en text i taget.
+
+    En poängsättare har ett `name`, en `version` som ändras när poängen
+    kan ändras (den används som nyckel i `ScoreStore`), `parallel` som
+    säger om stora batcher lönar sig att dela upp på en processpool, och
+    `score_batch(texts)` som returnerar en compound-poäng per text.
+    """
+
+    name = 'vader'
+    parallel = True
+
+    def __init__(self, analyzer: SentimentIntensityAnalyzer):
+        self.analyzer = analyzer
+        self.version = scorer_version()
+
+    def score_batch(self, texts: List[str]) -> List[float]:
+        return [self.analyzer.polarity_scores(text)['compound'] for text in texts]
+
+
+SCORERS = {VaderScorer.name: VaderScorer,
+           VectorizedVaderScorer.name: VectorizedVaderScorer}
+
+_scorers = {}
+_scorers_lock = threading.Lock()
+
+
+def get_scorer(name: str = SENTIMENT_SCORER):
+    """Processens poängsättare med namnet `name`, skapad vid första anropet."""
+    if name not in SCORERS:
+        raise ValueError(f"Okänd poängsättare: {name}. Välj bland {sorted(SCORERS)}")
+    if name not in _scorers:
+        analyzer = get_analyzer()
+        with _scorers_lock:
+            if name not in _scorers:
+                _scorers[name] = SCORERS[name](analyzer)
+    return _scorers[name]
+
+
+def _score_texts(texts: List[str], scorer: str = 'vader') -> List[float]:
+    """Poängsätter texter i en arbetsprocess med processens varma poängsättare."""
+    return get_scorer(scorer).score_batch(texts)
+
+
+class SentimentEngine:
+    """
+    Sentimentpoäng med en varm poängsättare, LRU-cache och processpool.
+
+    Samma text poängsätts bara en gång: poängen sparas under hashen av den
+    normaliserade texten, och de minst nyligen använda tas bort när cachen
+    är full. Bakom minnescachen kan en `ScoreStore` ligga, som sparar
+    poängen mellan körningar. Stora batcher med ocachade texter delas upp
+    på en processpool där varje process har en egen varm analysator.
+
+    Själva poängsättningen är utbytbar, se `VaderScorer` och `SCORERS`.
+
+    Args:
+        cache_size (int): Max antal poäng i cachen.
+        workers (int): Antal processer i poolen. 1 betyder ingen pool.
+        parallel_threshold (int): Minsta antal ocachade texter för poolen.
+        store (ScoreStore): Valfri beständig cache.
+        scorer: En poängsättare, som standard `get_scorer()`.
+    """
+
+    def __init__(self, cache_size: int = SENTIMENT_CACHE_SIZE,
+                 workers: int = SENTIMENT_WORKERS,
+                 parallel_threshold: int = SENTIMENT_PARALLEL_THRESHOLD,
+                 store: Optional[ScoreStore] = None, scorer=None):
+        self.scorer = scorer or get_scorer()
+        self.store = store
+        self.cache_size = cache_size
+        self.workers = max(workers, 1)
+        self.parallel_threshold = parallel_threshold
+        self._cache = OrderedDict()  # nyckel -> compound-poäng
+        self._lock = threading.Lock()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+        self.scored = 0
+        self.seconds = 0.0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Poolen skapas från en arbetstråd medan andra trådar läser
+                # via gRPC. En fork av en sådan process kan låsa sig, så
+                # processerna startas från en forkserver i stället. Varje
+                # process värmer upp analysatorn när den startar.
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=get_analyzer,
+                    mp_context=multiprocessing.get_context(SENTIMENT_POOL_START_METHOD))
+            return self._pool
+
+    def _lookup(self, key: bytes) -> Optional[float]:
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, scores: dict):
+        with self._lock:
+            self._cache.update(scores)
+            for key in scores:
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _compute(self, texts: List[str]) -> List[float]:
+        if (self.scorer.parallel and self.workers > 1
+                and len(texts) >= self.parallel_threshold):
+            chunk_size = -(-len(texts) // (self.workers * 4))
+            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            score_chunk = partial(_score_texts, scorer=self.scorer.name)
+            return [score for scores in self._get_pool().map(score_chunk, chunks)
+                    for score in scores]
+        return self.scorer.score_batch(texts)
+
+    def score_many(self, texts: Iterable[Optional[str]]) -> List[Optional[float]]:
+        """
+        Compound-poäng (-1 till 1) för varje text. None ger None.
+
+        Texter som redan finns i minnescachen eller den beständiga cachen,
+        eller förekommer flera gånger i batchen, räknas bara ut en gång.
+        """
+        started = time.perf_counter()
+        texts = list(texts)
+        keys = [text_key(text) if isinstance(text, str) else None for text in texts]
+
+        results = {}
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key is None or key in results or key in pending:
+                continue
+            score = self._lookup(key)
+            if score is None:
+                pending[key] = normalize_text(text)
+            else:
+                results[key] = score
+
+        if pending and self.store is not None:
+            try:
+                stored = self.store.get_many(pending)
+            except sqlite3.Error as e:
+                # Cachen är en optimering; poängen räknas ut i stället
+                print(f"Kunde inte läsa sentimentcachen: {e}")
+                stored = {}
+            self._store(stored)
+            results.update(stored)
+            pending = {key: text for key, text in pending.items() if key not in stored}
+
+        if pending:
+            computed = dict(zip(pending, self._compute(list(pending.values()))))
+            self._store(computed)
+            if self.store is not None:
+                try:
+                    self.store.put_many(computed)
+                except sqlite3.Error as e:
+                    print(f"Kunde inte spara i sentimentcachen: {e}")
+            results.update(computed)
+
+        with self._lock:
+            self.hits += len(texts) - keys.count(None) - len(pending)
+            self.misses += len(pending)
+            self.scored += len(texts)
+            self.seconds += time.perf_counter() - started
+        return [None if key is None else results[key] for key in keys]
+
+    def score(self, text: Optional[str]) -> Optional[float]:
+        """Compound-poäng för en text, se `score_many`."""
+        return self.score_many([text])[0]
+
+    def stats(self) -> dict:
+        store = self.store.stats() if self.store is not None else None
+        with self._lock:
+            return {"scorer": self.scorer.name,
+                    "texts": self.scored,
+                    "cache_hits": self.hits,
+                    "cache_misses": self.misses,
+                    "cache_entries": len(self._cache),
+                    "workers": self.workers,
+                    "seconds": round(self.seconds, 3),
+                    "texts_per_second": round(self.scored / self.seconds, 1)
+                    if self.seconds else 0.0,
+                    "store": store}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.store is not None:
+            self.store.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_sentiment_engine() -> SentimentEngine:
+    """
+    Processens delade motor, så att cachen och poolen återanvänds mellan anrop.
+
+    Poängen sparas också i SQLite-filen SENTIMENT_STORE_PATH, så att de
+    finns kvar efter en omstart. På Cloud Run ligger /tmp i minnet; peka
+    filen på en monterad volym för att dela den mellan instanser och
+    driftsättningar.
+
+    Poängsättaren väljs med SENTIMENT_SCORER. Poängen sparas under
+    poängsättarens version, så ett byte gör den sparade cachen inaktuell.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                scorer = get_scorer()
+                store = (ScoreStore(SENTIMENT_STORE_PATH, scorer.version)
+                         if SENTIMENT_STORE_PATH else None)
+                _engine = SentimentEngine(store=store, scorer=scorer)
+    return _engine
@@ -0,0 +1,145 @@
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+import pandas as pd
+import pyarrow as pa
+import pytest
+import clean_news as clean_news_module
+from clean_news import (FLATTEN_ARROW, FLATTEN_PANDAS, NEWS_WATERMARK_LAG,
+                        advance_transform_watermark, clean_news,
+                        get_transform_watermark, rebatch, update_is_processed,
+                        watermark_window)
+
+
+def article(**fields):
+    return {"source": {"id": None, "name": "Reuters"}, "author": "Jane Doe",
+            "title": "Apple beats estimates", "description": "Shares rise",
+            "url": "https://example.com/a", "urlToImage": "https://example.com/a.jpg",
+            "publishedAt": "2024-05-01T10:00:00Z", "content": "...", **fields}
+
+
+def raw_frame(payloads):
+    return pd.DataFrame({"unique_id": [str(i) for i in range(len(payloads))],
+                         "data": payloads,
+                         "company": [f"C{i}" for i in range(len(payloads))]})
+
+
+@pytest.mark.parametrize("payloads", [
+    [json.dumps({"status": "ok", "articles": [article(), article(author=None, title="T2")]}),
+     json.dumps({"articles": [article(publishedAt="not a date")]})],
+    # Svar utan artiklar ger en rad med bara company, som explode
+    [json.dumps({"articles": []}), None, json.dumps({"status": "error"}),
+     json.dumps({"articles": [article()]})],
+    [json.dumps({"articles": [article(description=None), article()]}, indent=2)],
+])
+def test_arrow_flattening_matches_pandas(payloads):
+    expected = clean_news(raw_frame(payloads), flatten=FLATTEN_PANDAS)
+
+    pd.testing.assert_frame_equal(clean_news(raw_frame(payloads), flatten=FLATTEN_ARROW),
+                                  expected)
+
+
+def test_rebatch_regroups_batches_in_order():
+    batches = [pa.RecordBatch.from_pydict({"n": list(range(start, stop))})
+               for start, stop in [(0, 3), (3, 7), (7, 8), (8, 13)]]
+
+    tables = list(rebatch(batches, batch_rows=4))
+
+    assert [table.num_rows for table in tables] == [4, 4, 4, 1]
+    assert [n for table in tables for n in table.column("n").to_pylist()] == list(range(13))
+    assert list(rebatch([], batch_rows=4)) == []
+
+
+@pytest.fixture
+def bq_client():
+    client = MagicMock()
+    client.query.return_value.result.return_value.num_dml_affected_rows = 3
+    with patch.object(clean_news_module, "get_bigquery_client", return_value=client):
+        yield client
+
+
+def test_update_is_processed_sends_ids_as_array_parameter(bq_client):
+    count = update_is_processed(["a", "b", "a", "c"], table="meta",
+                                project_id="p", dataset="d")
+
+    assert count == 3
+    query = bq_client.query.call_args.args[0]
+    assert "UPDATE `p.d.meta`" in query and "IN UNNEST(@ids)" in query
+    (parameter,) = bq_client.query.call_args.kwargs["job_config"].query_parameters
+    assert parameter.values == ["a", "b", "c"]
+    bq_client.create_table.assert_not_called()
+
+
+def test_update_is_processed_merges_from_staging_table(bq_client, monkeypatch):
+    monkeypatch.setattr(clean_news_module, "PROCESSED_IDS_PARAM_LIMIT", 2)
+
+    count = update_is_processed(["a", "b", "c"], table="meta",
+                                project_id="p", dataset="d")
+
+    assert count == 3
+    staging = bq_client.create_table.call_args.args[0]
+    assert staging.table_id.startswith("meta_staging_") and staging.expires is not None
+    rows, staging_id = bq_client.load_table_from_json.call_args.args
+    assert rows == [{"unique_id": "a"}, {"unique_id": "b"}, {"unique_id": "c"}]
+    query = bq_client.query.call_args.args[0]
+    assert "MERGE `p.d.meta`" in query and f"USING `{staging_id}`" in query
+    bq_client.delete_table.assert_called_once_with(staging_id, not_found_ok=True)
+
+
+def test_update_is_processed_drops_staging_table_on_failure(bq_client, monkeypatch):
+    monkeypatch.setattr(clean_news_module, "PROCESSED_IDS_PARAM_LIMIT", 2)
+    bq_client.query.side_effect = RuntimeError("MERGE failed")
+
+    with pytest.raises(RuntimeError):
+        update_is_processed(["a", "b", "c"], table="meta", project_id="p", dataset="d")
+
+    bq_client.delete_table.assert_called_once()
+
+
+def test_update_is_processed_without_ids(bq_client):
+    assert update_is_processed([], table="meta", project_id="p", dataset="d") == 0
+    bq_client.query.assert_not_called()
+
+
+NOW = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_watermark_window_starts_at_last_watermark_and_lags_now():
+    last = NOW - timedelta(hours=2)
+
+    assert watermark_window(last, NOW) == (last, NOW - NEWS_WATERMARK_LAG)
+    since, until = watermark_window(None, NOW)
+    assert since == datetime(1970, 1, 1, tzinfo=timezone.utc)
+    assert until == NOW - NEWS_WATERMARK_LAG
+
+
+def test_watermark_window_never_ends_before_it_starts():
+    # Vattenmärket ligger inom fördröjningen från nu: tomt fönster
+    last = NOW - NEWS_WATERMARK_LAG / 2
+
+    assert watermark_window(last, NOW) == (last, last)
+
+
+def test_get_transform_watermark_without_row():
+    client = MagicMock()
+    client.query.return_value.result.return_value = []
+
+    assert get_transform_watermark(client, "p.d.wm", "p.d.raw") is None
+    (parameter,) = client.query.call_args.kwargs["job_config"].query_parameters
+    assert parameter.value == "p.d.raw"
+
+
+def test_advance_transform_watermark_only_moves_forward():
+    client = MagicMock()
+    until = NOW - NEWS_WATERMARK_LAG
+
+    advance_transform_watermark(client, "p.d.wm", "p.d.raw", until)
+
+    query = client.query.call_args.args[0]
+    assert "MERGE `p.d.wm`" in query
+    # En äldre körning får inte skriva över ett nyare vattenmärke
+    assert "WHEN MATCHED AND S.last_fetch_date > T.last_fetch_date THEN" in query
+    parameters = {p.name: p.value
+                  for p in client.query.call_args.kwargs["job_config"].query_parameters}
+    assert parameters == {"source_table": "p.d.raw", "last_fetch_date": until}
+    client.query.return_value.result.assert_called_once()
@@ -0,0 +1,27 @@
+import pandas as pd
+from dedupe import ArticleDeduper, article_keys
+
+
+def articles(*rows):
+    return pd.DataFrame(rows, columns=["url", "title", "company", "description"])
+
+
+def test_duplicates_are_dropped_within_and_across_batches():
+    deduper = ArticleDeduper(article_keys([("u0", "Old", "AAPL")]))
+
+    first, stats = deduper.drop_duplicates(articles(
+        ("u1", "Apple beats", "AAPL", "a"),
+        ("u1", "Apple beats", "AAPL", "copy"),
+        # Samma nyhet för ett annat företag är en egen rad
+        ("u1", "Apple beats", "MSFT", "b"),
+        ("u0", "Old", "AAPL", "already written"),
+        (None, "No url", "AAPL", "c")))
+
+    assert first["description"].tolist() == ["a", "b", "c"]
+    assert stats == {"rows": 5, "duplicates_in_batch": 1, "duplicates_seen": 1}
+
+    second, _ = deduper.drop_duplicates(articles(("u1", "Apple beats", "MSFT", "again"),
+                                                 ("u2", "New", "TSLA", "d")))
+
+    assert second["description"].tolist() == ["d"]
+    assert deduper.stats()["duplicate_rate"] == round(3 / 7, 4)
@@ -0,0 +1,37 @@
+from score_cache import _MAX_PARAMS, ScoreStore
+
+
+def test_scores_survive_reopening(tmp_path):
+    path = str(tmp_path / "scores.sqlite")
+    store = ScoreStore(path, "v1")
+    store.put_many({b"a": 0.5, b"b": -0.25})
+    store.close()
+
+    store = ScoreStore(path, "v1")
+    assert store.get_many([b"a", b"b", b"c"]) == {b"a": 0.5, b"b": -0.25}
+    assert len(store) == 2
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 1, round(2 / 3, 4))
+    assert stats["invalidated"] == 0
+
+
+def test_scores_from_another_scorer_version_are_dropped(tmp_path):
+    path = str(tmp_path / "scores.sqlite")
+    store = ScoreStore(path, "v1")
+    store.put_many({b"a": 0.5, b"b": -0.25})
+    store.close()
+
+    store = ScoreStore(path, "v2")
+
+    assert store.invalidated == 2
+    assert store.get_many([b"a", b"b"]) == {}
+    assert len(store) == 0
+
+
+def test_lookups_larger_than_the_parameter_limit():
+    store = ScoreStore(":memory:", "v1")
+    scores = {i.to_bytes(4, "little"): i / 10000 for i in range(_MAX_PARAMS * 2 + 5)}
+    store.put_many(scores)
+
+    assert store.get_many(list(scores)) == scores
+    assert store.stats()["writes"] == len(scores)
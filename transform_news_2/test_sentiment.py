@@ -0,0 +1,90 @@
+import sqlite3
+from sentiment import SentimentEngine
+from score_cache import ScoreStore
+
+
+class StubScorer:
+    """Poängsätter med textens längd och minns vilka texter den fått."""
+
+    name = 'stub'
+    parallel = False
+    version = 'stub-1'
+
+    def __init__(self):
+        self.calls = []
+
+    def score_batch(self, texts):
+        self.calls.append(list(texts))
+        return [len(text) / 100 for text in texts]
+
+
+class BrokenStore:
+    def get_many(self, keys):
+        raise sqlite3.OperationalError("database is locked")
+
+    def put_many(self, scores):
+        raise sqlite3.OperationalError("database is locked")
+
+    def stats(self):
+        return {}
+
+
+def test_repeated_texts_are_scored_once_per_batch():
+    scorer = StubScorer()
+    engine = SentimentEngine(scorer=scorer, workers=1)
+
+    scores = engine.score_many(["good news", "good   news", None, "bad", "good news"])
+
+    # Extra blanksteg ger samma nyckel, None poängsätts inte
+    assert scorer.calls == [["good news", "bad"]]
+    assert scores == [0.09, 0.09, None, 0.03, 0.09]
+
+
+def test_hits_and_misses_are_counted():
+    scorer = StubScorer()
+    engine = SentimentEngine(scorer=scorer, workers=1)
+
+    engine.score_many(["a", "bb", "a"])
+    engine.score_many(["a", "bb", "ccc"])
+
+    stats = engine.stats()
+    assert (stats["texts"], stats["cache_hits"], stats["cache_misses"]) == (6, 3, 3)
+    assert stats["cache_entries"] == 3
+    assert scorer.calls == [["a", "bb"], ["ccc"]]
+
+
+def test_least_recently_used_score_is_evicted():
+    scorer = StubScorer()
+    engine = SentimentEngine(scorer=scorer, workers=1, cache_size=2)
+
+    engine.score_many(["a", "bb"])
+    engine.score("a")  # "a" blir senast använd
+    engine.score("ccc")  # cachen är full, "bb" tas bort
+    engine.score_many(["a", "bb"])
+
+    assert scorer.calls == [["a", "bb"], ["ccc"], ["bb"]]
+    assert engine.stats()["cache_entries"] == 2
+
+
+def test_scores_come_from_the_store_before_the_scorer():
+    store = ScoreStore(":memory:", StubScorer.version)
+    first = SentimentEngine(scorer=StubScorer(), workers=1, store=store)
+    first.score_many(["a", "bb"])
+
+    scorer = StubScorer()
+    second = SentimentEngine(scorer=scorer, workers=1, store=store)
+
+    assert second.score_many(["a", "bb", "ccc"]) == [0.01, 0.02, 0.03]
+    assert scorer.calls == [["ccc"]]
+    assert (second.stats()["cache_hits"], second.stats()["cache_misses"]) == (2, 1)
+
+
+def test_store_errors_fall_back_to_scoring():
+    scorer = StubScorer()
+    engine = SentimentEngine(scorer=scorer, workers=1, store=BrokenStore())
+
+    assert engine.score_many(["a", "bb"]) == [0.01, 0.02]
+    assert scorer.calls == [["a", "bb"]]
+    # Minnescachen fungerar även när den beständiga inte gör det
+    assert engine.score("a") == 0.01
+    assert len(scorer.calls) == 1
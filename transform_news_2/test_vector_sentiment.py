@@ -0,0 +1,57 @@
+import random
+import pytest
+from nltk.sentiment import SentimentIntensityAnalyzer
+from nltk.sentiment.vader import VaderConstants
+from vector_sentiment import VectorizedVaderScorer
+
+try:
+    analyzer = SentimentIntensityAnalyzer()
+except LookupError:
+    pytest.skip("vader_lexicon saknas, kör nltk.download('vader_lexicon')",
+                allow_module_level=True)
+
+# Texter som träffar VADER:s specialregler
+SPECIAL_CASES = [
+    "Apple beats estimates", "Tesla is not very good", "NOT GOOD at all for Amazon",
+    "VERY good quarter", "never so good", "It was never this bad", "at least good",
+    "least good", "good but bad!!!", "good, good; bad", "Yeah right, that is the bomb",
+    "kind of good", "he is kind of sort of nice", "bad ass results", "kiss of death for shares",
+    "hand to mouth is bad", "just enough good sort of", "what?? really???", "!good! ok",
+    "''good''", "it isn't good", "Good GOOD good", "not not not good", "the very least good",
+    "Great... but terrible", "great, but, TERRIBLE!!!!", "good :) ??", "", "   ", "a b c",
+]
+
+
+def random_headlines(count: int, seed: int = 0) -> list:
+    """Slumpade rubriker med lexikonord, förstärkningsord, versaler och skiljetecken."""
+    rng = random.Random(seed)
+    words = (sorted(analyzer.lexicon)[:2000] + list(VaderConstants.BOOSTER_DICT)
+             + list(VaderConstants.NEGATE)
+             + "but the of kind sort least at very never so this shares Apple".split() * 20)
+    headlines = []
+    for _ in range(count):
+        headline = []
+        for _ in range(rng.randint(1, 16)):
+            word = rng.choice(words)
+            if rng.random() < 0.1:
+                word = word.upper()
+            if rng.random() < 0.1:
+                word += rng.choice(["!", "?", ".", ",", "!!!", "?!", "...", "'"])
+            elif rng.random() < 0.05:
+                word = rng.choice(['"', "'", "(", "-"]) + word
+            headline.append(word)
+        headlines.append(" ".join(headline))
+    return headlines
+
+
+def test_scores_match_nltk():
+    texts = SPECIAL_CASES + random_headlines(5000)
+    expected = [analyzer.polarity_scores(text)['compound'] for text in texts]
+
+    assert VectorizedVaderScorer(analyzer).score_batch(texts) == expected
+
+
+def test_missing_texts_get_no_score():
+    scores = VectorizedVaderScorer(analyzer).score_batch([None, "good", float("nan")])
+
+    assert scores == [None, analyzer.polarity_scores("good")['compound'], None]
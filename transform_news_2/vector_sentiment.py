@@ -0,0 +1,284 @@
+import hashlib
+import string
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from nltk.sentiment.vader import VaderConstants
+
+C = VaderConstants
+
+_PUNCTUATION = set(string.punctuation)
+_PUNC_SET = frozenset(C.PUNC_LIST)
+_PUNC_LENGTHS = sorted({len(punc) for punc in C.PUNC_LIST})
+
+# Ord som ingår i idiom eller i booster-uttryck med flera ord. De får egna
+# små id:n så att n-gram kan slås upp i tabeller.
+_NGRAM_KEYS = [key for key in list(C.SPECIAL_CASE_IDIOMS) + list(C.BOOSTER_DICT)
+               if ' ' in key]
+_NGRAM_WORDS = sorted({word for key in _NGRAM_KEYS for word in key.split()})
+_NGRAM_BASE = len(_NGRAM_WORDS) + 1
+
+
+def _strip_punctuation(token: str) -> str:
+    """
+    VADER:s borttagning av skiljetecken före eller efter ett ord.
+
+    Ett token skrivs om bara när det är exakt en följd ur PUNC_LIST
+    framför eller bakom ett ord på minst två tecken utan skiljetecken.
+    """
+    if token[0] not in _PUNCTUATION and token[-1] not in _PUNCTUATION:
+        return token
+    for size in _PUNC_LENGTHS:
+        if token[:size] in _PUNC_SET:
+            word = token[size:]
+        elif token[-size:] in _PUNC_SET:
+            word = token[:-size]
+        else:
+            continue
+        if len(word) > 1 and _PUNCTUATION.isdisjoint(word):
+            return word
+    return token
+
+
+def _ngram_table(size: int) -> np.ndarray:
+    """Värde per n-gram-kod för idiom med `size` ord, NaN för övriga."""
+    table = np.full(_NGRAM_BASE ** size, np.nan)
+    for key, value in C.SPECIAL_CASE_IDIOMS.items():
+        words = key.split()
+        if len(words) == size:
+            code = 0
+            for word in words:
+                code = code * _NGRAM_BASE + _NGRAM_WORDS.index(word) + 1
+            table[code] = value
+    return table
+
+
+def _booster_bigram_table() -> np.ndarray:
+    table = np.zeros(_NGRAM_BASE ** 2, dtype=bool)
+    for key in C.BOOSTER_DICT:
+        words = key.split()
+        if len(words) == 2:
+            table[(_NGRAM_WORDS.index(words[0]) + 1) * _NGRAM_BASE
+                  + _NGRAM_WORDS.index(words[1]) + 1] = True
+    return table
+
+
+class VectorizedVaderScorer:
+    """
+    VADER:s compound-poäng för en hel kolumn på en gång.
+
+    Texterna delas upp i token i ett svep och varje unikt token slås upp i
+    lexikonet en gång. Därefter är allt arrayer: reglerna för förstärkande
+    ord, negation, versaler, "but", idiom och utropstecken räknas ut med
+    NumPy över alla token samtidigt, i samma ordning som NLTK:s
+    `polarity_scores` så att poängen blir desamma.
+
+    Args:
+        analyzer: En NLTK `SentimentIntensityAnalyzer`, för lexikonet.
+    """
+
+    name = 'vectorized'
+    # Hela batchen är redan arrayer; en processpool skulle bara kopiera data
+    parallel = False
+
+    def __init__(self, analyzer):
+        self.lexicon = analyzer.lexicon
+        digest = hashlib.blake2b(analyzer.lexicon_file.encode('utf-8'),
+                                 digest_size=8).hexdigest()
+        self.version = f"vader-vectorized1-{digest}"
+        self._idioms2 = _ngram_table(2)
+        self._idioms3 = _ngram_table(3)
+        self._booster2 = _booster_bigram_table()
+
+    def _vocabulary(self, tokens: pd.Index) -> dict:
+        """Egenskaper per unikt token (efter borttagna skiljetecken)."""
+        lower = [token.lower() for token in tokens]
+        in_lexicon = np.array([word in self.lexicon for word in lower])
+        return {
+            "in_lexicon": in_lexicon,
+            "valence": np.array([self.lexicon.get(word, 0.0) for word in lower]),
+            "upper": np.array([token.isupper() for token in tokens]),
+            "is_booster": np.array([word in C.BOOSTER_DICT for word in lower]),
+            "booster": np.array([C.BOOSTER_DICT.get(word, 0.0) for word in lower]),
+            "negated": np.array([word in C.NEGATE or "n't" in word for word in lower]),
+            "never": np.array([token == "never" for token in tokens]),
+            "so_this": np.array([token in ("so", "this") for token in tokens]),
+            "kind": np.array([word == "kind" for word in lower]),
+            "of": np.array([word == "of" for word in lower]),
+            "but": np.array([word == "but" for word in lower]),
+            "least": np.array([word == "least" for word in lower]),
+            "at_very": np.array([word in ("at", "very") for word in lower]),
+            "ngram": np.array([_NGRAM_WORDS.index(token) + 1 if token in _NGRAM_WORDS else 0
+                               for token in tokens]),
+        }
+
+    def score_batch(self, texts: List[Optional[str]]) -> List[Optional[float]]:
+        """Compound-poäng avrundade som NLTK (4 decimaler). None ger None."""
+        texts = list(texts)
+        valid = [isinstance(text, str) for text in texts]
+        split = [[token for token in text.split() if len(token) > 1] if ok else []
+                 for text, ok in zip(texts, valid)]
+        lengths = np.fromiter((len(tokens) for tokens in split), dtype=np.int64,
+                              count=len(split))
+        n = int(lengths.sum())
+        if n == 0:
+            return [0.0 if ok else None for ok in valid]
+
+        # Token -> id i två steg: unika råa token, sedan deras rensade form
+        raw_codes, raw_uniques = pd.factorize(
+            np.fromiter((token for tokens in split for token in tokens),
+                        dtype=object, count=n))
+        mapped_codes, mapped_uniques = pd.factorize(
+            np.array([_strip_punctuation(token) for token in raw_uniques], dtype=object))
+        codes = mapped_codes[raw_codes]
+        vocabulary = self._vocabulary(pd.Index(mapped_uniques))
+
+        def prop(name):
+            return vocabulary[name][codes]
+
+        text_id = np.repeat(np.arange(len(texts)), lengths)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        local = np.arange(n) - starts[text_id]          # position i texten
+        remaining = lengths[text_id] - local - 1         # token kvar efter
+
+        def shift(values, k, fill=False):
+            """values[i - k] (k > 0) eller values[i + |k|], fill utanför texten."""
+            out = np.full(n, fill, dtype=values.dtype)
+            if k > 0:
+                out[k:] = values[:-k]
+                out[local < k] = fill
+            else:
+                out[:k] = values[-k:]
+                out[remaining < -k] = fill
+            return out
+
+        in_lexicon = prop("in_lexicon")
+        upper = prop("upper")
+        booster = prop("booster")
+        is_booster = prop("is_booster")
+        negated = prop("negated")
+        so_this = prop("so_this")
+        never = prop("never")
+        ngram = prop("ngram")
+
+        # Versaler förstärker bara om några men inte alla ord är versaler
+        caps = np.bincount(text_id, weights=upper, minlength=len(texts))
+        cap_diff = ((lengths - caps > 0) & (lengths - caps < lengths))[text_id]
+
+        # Token som får poäng: i lexikonet, inte förstärkningsord, inte "kind of"
+        kind_of = prop("kind") & shift(prop("of"), -1)
+        candidate = in_lexicon & ~is_booster & ~kind_of
+        v = np.where(candidate, prop("valence"), 0.0)
+        emphasis = candidate & upper & cap_diff
+        v = np.where(emphasis, np.where(v > 0, v + C.C_INCR, v - C.C_INCR), v)
+
+        for k in (1, 2, 3):
+            active = candidate & (local >= k) & ~shift(in_lexicon, k, True)
+
+            # Förstärkande eller dämpande ord k steg bakåt
+            prev_booster = shift(is_booster, k)
+            scalar = np.where(prev_booster, shift(booster, k, 0.0), 0.0)
+            scalar = np.where(v < 0, -scalar, scalar)
+            caps_boost = prev_booster & shift(upper, k) & cap_diff
+            scalar = np.where(caps_boost, np.where(v > 0, scalar + C.C_INCR,
+                                                   scalar - C.C_INCR), scalar)
+            if k == 2:
+                scalar = scalar * 0.95
+            elif k == 3:
+                scalar = scalar * 0.9
+            v = np.where(active, v + scalar, v)
+
+            # Negation och "never so/this"
+            if k == 1:
+                factor = np.where(shift(negated, 1), C.N_SCALAR, 1.0)
+            elif k == 2:
+                never_so = shift(never, 2) & shift(so_this, 1)
+                factor = np.where(never_so, 1.5,
+                                  np.where(shift(negated, 2), C.N_SCALAR, 1.0))
+            else:
+                never_so = (shift(never, 3) & shift(so_this, 2)) | shift(so_this, 1)
+                factor = np.where(never_so, 1.25,
+                                  np.where(shift(negated, 3), C.N_SCALAR, 1.0))
+            v = np.where(active & (factor != 1.0), v * factor, v)
+
+            if k == 3:
+                v = self._idioms(v, active, ngram, shift)
+
+        # "least" före ordet vänder poängen, utom i "at least" och "very least"
+        least1 = shift(prop("least"), 1) & ~shift(in_lexicon, 1, True)
+        least_flip = least1 & np.where(local > 1, ~shift(prop("at_very"), 2), local == 1)
+        v = np.where(candidate & least_flip, v * C.N_SCALAR, v)
+
+        # NLTK använder första förekomsten av ett token för sammanhanget
+        _, first, inverse = np.unique(text_id * len(mapped_uniques) + codes,
+                                      return_index=True, return_inverse=True)
+        sentiments = v[first[inverse.ravel()]]
+
+        # "but": hälften före, en och en halv gång efter första "but"
+        is_but = prop("but")
+        but_pos = np.full(len(texts), -1)
+        but_rows = np.flatnonzero(is_but)
+        but_pos[text_id[but_rows[::-1]]] = local[but_rows[::-1]]
+        text_but = but_pos[text_id]
+        sentiments = np.where(text_but < 0, sentiments,
+                              np.where(local < text_but, sentiments * 0.5,
+                                       np.where(local > text_but, sentiments * 1.5,
+                                                sentiments)))
+
+        total = _sequential_sums(sentiments, text_id, local, len(texts))
+
+        exclamations = np.minimum([text.count('!') if ok else 0
+                                   for text, ok in zip(texts, valid)], 4) * 0.292
+        questions = np.array([text.count('?') if ok else 0
+                              for text, ok in zip(texts, valid)])
+        amplifier = exclamations + np.where(questions > 3, 0.96,
+                                            np.where(questions > 1, questions * 0.18, 0.0))
+        total = np.where(total > 0, total + amplifier,
+                         np.where(total < 0, total - amplifier, total))
+        compound = total / np.sqrt(total * total + 15)
+
+        return [round(float(score), 4) if ok else None
+                for score, ok in zip(compound, valid)]
+
+    def _idioms(self, v, active, ngram, shift):
+        """VADER:s idiomkontroll, som körs för ord med tre ord före sig."""
+        base = _NGRAM_BASE
+        w = {k: shift(ngram, k, 0) for k in (3, 2, 1, -1, -2)}
+        w[0] = ngram
+
+        def pair(a, b):
+            return self._idioms2[w[a] * base + w[b]]
+
+        def triple(a, b, c):
+            return self._idioms3[(w[a] * base + w[b]) * base + w[c]]
+
+        # Den första träffen i NLTK:s ordning vinner
+        idiom = np.full(len(v), np.nan)
+        for value in (pair(1, 0), triple(2, 1, 0), pair(2, 1), triple(3, 2, 1), pair(3, 2)):
+            idiom = np.where(np.isnan(idiom), value, idiom)
+        # Idiom efter ordet skriver över
+        idiom = np.where(np.isnan(pair(0, -1)), idiom, pair(0, -1))
+        idiom = np.where(np.isnan(triple(0, -1, -2)), idiom, triple(0, -1, -2))
+        v = np.where(active & ~np.isnan(idiom), idiom, v)
+
+        booster_bigram = (self._booster2[w[3] * base + w[2]]
+                          | self._booster2[w[2] * base + w[1]])
+        return np.where(active & booster_bigram, v + C.B_DECR, v)
+
+
+def _sequential_sums(values, text_id, local, count) -> np.ndarray:
+    """
+    Summan per text, adderad i ordning som Pythons sum(), så att avrundningen
+    blir densamma som i NLTK. Bara token med poäng behöver adderas.
+    """
+    nonzero = np.flatnonzero(values)
+    totals = np.zeros(count)
+    if len(nonzero) == 0:
+        return totals
+    ids = text_id[nonzero]
+    # Ordningsnummer bland texternas token med poäng
+    rank = np.arange(len(nonzero)) - np.searchsorted(ids, ids)
+    for r in range(int(rank.max()) + 1):
+        rows = nonzero[rank == r]
+        totals[text_id[rows]] += values[rows]
+    return totals
@@ -0,0 +1,79 @@
+"""
+Compares the 'sql' and 'python' transforms of clean_stocks on real data.
+
+Each transform cleans the full history of the chosen symbols into its own
+scratch table next to the cleaned table, so production data is never
+touched. The script prints wall time and MERGE statistics per run, then
+checks that both transforms produced the same rows. Scratch tables are
+deleted afterwards.
+
+    python benchmark_transform.py --symbols AAPL MSFT --repeat 3
+"""
+import argparse
+import json
+import time
+from clean_stocks import (TRANSFORM_PYTHON, TRANSFORM_SQL, clean_since,
+                          create_staging_table, is_compact_raw_table)
+from shared.gcp import get_bigquery_client, get_secret
+from shared.symbols import load_symbol_universe
+
+
+def run_once(client, raw_data_table_id: str, cleaned_data_table_id: str,
+             symbols: list, transform: str) -> dict:
+    """Cleans `symbols` into a new scratch table and times it."""
+    scratch_table_id = create_staging_table(client, f"{cleaned_data_table_id}_bench")
+    started = time.perf_counter()
+    result = clean_since(client, raw_data_table_id, scratch_table_id, {}, symbols,
+                         transform=transform)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    result["table"] = scratch_table_id
+    return result
+
+
+def count_differences(client, table_a: str, table_b: str) -> int:
+    """Rows found in only one of the two tables."""
+    query = f"""
+        SELECT COUNT(*) AS differences FROM (
+            (SELECT * FROM `{table_a}` EXCEPT DISTINCT SELECT * FROM `{table_b}`)
+            UNION ALL
+            (SELECT * FROM `{table_b}` EXCEPT DISTINCT SELECT * FROM `{table_a}`)
+        )
+    """
+    return next(iter(client.query(query).result())).differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--raw-table", help="Default: secret RAW_DATA_TABLE_ID")
+    parser.add_argument("--cleaned-table", help="Scratch tables are created next to it. "
+                                                "Default: secret CLEANED_DATA_TABLE_ID")
+    parser.add_argument("--symbols", nargs="+", default=load_symbol_universe())
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    client = get_bigquery_client()
+    raw_data_table_id = args.raw_table or get_secret("RAW_DATA_TABLE_ID")
+    cleaned_data_table_id = args.cleaned_table or get_secret("CLEANED_DATA_TABLE_ID")
+    if is_compact_raw_table(client, raw_data_table_id):
+        parser.error(f"{raw_data_table_id} stores compressed payloads; only 'python' can read it")
+
+    scratch_tables = []
+    try:
+        last = {}
+        for _ in range(args.repeat):
+            for transform in (TRANSFORM_SQL, TRANSFORM_PYTHON):
+                result = run_once(client, raw_data_table_id, cleaned_data_table_id,
+                                  args.symbols, transform)
+                scratch_tables.append(result["table"])
+                last[transform] = result["table"]
+                print(json.dumps(result, default=str))
+
+        differences = count_differences(client, last[TRANSFORM_SQL], last[TRANSFORM_PYTHON])
+        print(f"Rows that differ between the transforms: {differences}")
+    finally:
+        for table_id in scratch_tables:
+            client.delete_table(table_id, not_found_ok=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,59 @@
-import os
-import json
+import io
+import uuid
+from operator import itemgetter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Optional
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from fastapi import FastAPI, HTTPException
 from google.cloud import bigquery
-from google.cloud import secretmanager
 import uvicorn
 import logging
-from google.auth import default
+from shared.gcp import cache_stats, get_bigquery_client, get_secret
+from shared.payload_codec import decode_payload
+from shared.shard_leases import lease_table_id, run_sharded
+from shared.symbols import load_symbol_universe
 
 app = FastAPI()
 
-def get_project_id():
-    """Retrieve project ID from environment."""
-    #GOOGLE_CLOUD_PROJECT: This specific environment variable is used to store the Google Cloud project ID. 
-    #It allows the application to know which Google Cloud project it should interact with.
-    project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
+_compact_tables = {}
 
-    if project_id is None:
-        # If not set, use google.auth.default to fetch the project ID
-        credentials, project_id = default()
-    
-    return project_id
+# Values for the `transform` option
+TRANSFORM_AUTO = "auto"      # SQL when the raw table is plain JSON, else Python
+TRANSFORM_SQL = "sql"
+TRANSFORM_PYTHON = "python"
+TRANSFORMS = (TRANSFORM_AUTO, TRANSFORM_SQL, TRANSFORM_PYTHON)
 
 
-def get_secret(secret_name='bigquery-accout-secret') -> str:
-    """Fetches a secret from Google Cloud Secret Manager.
-
-    Args:
-        secret_name (str): The name of the secret in Secret Manager.
-
-    Returns:
-        str: The secret data as a string.
+def is_compact_raw_table(client, table_id: str) -> bool:
     """
-    # Instansiera en klient för Secret Manager
-    client = secretmanager.SecretManagerServiceClient()
-
-    # Bygg sökvägen till den hemlighet du vill hämta
-    project_id = get_project_id()  # Ersätt med ditt projekt-ID
-    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+    Returns True if the raw table stores compressed payloads (raw_data_z).
+    The schema is looked up once per table and process.
+    """
+    if table_id not in _compact_tables:
+        schema = client.get_table(table_id).schema
+        _compact_tables[table_id] = any(field.name == "raw_data_z" for field in schema)
+    return _compact_tables[table_id]
 
-    # Hämta den senaste versionen av hemligheten
-    response = client.access_secret_version(name=secret_path)
 
-    # Dekoda hemligheten till en sträng
-    secret_data = response.payload.data.decode('UTF-8')
+def raw_payload_columns(client, table_id: str) -> str:
+    """SELECT list for the payload, for both plain and compact raw tables."""
+    if is_compact_raw_table(client, table_id):
+        return "raw_data_z AS raw_data, encoding"
+    return "raw_data, 'json' AS encoding"
 
-    return secret_data
 
+def decode_raw_rows(results):
+    """
+    Yields rows with `stock_symbol` and a decoded `raw_data` dict, whatever
+    encoding the raw table uses.
+    """
+    for row in results:
+        yield SimpleNamespace(stock_symbol=row.stock_symbol,
+                              raw_data=decode_payload(row.raw_data, row.encoding))
 
-# List of 5 specific stocks to focus on
-STOCK_SYMBOLS = ["TSLA", "MSFT", "AMZN", "GOOGL", "AAPL"]
 
 def get_latest_date_in_bigquery(client, table_id: str, stock_symbol: str):
     """
@@ -72,158 +77,657 @@ def get_latest_date_in_bigquery(client, table_id: str, stock_symbol: str):
         return row.latest_date
     return None
 
-def clean_and_insert_latest_data(client, results, cleaned_data_table_id: str):
+def fetch_and_insert_historical_data(client, raw_data_table_id: str, cleaned_data_table_id: str,
+                                     stock_symbol: str, transform: str = TRANSFORM_AUTO):
+    """
+    Upserts every stored date for a specific stock symbol into BigQuery,
+    whatever is already cleaned.
+    """
+    logging.info(f"Fetching historical data for {stock_symbol}")
+    clean_since(client, raw_data_table_id, cleaned_data_table_id, {}, [stock_symbol],
+                transform=transform)
+
+def fetch_and_insert_latest_data(client, raw_data_table_id: str, cleaned_data_table_id: str, stock_symbol: str):
+    """
+    Catches one stock symbol up: every date after its latest cleaned date is
+    upserted, not only the newest one, so missed days are filled in.
     """
-    Cleans the latest day's stock data from BigQuery and inserts it into the cleaned_data_table in BigQuery.
+    logging.info(f"Fetching latest data for {stock_symbol}")
+    clean_all_stocks(client, raw_data_table_id, cleaned_data_table_id, [stock_symbol])
+
+def get_latest_dates_in_bigquery(client, table_id: str, stock_symbols: list) -> dict:
+    """
+    Returns the latest cleaned date per stock_symbol, for all symbols in one query.
+    Symbols without data are left out.
+    """
+    query = f"""
+        SELECT stock_symbol, MAX(date) AS latest_date
+        FROM `{table_id}`
+        WHERE stock_symbol IN UNNEST(@stock_symbols)
+        GROUP BY stock_symbol
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("stock_symbols", "STRING", list(stock_symbols))
+        ]
+    )
+    return {row.stock_symbol: row.latest_date
+            for row in client.query(query, job_config=job_config).result()}
+
+
+def fetch_raw_rows_since(client, raw_data_table_id: str, latest_dates: dict,
+                         stock_symbols: list):
+    """
+    Reads the raw snapshots that can hold bars newer than each symbol's
+    watermark, for all symbols in one query.
+
+    A bar is always fetched on or after its own date, so snapshots fetched
+    before the watermark day are skipped. Symbols without a watermark get
+    every snapshot. Rows come grouped per symbol, newest snapshot first,
+    and are streamed page by page.
+    """
+    query = f"""
+        SELECT r.stock_symbol, {raw_payload_columns(client, raw_data_table_id)}
+        FROM `{raw_data_table_id}` r
+        LEFT JOIN UNNEST(@watermarks) w ON r.stock_symbol = w.stock_symbol
+        WHERE r.stock_symbol IN UNNEST(@stock_symbols)
+          AND (w.latest_date IS NULL OR DATE(r.fetch_date) >= w.latest_date)
+        ORDER BY r.stock_symbol, r.fetch_date DESC
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            watermark_query_parameter(latest_dates),
+            bigquery.ArrayQueryParameter("stock_symbols", "STRING", list(stock_symbols)),
+        ]
+    )
+    return decode_raw_rows(client.query(query, job_config=job_config).result(page_size=500))
+
+
+# Bars per load job. Bounds memory no matter how much history is cleaned.
+LOAD_CHUNK_ROWS = 500_000
+
+OHLCV_KEYS = ["1. open", "2. high", "3. low", "4. close", "5. volume"]
+
+CLEAN_STOCK_ARROW_SCHEMA = pa.schema([
+    ("stock_symbol", pa.string()),
+    ("date", pa.date32()),
+    ("open", pa.float64()),
+    ("high", pa.float64()),
+    ("low", pa.float64()),
+    ("close", pa.float64()),
+    ("volume", pa.int64()),
+])
+
+
+def parse_time_series(time_series: dict, since: str = "", seen: Optional[np.ndarray] = None):
+    """
+    Parses one "Time Series (Daily)" payload into typed NumPy columns.
+
+    Each OHLCV field is read column by column straight into a NumPy array
+    with `np.fromiter`, so no row is built per bar and the per-value
+    conversion runs in C through `map`.
 
     Args:
-        client: BigQuery client instance.
-        results: The query results from the raw data table.
-        cleaned_data_table_id: The BigQuery table ID where the cleaned data will be inserted.
+        time_series (dict): Date -> OHLCV strings, as Alpha Vantage sends it.
+        since (str): Only keep dates after this one ('YYYY-MM-DD').
+        seen (np.ndarray): Dates already taken from a newer snapshot.
+
+    Returns:
+        tuple: (dates as datetime64[D], float64 array of shape (n, 4) with
+        open/high/low/close, int64 volumes).
+    """
+    dates = np.array(list(time_series.keys()), dtype="U10")
+    mask = dates > since if since else np.ones(len(dates), dtype=bool)
+    if seen is not None and len(seen):
+        mask &= ~np.isin(dates, seen)
+
+    bars = np.fromiter(time_series.values(), dtype=object, count=len(dates))[mask]
+    count = len(bars)
+
+    prices = np.empty((count, 4), dtype=np.float64)
+    for column, key in enumerate(OHLCV_KEYS[:4]):
+        prices[:, column] = np.fromiter(map(float, map(itemgetter(key), bars)),
+                                        dtype=np.float64, count=count)
+    volumes = np.fromiter(map(int, map(itemgetter(OHLCV_KEYS[4]), bars)),
+                          dtype=np.int64, count=count)
+    return dates[mask].astype("datetime64[D]"), prices, volumes
+
+
+def iter_clean_chunks(results, latest_dates: dict, chunk_rows: int = LOAD_CHUNK_ROWS):
     """
-    rows_to_insert = []
-    
+    Turns raw snapshots into Arrow tables of at most about `chunk_rows` bars.
+
+    `results` must be ordered by stock_symbol and then newest snapshot
+    first. A bar that appears in several snapshots is then taken from the
+    newest one, and only the dates seen for the current symbol are kept in
+    memory.
+
+    Yields:
+        pyarrow.Table: Rows with the clean_stock_data columns.
+    """
+    watermarks = {symbol: latest_date.isoformat()
+                  for symbol, latest_date in latest_dates.items()
+                  if latest_date is not None}
+
+    parts = []
+    buffered = 0
+    symbol = None
+    seen = np.array([], dtype="U10")
+
     for row in results:
-        stock_symbol = row.stock_symbol
-        raw_data_str = row.raw_data  # raw_data is expected to be in JSON format
-        
-        # Parse the JSON-like structure of raw_data_str
-        time_series = raw_data_str.get("Time Series (Daily)", {})
-        
-        if time_series:
-            latest_date = max(time_series.keys())
-            latest_data = time_series[latest_date]
-            
-            cleaned_row = {
-                "stock_symbol": stock_symbol,
-                "date": latest_date,
-                "open": float(latest_data["1. open"]),
-                "high": float(latest_data["2. high"]),
-                "low": float(latest_data["3. low"]),
-                "close": float(latest_data["4. close"]),
-                "volume": int(latest_data["5. volume"]),
-            }
-            rows_to_insert.append(cleaned_row)
-    
-    # Insert cleaned rows into BigQuery
-    errors = client.insert_rows_json(cleaned_data_table_id, rows_to_insert)
-    
-    if errors:
-        logging.error(f"Encountered errors while inserting rows: {errors}")
-        raise HTTPException(status_code=500, detail=f"Error inserting rows: {errors}")
-    
-    logging.info("Cleaned data successfully inserted.")
-    return {"status": "success", "message": "Latest data successfully inserted."}
-
-def clean_and_insert_data(client, results, cleaned_data_table_id: str):
-    """
-    Cleans the raw stock data from BigQuery and inserts it into the cleaned_data_table in BigQuery.
+        if row.stock_symbol != symbol:
+            symbol = row.stock_symbol
+            seen = np.array([], dtype="U10")
+
+        time_series = row.raw_data.get("Time Series (Daily)", {})
+        if not time_series:
+            continue
+        dates, prices, volumes = parse_time_series(time_series,
+                                                   watermarks.get(symbol, ""), seen)
+        if len(dates) == 0:
+            continue
+        seen = np.concatenate([seen, dates.astype("U10")])
+
+        parts.append(pa.table({
+            "stock_symbol": pa.array(np.full(len(dates), symbol, dtype=object), pa.string()),
+            "date": pa.array(dates, pa.date32()),
+            "open": prices[:, 0],
+            "high": prices[:, 1],
+            "low": prices[:, 2],
+            "close": prices[:, 3],
+            "volume": volumes,
+        }, schema=CLEAN_STOCK_ARROW_SCHEMA))
+        buffered += len(dates)
+
+        if buffered >= chunk_rows:
+            yield pa.concat_tables(parts)
+            parts, buffered = [], 0
+
+    if parts:
+        yield pa.concat_tables(parts)
+
+
+def load_arrow_table(client, table_id: str, table: pa.Table):
+    """Appends an Arrow table to BigQuery with a Parquet load job."""
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    buffer.seek(0)
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    client.load_table_from_file(buffer, table_id, job_config=job_config).result()
+
+
+CLEAN_STOCK_SCHEMA = [
+    bigquery.SchemaField("stock_symbol", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("date", "DATE", mode="NULLABLE"),
+    bigquery.SchemaField("open", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("high", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("low", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("close", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("volume", "INTEGER", mode="NULLABLE"),
+]
+
+# Staging tables are dropped after the MERGE; the expiry only matters if
+# the service dies in between.
+STAGING_TABLE_EXPIRY = timedelta(hours=6)
+
+
+def create_staging_table(client, cleaned_data_table_id: str) -> str:
+    """
+    Creates an empty, short-lived table next to `cleaned_data_table_id`
+    for one run. Each run gets its own table, so runs never see each
+    other's rows.
+
+    Returns:
+        str: The staging table ID.
+    """
+    table_id = f"{cleaned_data_table_id}_staging_{uuid.uuid4().hex[:12]}"
+    table = bigquery.Table(table_id, schema=CLEAN_STOCK_SCHEMA)
+    table.expires = datetime.now(timezone.utc) + STAGING_TABLE_EXPIRY
+    client.create_table(table)
+    return table_id
+
+
+MERGE_CLEAN_ROWS_QUERY = """
+    MERGE `{cleaned_data_table_id}` T
+    USING ({source}) S
+    ON T.stock_symbol = S.stock_symbol AND T.date = S.date
+    WHEN MATCHED AND (T.open IS DISTINCT FROM S.open
+                      OR T.high IS DISTINCT FROM S.high
+                      OR T.low IS DISTINCT FROM S.low
+                      OR T.close IS DISTINCT FROM S.close
+                      OR T.volume IS DISTINCT FROM S.volume) THEN
+        UPDATE SET open = S.open, high = S.high, low = S.low,
+                   close = S.close, volume = S.volume
+    WHEN NOT MATCHED THEN
+        INSERT (stock_symbol, date, open, high, low, close, volume)
+        VALUES (S.stock_symbol, S.date, S.open, S.high, S.low, S.close, S.volume)
+"""
+
+
+def merge_clean_rows(client, source: str, cleaned_data_table_id: str,
+                     job_config: Optional[bigquery.QueryJobConfig] = None) -> dict:
+    """
+    Upserts the rows of the `source` query into the cleaned table on
+    (stock_symbol, date). `source` must give at most one row per key.
+
+    Running it again with the same rows changes nothing, so overlapping
+    or repeated runs cannot create duplicates.
+
+    Returns:
+        dict: Counts of inserted and updated rows, and the bytes the job
+        processed.
+    """
+    query = MERGE_CLEAN_ROWS_QUERY.format(cleaned_data_table_id=cleaned_data_table_id,
+                                          source=source)
+    job = client.query(query, job_config=job_config)
+    job.result()
+    result = {"inserted": None, "updated": None,
+              "affected": job.num_dml_affected_rows or 0,
+              "bytes_processed": getattr(job, "total_bytes_processed", None)}
+    dml_stats = getattr(job, "dml_stats", None)
+    if dml_stats is not None:
+        result.update(inserted=dml_stats.inserted_row_count,
+                      updated=dml_stats.updated_row_count)
+    return result
+
+
+def merge_staged_rows(client, staging_table_id: str, cleaned_data_table_id: str) -> dict:
+    """Upserts a staging table from `upsert_clean_chunks`, see `merge_clean_rows`."""
+    source = f"""
+        SELECT * FROM `{staging_table_id}`
+        WHERE TRUE
+        -- Skyddar mot att samma dag laddats två gånger; MERGE kräver unika källrader.
+        -- Skiljer raderna sig behålls den med högst volym, som i dedupe_clean_stock_data.sql
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY stock_symbol, date ORDER BY volume DESC) = 1
+    """
+    return merge_clean_rows(client, source, cleaned_data_table_id)
+
+
+def watermark_query_parameter(latest_dates: dict) -> bigquery.ArrayQueryParameter:
+    """The per-symbol watermarks as an ARRAY<STRUCT> parameter named `watermarks`."""
+    watermarks = [bigquery.StructQueryParameter(
+        None,
+        bigquery.ScalarQueryParameter("stock_symbol", "STRING", symbol),
+        bigquery.ScalarQueryParameter("latest_date", "DATE", latest_date))
+        for symbol, latest_date in latest_dates.items()]
+    # Typen anges explicit eftersom listan kan vara tom
+    watermark_type = bigquery.StructQueryParameterType(
+        bigquery.ScalarQueryParameterType("STRING", name="stock_symbol"),
+        bigquery.ScalarQueryParameterType("DATE", name="latest_date"))
+    return bigquery.ArrayQueryParameter("watermarks", watermark_type, watermarks)
+
+
+def transform_in_sql(client, raw_data_table_id: str, cleaned_data_table_id: str,
+                     latest_dates: dict, stock_symbols: list) -> dict:
+    """
+    Cleans the raw snapshots inside BigQuery, so no raw bytes leave the
+    warehouse.
+
+    "Time Series (Daily)" is unnested with JSON_KEYS and each bar read with
+    JSON functions. Dates after each symbol's watermark are kept, the
+    newest snapshot wins for a date, and the result is upserted with the
+    same MERGE as the Python path. Only works on the plain raw table,
+    since compact payloads are compressed.
+
+    Returns:
+        dict: See `merge_clean_rows`.
+    """
+    source = f"""
+        SELECT stock_symbol, date,
+               SAFE_CAST(JSON_VALUE(bar, '$."1. open"') AS FLOAT64) AS open,
+               SAFE_CAST(JSON_VALUE(bar, '$."2. high"') AS FLOAT64) AS high,
+               SAFE_CAST(JSON_VALUE(bar, '$."3. low"') AS FLOAT64) AS low,
+               SAFE_CAST(JSON_VALUE(bar, '$."4. close"') AS FLOAT64) AS close,
+               SAFE_CAST(JSON_VALUE(bar, '$."5. volume"') AS INT64) AS volume
+        FROM (
+            SELECT r.stock_symbol, r.fetch_date, w.latest_date,
+                   SAFE_CAST(day AS DATE) AS date,
+                   r.raw_data['Time Series (Daily)'][day] AS bar
+            FROM `{raw_data_table_id}` r
+            LEFT JOIN UNNEST(@watermarks) w ON r.stock_symbol = w.stock_symbol
+            CROSS JOIN UNNEST(JSON_KEYS(r.raw_data['Time Series (Daily)'], 1)) AS day
+            WHERE r.stock_symbol IN UNNEST(@stock_symbols)
+              AND (w.latest_date IS NULL OR DATE(r.fetch_date) >= w.latest_date)
+        )
+        WHERE date IS NOT NULL AND (latest_date IS NULL OR date > latest_date)
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY stock_symbol, date ORDER BY fetch_date DESC) = 1
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            watermark_query_parameter(latest_dates),
+            bigquery.ArrayQueryParameter("stock_symbols", "STRING", list(stock_symbols)),
+        ]
+    )
+    return merge_clean_rows(client, source, cleaned_data_table_id, job_config)
+
+
+def resolve_transform(client, raw_data_table_id: str, transform: str = TRANSFORM_AUTO) -> str:
+    """
+    Picks where the raw payloads are parsed. Compact raw tables hold zlib
+    payloads that BigQuery cannot read, so they always use Python.
+
+    Raises:
+        ValueError: For an unknown transform, or 'sql' on a compact table.
+    """
+    if transform not in TRANSFORMS:
+        raise ValueError(f"Unknown transform '{transform}', expected one of {TRANSFORMS}")
+    compact = is_compact_raw_table(client, raw_data_table_id)
+    if transform == TRANSFORM_SQL and compact:
+        raise ValueError(f"{raw_data_table_id} stores compressed payloads; use transform 'python'")
+    if transform == TRANSFORM_AUTO:
+        return TRANSFORM_PYTHON if compact else TRANSFORM_SQL
+    return transform
+
+
+def upsert_clean_chunks(client, cleaned_data_table_id: str, chunks) -> dict:
+    """
+    Loads the chunks into a staging table and upserts them with one MERGE.
 
     Args:
         client: BigQuery client instance.
-        results: The query results from the raw data table.
-        cleaned_data_table_id: The BigQuery table ID where the cleaned data will be inserted.
+        cleaned_data_table_id: The table to upsert into.
+        chunks: Arrow tables from `iter_clean_chunks`.
+
+    Returns:
+        dict: Rows staged per symbol and the MERGE counts.
     """
-    rows_to_insert = []
-    
-    for row in results:
-        stock_symbol = row.stock_symbol
-        raw_data_str = row.raw_data  # raw_data is expected to be in JSON format
+    staged = {}
+    staging_table_id = None
+    try:
+        for table in chunks:
+            if staging_table_id is None:
+                staging_table_id = create_staging_table(client, cleaned_data_table_id)
+            load_arrow_table(client, staging_table_id, table)
+            symbols, counts = np.unique(table.column("stock_symbol").to_numpy(zero_copy_only=False),
+                                        return_counts=True)
+            for symbol, count in zip(symbols, counts):
+                staged[symbol] = staged.get(symbol, 0) + int(count)
 
-        # Parse the JSON-like structure of raw_data_str
-        time_series = raw_data_str.get("Time Series (Daily)", {})
-        
-        for date, daily_data in time_series.items():
-            cleaned_row = {
-                "stock_symbol": stock_symbol,
-                "date": date,
-                "open": float(daily_data["1. open"]),
-                "high": float(daily_data["2. high"]),
-                "low": float(daily_data["3. low"]),
-                "close": float(daily_data["4. close"]),
-                "volume": int(daily_data["5. volume"]),
-            }
-            rows_to_insert.append(cleaned_row)
-    
-    # Insert cleaned rows into BigQuery
-    errors = client.insert_rows_json(cleaned_data_table_id, rows_to_insert)
-    
-    if errors:
-        logging.error(f"Encountered errors while inserting rows: {errors}")
-        raise HTTPException(status_code=500, detail=f"Error inserting rows: {errors}")
-    
-    logging.info("Cleaned data successfully inserted.")
-    return {"status": "success", "message": "Cleaned data successfully inserted."}
-
-
-def fetch_and_insert_historical_data(client, raw_data_table_id: str, cleaned_data_table_id: str, stock_symbol: str):
-    """
-    Fetches historical stock data for a specific stock symbol and inserts all records into BigQuery.
-    """
-    # Your existing function to fetch and insert all historical data
-    logging.info(f"Fetching historical data for {stock_symbol}")
-    
-    # Fetch raw data
-    query = f"""
-        SELECT stock_symbol, raw_data
-        FROM `{raw_data_table_id}`
-        WHERE stock_symbol = @stock_symbol
+        if staging_table_id is None:
+            return {"staged": staged, "inserted": 0, "updated": 0, "affected": 0}
+        return {"staged": staged,
+                **merge_staged_rows(client, staging_table_id, cleaned_data_table_id)}
+    finally:
+        if staging_table_id is not None:
+            client.delete_table(staging_table_id, not_found_ok=True)
+
+
+def clean_since(client, raw_data_table_id: str, cleaned_data_table_id: str,
+                latest_dates: dict, stock_symbols: list,
+                chunk_rows: int = LOAD_CHUNK_ROWS, transform: str = TRANSFORM_AUTO) -> dict:
     """
-    query_job = client.query(query, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("stock_symbol", "STRING", stock_symbol)]
-    ))
-    results = query_job.result()
+    Upserts every date after each symbol's watermark in `latest_dates`.
+    Symbols without a watermark get their whole history.
 
-    # Clean and insert historical data into BigQuery
-    clean_and_insert_data(client, results, cleaned_data_table_id)
+    With the 'sql' transform this is one MERGE that parses the JSON inside
+    BigQuery. The 'python' transform, the fallback for compact raw tables,
+    reads the raw snapshots, loads them into a staging table in chunks of
+    `chunk_rows` bars and merges that.
 
-def fetch_and_insert_latest_data(client, raw_data_table_id: str, cleaned_data_table_id: str, stock_symbol: str):
+    Returns:
+        dict: The transform used, how many rows the MERGE inserted and
+        updated and, for 'python', rows staged per symbol ("staged").
     """
-    Fetches the latest stock data for a specific stock symbol and inserts the newest record into BigQuery.
+    transform = resolve_transform(client, raw_data_table_id, transform)
+    if transform == TRANSFORM_SQL:
+        result = transform_in_sql(client, raw_data_table_id, cleaned_data_table_id,
+                                  latest_dates, stock_symbols)
+    else:
+        results = fetch_raw_rows_since(client, raw_data_table_id, latest_dates, stock_symbols)
+        result = upsert_clean_chunks(client, cleaned_data_table_id,
+                                     iter_clean_chunks(results, latest_dates, chunk_rows))
+        result["staged"] = {symbol: result["staged"].get(symbol, 0)
+                            for symbol in stock_symbols}
+    result["transform"] = transform
+    return result
+
+
+def clean_all_stocks(client, raw_data_table_id: str, cleaned_data_table_id: str,
+                     stock_symbols: list, chunk_rows: int = LOAD_CHUNK_ROWS,
+                     lookback_days: int = 0, transform: str = TRANSFORM_AUTO) -> dict:
     """
-    logging.info(f"Fetching latest data for {stock_symbol}")
-    
-    query = f"""
-        SELECT stock_symbol, raw_data
-        FROM `{raw_data_table_id}`
-        WHERE stock_symbol = @stock_symbol
+    Catches every symbol up from its latest cleaned date to the newest raw
+    snapshot with a fixed number of BigQuery jobs: one watermark query and
+    then the jobs of `clean_since`.
+
+    Every date after the watermark is taken, not just the newest one, so a
+    skipped run leaves no hole. The MERGE makes runs idempotent, so a
+    repeated run leaves no duplicates either.
+
+    Args:
+        lookback_days (int): Also re-clean this many days before each
+            watermark, to repair holes or bars Alpha Vantage corrected.
+        transform (str): 'auto', 'sql' or 'python', see `resolve_transform`.
+
+    Returns:
+        dict: See `clean_since`.
     """
-    query_job = client.query(query, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("stock_symbol", "STRING", stock_symbol)]
-    ))
-    results = query_job.result()
+    latest_dates = get_latest_dates_in_bigquery(client, cleaned_data_table_id, stock_symbols)
+    if lookback_days:
+        latest_dates = {symbol: latest_date - timedelta(days=lookback_days)
+                        for symbol, latest_date in latest_dates.items()
+                        if latest_date is not None}
+
+    result = clean_since(client, raw_data_table_id, cleaned_data_table_id, latest_dates,
+                         stock_symbols, chunk_rows, transform)
+    logging.info(f"Cleaned stock data upserted: {result}")
+    return result
 
-    # Clean and insert the latest data into BigQuery
-    clean_and_insert_latest_data(client, results, cleaned_data_table_id)
 
 @app.post("/clean-stock-data/")
-def clean_stock_data():
+def clean_stock_data(lookback_days: int = 0, transform: str = TRANSFORM_AUTO,
+                     shard_count: int = 1, shard: Optional[int] = None,
+                     run_key: Optional[str] = None):
     """
-    Determines whether to fetch historical or daily stock data for TSLA, MSFT, AMZN, GOOGL, AAPL,
-    and inserts it into BigQuery.
+    Cleans new stock data for the symbol universe and upserts it into BigQuery.
+
+    Symbols without cleaned data get their whole history, the others every
+    date after their latest cleaned date, or `lookback_days` before it.
+    `transform` chooses between parsing in BigQuery ('sql') and in this
+    service ('python'); 'auto' uses SQL whenever the raw table allows it.
+
+    With `shard_count` above 1 the universe is split into hash shards.
+    This instance then leases and cleans open shards until none are left,
+    or only `shard` if given, so several instances can share the work.
+    `run_key` (default today's UTC date) decides when a shard is due again.
     """
     try:
-        # Load secrets and set up BigQuery client
-        secret_data = get_secret('bigquery-accout-secret')
-        service_account_info = json.loads(secret_data)
-        client = bigquery.Client.from_service_account_info(service_account_info)
+        # Shared BigQuery client and cached secrets
+        client = get_bigquery_client()
         
         # Fetch table IDs from secrets
         raw_data_table_id = get_secret("RAW_DATA_TABLE_ID")
         cleaned_data_table_id = get_secret("CLEANED_DATA_TABLE_ID")
+        universe = load_symbol_universe()
+
+        def process(symbols: list) -> dict:
+            return clean_all_stocks(client, raw_data_table_id, cleaned_data_table_id,
+                                    symbols, lookback_days=lookback_days,
+                                    transform=transform)
 
-        for stock_symbol in STOCK_SYMBOLS:
-            latest_date = get_latest_date_in_bigquery(client, cleaned_data_table_id, stock_symbol)
+        if shard_count > 1 or shard is not None:
+            sharded = run_sharded(client, lease_table_id(cleaned_data_table_id),
+                                  "clean_stocks", universe, shard_count, process,
+                                  run_key=run_key,
+                                  shards=None if shard is None else [shard])
+            return {"status": "success",
+                    "message": f"Cleaned {len(sharded['shards'])} of {shard_count} shards.",
+                    **sharded}
 
-            if latest_date is None:
-                # If no data exists, perform historical data fetch
-                fetch_and_insert_historical_data(client, raw_data_table_id, cleaned_data_table_id, stock_symbol)
-            else:
-                # Fetch and insert only the latest data
-                fetch_and_insert_latest_data(client, raw_data_table_id, cleaned_data_table_id, stock_symbol)
+        result = process(universe)
 
-        return {"status": "success", "message": "Stock data updated successfully."}
+        return {"status": "success", "message": "Stock data updated successfully.",
+                "transform": result["transform"],
+                "rows_staged": result.get("staged"),
+                "rows_inserted": result["inserted"],
+                "rows_updated": result["updated"]}
 
     except Exception as e:
         logging.error(f"An error occurred: {e}")
-        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+# Tabell av typen intraday_clean_watermarks i create_table/main.py, i samma
+# dataset som den rensade intradagstabellen
+INTRADAY_WATERMARK_TABLE = 'intraday_clean_watermarks'
+
+
+def intraday_watermark_table_id(cleaned_table_id: str,
+                                table: str = INTRADAY_WATERMARK_TABLE) -> str:
+    project, dataset, _ = cleaned_table_id.split('.')
+    return f"{project}.{dataset}.{table}"
+
+
+def get_intraday_watermarks(client, watermark_table_id: str) -> dict:
+    """
+    Returns the newest cleaned bar per (stock_symbol, interval).
+
+    Read from the small watermark table, one row per series, so the cost
+    does not grow with the history.
+    """
+    query = f"""
+        SELECT stock_symbol, interval, last_timestamp
+        FROM `{watermark_table_id}`
+    """
+    return {(row.stock_symbol, row.interval): row.last_timestamp
+            for row in client.query(query).result()}
+
+
+def seed_intraday_watermarks(client, cleaned_table_id: str, watermark_table_id: str):
+    """
+    Fills an empty watermark table from the cleaned table.
+
+    This reads the whole cleaned table once, on the first run after the
+    watermark table is created. After that `clean_intraday_data` keeps it
+    up to date.
+    """
+    query = f"""
+        INSERT INTO `{watermark_table_id}` (stock_symbol, interval, last_timestamp, updated_at)
+        SELECT stock_symbol, interval, MAX(timestamp), CURRENT_TIMESTAMP()
+        FROM `{cleaned_table_id}`
+        GROUP BY stock_symbol, interval
+    """
+    client.query(query).result()
+
+
+def intraday_read_since(watermarks: dict, now: datetime,
+                        new_series_days: int = 7) -> Optional[datetime]:
+    """
+    Lower bound on the raw bars to read.
+
+    The oldest watermark, so that every series is read from its own
+    watermark on, however long cleaning was paused. Series that have no
+    cleaned bars yet get at least `new_series_days` of history. None, which
+    reads everything, when the cleaned table is empty.
+    """
+    if not watermarks:
+        return None
+    return min(min(watermarks.values()), now - timedelta(days=new_series_days))
+
+
+def clean_intraday_data(client, raw_table_id: str, cleaned_table_id: str,
+                        new_series_days: int = 7) -> int:
+    """
+    Copies intraday bars newer than each series' watermark into the cleaned
+    table in one INSERT ... SELECT, dropping duplicate bars.
+
+    Both tables are partitioned on `timestamp`, and the read is limited to
+    partitions from the oldest watermark on, so each run only reads new
+    days. The insert and the watermark update run in one transaction, so
+    a failed run leaves both as they were.
+
+    Returns:
+        int: Number of bars inserted.
+    """
+    watermark_table_id = intraday_watermark_table_id(cleaned_table_id)
+    watermarks = get_intraday_watermarks(client, watermark_table_id)
+    if not watermarks:
+        seed_intraday_watermarks(client, cleaned_table_id, watermark_table_id)
+        watermarks = get_intraday_watermarks(client, watermark_table_id)
+
+    since = intraday_read_since(watermarks, datetime.now(timezone.utc), new_series_days)
+    rows = [bigquery.StructQueryParameter(
+        None,
+        bigquery.ScalarQueryParameter("stock_symbol", "STRING", symbol),
+        bigquery.ScalarQueryParameter("interval", "STRING", interval),
+        bigquery.ScalarQueryParameter("latest", "TIMESTAMP", latest))
+        for (symbol, interval), latest in watermarks.items()]
+
+    since_filter = "timestamp > @since" if since is not None else "TRUE"
+    query = f"""
+        BEGIN TRANSACTION;
+
+        INSERT INTO `{cleaned_table_id}`
+            (stock_symbol, interval, timestamp, open, high, low, close, volume)
+        SELECT r.stock_symbol, r.interval, r.timestamp,
+               ANY_VALUE(r.open), ANY_VALUE(r.high), ANY_VALUE(r.low),
+               ANY_VALUE(r.close), ANY_VALUE(r.volume)
+        FROM `{raw_table_id}` r
+        LEFT JOIN UNNEST(@watermarks) w
+            ON r.stock_symbol = w.stock_symbol AND r.interval = w.interval
+        WHERE r.{since_filter}
+          AND (w.latest IS NULL OR r.timestamp > w.latest)
+        GROUP BY r.stock_symbol, r.interval, r.timestamp;
+
+        -- Bara partitionerna efter det äldsta vattenmärket kan ha nya staplar
+        MERGE `{watermark_table_id}` T
+        USING (
+            SELECT stock_symbol, interval, MAX(timestamp) AS latest
+            FROM `{cleaned_table_id}`
+            WHERE {since_filter}
+            GROUP BY stock_symbol, interval
+        ) S
+        ON T.stock_symbol = S.stock_symbol AND T.interval = S.interval
+        WHEN MATCHED AND S.latest > T.last_timestamp THEN
+            UPDATE SET last_timestamp = S.latest, updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (stock_symbol, interval, last_timestamp, updated_at)
+            VALUES (S.stock_symbol, S.interval, S.latest, CURRENT_TIMESTAMP());
+
+        COMMIT TRANSACTION;
+    """
+    # Typen anges explicit eftersom listan är tom första gången
+    watermark_type = bigquery.StructQueryParameterType(
+        bigquery.ScalarQueryParameterType("STRING", name="stock_symbol"),
+        bigquery.ScalarQueryParameterType("STRING", name="interval"),
+        bigquery.ScalarQueryParameterType("TIMESTAMP", name="latest"))
+    query_parameters = [bigquery.ArrayQueryParameter("watermarks", watermark_type, rows)]
+    if since is not None:
+        query_parameters.append(bigquery.ScalarQueryParameter("since", "TIMESTAMP", since))
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+    job = client.query(query, job_config=job_config)
+    job.result()
+
+    # Ett skript rapporterar inte antalet rader själv; INSERT-satsen gör det
+    return sum(child.num_dml_affected_rows or 0
+               for child in client.list_jobs(parent_job=job.job_id)
+               if getattr(child, "statement_type", None) == "INSERT")
+
+
+@app.post("/clean-intraday-data/")
+def clean_intraday_stock_data(new_series_days: int = 7):
+    """
+    Moves new intraday bars from INTRADAY_TABLE_ID to CLEANED_INTRADAY_TABLE_ID.
+
+    `new_series_days` is how much history series without cleaned bars get.
+    """
+    try:
+        client = get_bigquery_client()
+        inserted = clean_intraday_data(client,
+                                       get_secret("INTRADAY_TABLE_ID"),
+                                       get_secret("CLEANED_INTRADAY_TABLE_ID"),
+                                       new_series_days)
+        return {"status": "success", "message": f"{inserted} intraday bars inserted."}
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+@app.get("/cache-stats/")
+def get_cache_stats():
+    """Hit/miss counters for the shared secret and client caches."""
+    return cache_stats()